@@ -1,61 +1,57 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from database import get_db, User, Channel, GroupSource, FundingRequest, PointsSettings, SystemSettings, PointsTransfer
+from telegram.error import TelegramError
+from database import User, Channel, GroupSource, FundingRequest, PointsSettings, SystemSettings, PointsTransfer
 from datetime import datetime
-from sqlalchemy import func, desc
-
+from settings_cache import settings_cache
+from user_cache import user_cache
+from admin_roster import admin_roster
+from points_service import reject_and_refund
+from stats_counters import read_stats
+from archive import recent_transfers, transfer_totals
+from callback_router import router
+from broadcast import create_broadcast, cancel_broadcast, progress_text, progress_keyboard
+from sqlalchemy import select, func, desc, tuple_
+
+@router.route("admin_stats", admin_only=True, answer=False)
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """عرض إحصائيات النظام"""
     query = update.callback_query
     await query.answer()
-    db = get_db()
+    # شاشات التقارير تقرأ من مجمع القراءة حتى لا تنافس مسار الكتابة
+    db = context.read_db
     
-    try:
-        # إحصائيات المستخدمين
-        total_users = db.query(User).count()
-        total_admins = db.query(User).filter_by(is_admin=True).count()
-        banned_users = db.query(User).filter_by(is_banned=True).count()
-        
-        # إحصائيات النقاط
-        total_points = db.query(func.sum(User.points)).scalar() or 0
-        
-        # إحصائيات الطلبات
-        total_requests = db.query(FundingRequest).count()
-        pending_requests = db.query(FundingRequest).filter_by(status='pending').count()
-        completed_requests = db.query(FundingRequest).filter_by(status='completed').count()
-        
-        # إحصائيات التحويلات
-        total_transfers = db.query(PointsTransfer).count()
-        
-        text = f"""
+    # صف عدادات واحد بدلاً من عشرة استعلامات COUNT/SUM على الجداول
+    stats = await read_stats(db)
+    
+    text = f"""
 📊 إحصائيات النظام:
 
 👥 المستخدمين:
-• إجمالي المستخدمين: {total_users}
-• المشرفين: {total_admins}
-• المحظورين: {banned_users}
+• إجمالي المستخدمين: {stats.users}
+• المشرفين: {stats.admins}
+• المحظورين: {stats.banned}
 
 ⭐ النقاط:
-• إجمالي النقاط: {total_points:,}
+• إجمالي النقاط: {stats.points:,}
 
 📋 طلبات التمويل:
-• إجمالي الطلبات: {total_requests}
-• قيد الانتظار: {pending_requests}
-• المكتملة: {completed_requests}
+• إجمالي الطلبات: {stats.requests}
+• قيد الانتظار: {stats.requests_pending}
+• المكتملة: {stats.requests_completed}
 
 🔄 التحويلات:
-• عدد التحويلات: {total_transfers}
+• عدد التحويلات: {stats.transfers}
 
 📢 القنوات والمجموعات:
-• القنوات المسجلة: {db.query(Channel).count()}
-• مجموعات المصدر: {db.query(GroupSource).count()}
+• القنوات المسجلة: {stats.channels}
+• مجموعات المصدر: {stats.groups}
 """
-        
-        keyboard = [[InlineKeyboardButton("🔙 رجوع للوحة", callback_data="admin_panel")]]
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        db.close()
+    
+    keyboard = [[InlineKeyboardButton("🔙 رجوع للوحة", callback_data="admin_panel")]]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
+@router.route("admin_users", admin_only=True, answer=False)
 async def admin_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إدارة المستخدمين"""
     query = update.callback_query
@@ -80,59 +76,88 @@ async def admin_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
+USERS_PER_PAGE = 10
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+def _users_page_data(page: int, direction: str, user) -> str:
+    """callback_data لصفحة مستخدمين: رقم الصفحة للعرض + مؤشر (created_at, id) لآخر صف شوهد"""
+    return f"show_all_users_{page}_{direction}_{user.created_at.strftime(CURSOR_FORMAT)}_{user.id}"
+
+@router.route("show_all_users_", prefix=True, admin_only=True, answer=False)
 async def show_all_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """عرض جميع المستخدمين"""
+    """عرض جميع المستخدمين
+
+    ترقيم بالمؤشر (keyset) على (created_at, id): كل صفحة تبدأ من آخر صف في الصفحة السابقة
+    عبر الفهرس، فتكلفة الصفحة 10,000 مثل الصفحة الأولى.
+    """
     query = update.callback_query
     await query.answer()
     
-    page = 1
-    if query.data.startswith("show_all_users_"):
-        try:
-            page = int(query.data.split("_")[3])
-        except:
-            page = 1
-    
-    db = get_db()
+    # show_all_users_{page}[_{n|p}_{created_at}_{id}]
+    page, direction, cursor = 1, None, None
+    parts = query.data.split("_")
     try:
-        # حساب الصفحات
-        users_per_page = 10
-        total_users = db.query(User).count()
-        total_pages = (total_users + users_per_page - 1) // users_per_page
-        
-        # جلب المستخدمين للصفحة الحالية
-        offset = (page - 1) * users_per_page
-        users = db.query(User).order_by(User.created_at.desc()).offset(offset).limit(users_per_page).all()
-        
-        text = f"👥 جميع المستخدمين (الصفحة {page} من {total_pages}):\n\n"
-        
-        for i, user in enumerate(users, 1):
-            status = "🚫" if user.is_banned else "✅"
-            admin = "👑" if user.is_admin else ""
-            text += f"{offset + i}. {admin} {user.first_name} (@{user.username or 'لا يوجد'})\n"
-            text += f"   🆔: {user.user_id} | ⭐: {user.points} | {status}\n"
-            text += f"   📅: {user.created_at.strftime('%Y-%m-%d')}\n\n"
-        
-        # أزرار التنقل بين الصفحات
-        keyboard = []
-        nav_buttons = []
-        
-        if page > 1:
-            nav_buttons.append(InlineKeyboardButton("◀️ السابق", callback_data=f"show_all_users_{page-1}"))
-        
-        nav_buttons.append(InlineKeyboardButton(f"📄 {page}/{total_pages}", callback_data="current_page"))
-        
-        if page < total_pages:
-            nav_buttons.append(InlineKeyboardButton("▶️ التالي", callback_data=f"show_all_users_{page+1}"))
-        
-        if nav_buttons:
-            keyboard.append(nav_buttons)
-        
-        keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data="admin_users")])
-        
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        db.close()
+        page = int(parts[3])
+        if len(parts) == 7:
+            direction = parts[4]
+            cursor = (datetime.strptime(parts[5], CURSOR_FORMAT), int(parts[6]))
+    except (IndexError, ValueError):
+        page, direction, cursor = 1, None, None
+    
+    db = context.read_db
+    # العدد التقريبي من عدادات الإحصائيات بدلاً من COUNT(*) مع كل ضغطة
+    stats = await read_stats(db)
+    total_pages = max(1, (stats.users + USERS_PER_PAGE - 1) // USERS_PER_PAGE)
+    
+    key = tuple_(User.created_at, User.id)
+    stmt = select(User)
+    if direction == 'p':
+        # الصفحة السابقة: الصفوف الأحدث من المؤشر بترتيب تصاعدي ثم نعكسها
+        stmt = stmt.where(key > cursor).order_by(User.created_at.asc(), User.id.asc())
+    else:
+        if cursor is not None:
+            stmt = stmt.where(key < cursor)
+        stmt = stmt.order_by(User.created_at.desc(), User.id.desc())
+    # صف إضافي لمعرفة وجود صفحة بعدها
+    users = (await db.scalars(stmt.limit(USERS_PER_PAGE + 1))).all()
+    more = len(users) > USERS_PER_PAGE
+    users = users[:USERS_PER_PAGE]
+    if direction == 'p':
+        users.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = cursor is not None, more
+    
+    text = f"👥 جميع المستخدمين (الصفحة {page} من ~{total_pages}):\n\n"
+    
+    offset = (page - 1) * USERS_PER_PAGE
+    for i, user in enumerate(users, 1):
+        status = "🚫" if user.is_banned else "✅"
+        admin = "👑" if user.is_admin else ""
+        text += f"{offset + i}. {admin} {user.first_name} (@{user.username or 'لا يوجد'})\n"
+        text += f"   🆔: {user.user_id} | ⭐: {user.points} | {status}\n"
+        text += f"   📅: {user.created_at.strftime('%Y-%m-%d')}\n\n"
+    
+    # أزرار التنقل بين الصفحات
+    keyboard = []
+    nav_buttons = []
+    
+    if has_prev and users and page > 1:
+        nav_buttons.append(InlineKeyboardButton("◀️ السابق", callback_data=_users_page_data(page - 1, 'p', users[0])))
+    
+    nav_buttons.append(InlineKeyboardButton(f"📄 {page}/~{total_pages}", callback_data="current_page"))
+    
+    if has_next and users:
+        nav_buttons.append(InlineKeyboardButton("▶️ التالي", callback_data=_users_page_data(page + 1, 'n', users[-1])))
+    
+    if nav_buttons:
+        keyboard.append(nav_buttons)
+    
+    keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data="admin_users")])
+    
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
+@router.route("admin_admins", admin_only=True, answer=False)
 async def admin_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إدارة المشرفين"""
     query = update.callback_query
@@ -153,28 +178,31 @@ async def admin_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
+@router.route("list_admins", admin_only=True, answer=False)
 async def list_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """عرض قائمة المشرفين"""
     query = update.callback_query
     await query.answer()
-    db = get_db()
-    
-    try:
-        admins = db.query(User).filter_by(is_admin=True).order_by(User.created_at).all()
-        
-        if not admins:
-            text = "👑 لا يوجد مشرفين حالياً."
-        else:
-            text = "👑 قائمة المشرفين:\n\n"
-            for i, admin in enumerate(admins, 1):
-                text += f"{i}. {admin.first_name} (@{admin.username or 'لا يوجد'})\n"
-                text += f"   🆔: {admin.user_id} | 📅: {admin.created_at.strftime('%Y-%m-%d')}\n\n"
-        
-        keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="admin_admins")]]
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        db.close()
+    db = context.db
+    
+    admins = await admin_roster.get(db)
+    
+    if not admins:
+        text = "👑 لا يوجد مشرفين حالياً."
+    else:
+        text = "👑 قائمة المشرفين:\n\n"
+        for i, admin in enumerate(admins, 1):
+            text += f"{i}. {admin.first_name} (@{admin.username or 'لا يوجد'})\n"
+            text += f"   🆔: {admin.user_id} | 📅: {admin.created_at.strftime('%Y-%m-%d')}\n"
+            failure = admin_roster.failures.get(admin.user_id)
+            if failure:
+                text += f"   ⚠️ لا تصله الإشعارات ({failure[0]} مرة): {failure[1]}\n"
+            text += "\n"
+    
+    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="admin_admins")]]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
+@router.route("admin_channels", admin_only=True, answer=False)
 async def admin_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إدارة القنوات"""
     query = update.callback_query
@@ -196,6 +224,7 @@ async def admin_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
+@router.route("admin_groups", admin_only=True, answer=False)
 async def admin_groups(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إدارة المجموعات"""
     query = update.callback_query
@@ -216,56 +245,55 @@ async def admin_groups(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
+@router.route("admin_requests", admin_only=True, answer=False)
 async def admin_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """عرض طلبات التمويل"""
     query = update.callback_query
     await query.answer()
-    db = get_db()
+    db = context.db
+    
+    # جلب الطلبات المعلقة
+    pending_requests = (await db.scalars(select(FundingRequest).filter_by(status='pending').order_by(FundingRequest.created_at.desc()).limit(10))).all()
+    
+    if not pending_requests:
+        text = "✅ لا توجد طلبات معلقة حالياً."
+    else:
+        text = "📋 طلبات التمويل المعلقة:\n\n"
+        users = await user_cache.get_many(db, [req.user_id for req in pending_requests])
+        for req in pending_requests:
+            user = users.get(req.user_id)
+            username = user.first_name if user else "مجهول"
+            
+            text += f"• #{req.id} - {username}\n"
+            text += f"  👥 {req.requested_members} عضو | 💰 {req.points_cost} نقطة\n"
+            text += f"  📢 {req.target_channel}\n"
+            text += f"  🕒 {req.created_at.strftime('%Y-%m-%d %H:%M')}\n\n"
+            
+            # أزرار الموافقة/الرفض
+            text += f"  [✅](approve_request_{req.id}) [❌](reject_request_{req.id})\n\n"
     
-    try:
-        # جلب الطلبات المعلقة
-        pending_requests = db.query(FundingRequest).filter_by(status='pending').order_by(FundingRequest.created_at.desc()).limit(10).all()
-        
-        if not pending_requests:
-            text = "✅ لا توجد طلبات معلقة حالياً."
-        else:
-            text = "📋 طلبات التمويل المعلقة:\n\n"
-            for req in pending_requests:
-                user = db.query(User).filter_by(user_id=req.user_id).first()
-                username = user.first_name if user else "مجهول"
-                
-                text += f"• #{req.id} - {username}\n"
-                text += f"  👥 {req.requested_members} عضو | 💰 {req.points_cost} نقطة\n"
-                text += f"  📢 {req.target_channel}\n"
-                text += f"  🕒 {req.created_at.strftime('%Y-%m-%d %H:%M')}\n\n"
-                
-                # أزرار الموافقة/الرفض
-                text += f"  [✅](approve_request_{req.id}) [❌](reject_request_{req.id})\n\n"
-        
-        keyboard = [
-            [InlineKeyboardButton("🔄 تحديث", callback_data="admin_requests")],
-            [InlineKeyboardButton("📊 جميع الطلبات", callback_data="all_requests")],
-            [InlineKeyboardButton("🔙 رجوع للوحة", callback_data="admin_panel")]
-        ]
-        
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
-    finally:
-        db.close()
+    keyboard = [
+        [InlineKeyboardButton("🔄 تحديث", callback_data="admin_requests")],
+        [InlineKeyboardButton("📊 جميع الطلبات", callback_data="all_requests")],
+        [InlineKeyboardButton("🔙 رجوع للوحة", callback_data="admin_panel")]
+    ]
+    
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
+@router.route("admin_system", admin_only=True, answer=False)
 async def admin_system(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إعدادات النظام"""
     query = update.callback_query
     await query.answer()
-    db = get_db()
+    db = context.db
     
-    try:
-        settings = db.query(SystemSettings).first()
-        if not settings:
-            settings = SystemSettings()
-            db.add(settings)
-            db.commit()
-        
-        text = f"""
+    settings = await db.scalar(select(SystemSettings).limit(1))
+    if not settings:
+        settings = SystemSettings()
+        db.add(settings)
+        await db.flush()
+    
+    text = f"""
 ⚙️ إعدادات النظام:
 
 🔧 وضع الصيانة: {'✅ مفعل' if settings.maintenance_mode else '❌ معطل'}
@@ -274,37 +302,35 @@ async def admin_system(update: Update, context: ContextTypes.DEFAULT_TYPE):
 🔄 تحويل النقاط: {'✅ مفعل' if settings.transfer_enabled else '❌ معطل'}
 💸 عمولة التحويل: {settings.transfer_fee_percent}%
 """
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("🔧 تفعيل/تعطيل الصيانة", callback_data="toggle_maintenance"),
-                InlineKeyboardButton("✏️ تعديل رسالة الصيانة", callback_data="edit_maintenance_msg")
-            ],
-            [
-                InlineKeyboardButton("🔄 تفعيل/تعطيل التحويل", callback_data="toggle_transfer"),
-                InlineKeyboardButton("💰 تعديل عمولة التحويل", callback_data="edit_transfer_fee")
-            ],
-            [InlineKeyboardButton("🔙 رجوع للوحة", callback_data="admin_panel")]
-        ]
-        
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        db.close()
+    
+    keyboard = [
+        [
+            InlineKeyboardButton("🔧 تفعيل/تعطيل الصيانة", callback_data="toggle_maintenance"),
+            InlineKeyboardButton("✏️ تعديل رسالة الصيانة", callback_data="edit_maintenance_msg")
+        ],
+        [
+            InlineKeyboardButton("🔄 تفعيل/تعطيل التحويل", callback_data="toggle_transfer"),
+            InlineKeyboardButton("💰 تعديل عمولة التحويل", callback_data="edit_transfer_fee")
+        ],
+        [InlineKeyboardButton("🔙 رجوع للوحة", callback_data="admin_panel")]
+    ]
+    
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
+@router.route("admin_points", admin_only=True, answer=False)
 async def admin_points(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إعدادات النقاط"""
     query = update.callback_query
     await query.answer()
-    db = get_db()
+    db = context.db
     
-    try:
-        settings = db.query(PointsSettings).first()
-        if not settings:
-            settings = PointsSettings()
-            db.add(settings)
-            db.commit()
-        
-        text = f"""
+    settings = await db.scalar(select(PointsSettings).limit(1))
+    if not settings:
+        settings = PointsSettings()
+        db.add(settings)
+        await db.flush()
+    
+    text = f"""
 ⭐ إعدادات النقاط:
 
 • سعر العضو الواحد: {settings.points_per_member} نقطة
@@ -315,35 +341,31 @@ async def admin_points(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 آخر تحديث: {settings.updated_at.strftime('%Y-%m-%d %H:%M')}
 """
-        
-        keyboard = [
-            [InlineKeyboardButton("✏️ تعديل الإعدادات", callback_data="edit_points_settings")],
-            [InlineKeyboardButton("🔙 رجوع للوحة", callback_data="admin_panel")]
-        ]
-        
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        db.close()
+    
+    keyboard = [
+        [InlineKeyboardButton("✏️ تعديل الإعدادات", callback_data="edit_points_settings")],
+        [InlineKeyboardButton("🔙 رجوع للوحة", callback_data="admin_panel")]
+    ]
+    
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
+@router.route("admin_transfer", admin_only=True, answer=False)
 async def admin_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إعدادات التحويل"""
     query = update.callback_query
     await query.answer()
-    db = get_db()
+    db = context.db
     
-    try:
-        settings = db.query(SystemSettings).first()
-        if not settings:
-            settings = SystemSettings()
-            db.add(settings)
-            db.commit()
-        
-        # إحصائيات التحويلات
-        total_transfers = db.query(PointsTransfer).count() or 0
-        total_amount = db.query(func.sum(PointsTransfer.amount)).scalar() or 0
-        total_fees = db.query(func.sum(PointsTransfer.fee_amount)).scalar() or 0
-        
-        text = f"""
+    settings = await db.scalar(select(SystemSettings).limit(1))
+    if not settings:
+        settings = SystemSettings()
+        db.add(settings)
+        await db.flush()
+    
+    # إحصائيات التحويلات (الجدول الساخن + الأرشيف) من مجمع القراءة
+    total_transfers, total_amount, total_fees = await transfer_totals(context.read_db)
+    
+    text = f"""
 🔄 إعدادات تحويل النقاط:
 
 📊 الإحصائيات:
@@ -355,21 +377,20 @@ async def admin_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • التحويل مفعل: {'✅ نعم' if settings.transfer_enabled else '❌ لا'}
 • نسبة العمولة: {settings.transfer_fee_percent}%
 """
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ تفعيل التحويل", callback_data="enable_transfer"),
-                InlineKeyboardButton("❌ تعطيل التحويل", callback_data="disable_transfer")
-            ],
-            [InlineKeyboardButton("💰 تعديل العمولة", callback_data="edit_transfer_fee_menu")],
-            [InlineKeyboardButton("📋 سجل التحويلات", callback_data="view_transfers_log")],
-            [InlineKeyboardButton("🔙 رجوع للوحة", callback_data="admin_panel")]
-        ]
-        
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        db.close()
+    
+    keyboard = [
+        [
+            InlineKeyboardButton("✅ تفعيل التحويل", callback_data="enable_transfer"),
+            InlineKeyboardButton("❌ تعطيل التحويل", callback_data="disable_transfer")
+        ],
+        [InlineKeyboardButton("💰 تعديل العمولة", callback_data="edit_transfer_fee_menu")],
+        [InlineKeyboardButton("📋 سجل التحويلات", callback_data="view_transfers_log")],
+        [InlineKeyboardButton("🔙 رجوع للوحة", callback_data="admin_panel")]
+    ]
+    
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
+@router.route("admin_broadcast", admin_only=True, answer=False)
 async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إرسال رسالة للجميع"""
     query = update.callback_query
@@ -391,46 +412,71 @@ async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
+@router.route("broadcast_text", "broadcast_with_points", admin_only=True, answer=False)
+async def broadcast_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """طلب نص البث (ومقدار النقاط للرسالة مع نقاط)"""
+    query = update.callback_query
+    await query.answer()
+    with_points = query.data == "broadcast_with_points"
+    
+    if with_points:
+        text = (
+            "⭐ رسالة مع نقاط\n\n"
+            "ارسل عدد النقاط في السطر الأول ثم نص الرسالة:\n"
+            "مثال:\n`10`\n`هدية لكل المستخدمين!`"
+        )
+    else:
+        text = "📝 رسالة نصية\n\nارسل نص الرسالة التي تريد إرسالها لكل المستخدمين:"
+    
+    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="admin_broadcast")]]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    context.user_data['awaiting_broadcast'] = {'points': with_points}
+
+@router.route("cancel_broadcast_", prefix=True, admin_only=True, answer=False)
+async def cancel_broadcast_job(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """إيقاف بث جارٍ"""
+    query = update.callback_query
+    job_id = int(query.data.split("_")[2])
+    if await cancel_broadcast(context.db, job_id):
+        await query.answer(f"⛔ سيتوقف البث #{job_id}", show_alert=True)
+    else:
+        await query.answer("⚠️ البث انتهى بالفعل", show_alert=True)
+
+@router.route("toggle_maintenance", admin_only=True, answer=False)
 async def toggle_maintenance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """تفعيل/تعطيل وضع الصيانة"""
     query = update.callback_query
     await query.answer()
-    db = get_db()
+    db = context.db
     
-    try:
-        settings = db.query(SystemSettings).first()
-        if settings:
-            settings.maintenance_mode = not settings.maintenance_mode
-            settings.updated_at = datetime.now()
-            settings.updated_by = query.from_user.id
-            db.commit()
-        
-        status = "مفعل" if settings.maintenance_mode else "معطل"
-        await query.answer(f"✅ تم {status} وضع الصيانة", show_alert=True)
-        await admin_system(update, context)
-    finally:
-        db.close()
+    settings = await db.scalar(select(SystemSettings).limit(1))
+    if settings:
+        settings = await settings_cache.update_system(
+            db, query.from_user.id, maintenance_mode=not settings.maintenance_mode
+        )
+    
+    status = "مفعل" if settings.maintenance_mode else "معطل"
+    await query.answer(f"✅ تم {status} وضع الصيانة", show_alert=True)
+    await admin_system(update, context)
 
+@router.route("toggle_transfer", admin_only=True, answer=False)
 async def toggle_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """تفعيل/تعطيل تحويل النقاط"""
     query = update.callback_query
     await query.answer()
-    db = get_db()
+    db = context.db
     
-    try:
-        settings = db.query(SystemSettings).first()
-        if settings:
-            settings.transfer_enabled = not settings.transfer_enabled
-            settings.updated_at = datetime.now()
-            settings.updated_by = query.from_user.id
-            db.commit()
-        
-        status = "تفعيل" if settings.transfer_enabled else "تعطيل"
-        await query.answer(f"✅ تم {status} تحويل النقاط", show_alert=True)
-        await admin_transfer(update, context)
-    finally:
-        db.close()
+    settings = await db.scalar(select(SystemSettings).limit(1))
+    if settings:
+        settings = await settings_cache.update_system(
+            db, query.from_user.id, transfer_enabled=not settings.transfer_enabled
+        )
+    
+    status = "تفعيل" if settings.transfer_enabled else "تعطيل"
+    await query.answer(f"✅ تم {status} تحويل النقاط", show_alert=True)
+    await admin_transfer(update, context)
 
+@router.route("edit_transfer_fee_menu", admin_only=True, answer=False)
 async def edit_transfer_fee_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """تعديل عمولة التحويل"""
     query = update.callback_query
@@ -445,6 +491,7 @@ async def edit_transfer_fee_menu(update: Update, context: ContextTypes.DEFAULT_T
     
     context.user_data['awaiting_transfer_fee'] = True
 
+@router.route("edit_maintenance_msg", admin_only=True, answer=False)
 async def edit_maintenance_msg(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """تعديل رسالة الصيانة"""
     query = update.callback_query
@@ -458,97 +505,54 @@ async def edit_maintenance_msg(update: Update, context: ContextTypes.DEFAULT_TYP
     
     context.user_data['awaiting_maintenance_msg'] = True
 
+@router.route("view_transfers_log", admin_only=True, answer=False)
 async def view_transfers_log(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """عرض سجل التحويلات"""
     query = update.callback_query
     await query.answer()
-    db = get_db()
+    db = context.read_db
+    
+    # جلب آخر 10 تحويلات
+    transfers = await recent_transfers(db, limit=10)
+    
+    if not transfers:
+        text = "📋 لا توجد تحويلات سابقة."
+    else:
+        text = "📋 آخر 10 تحويلات:\n\n"
+        users = await user_cache.get_many(
+            db, [t.from_user_id for t in transfers] + [t.to_user_id for t in transfers]
+        )
+        for transfer in transfers:
+            from_user = users.get(transfer.from_user_id)
+            to_user = users.get(transfer.to_user_id)
+            
+            from_name = from_user.first_name if from_user else "مجهول"
+            to_name = to_user.first_name if to_user else "مجهول"
+            
+            text += (
+                f"🔄 التحويل #{transfer.id}\n"
+                f"📤 من: {from_name} ({transfer.from_user_id})\n"
+                f"📥 إلى: {to_name} ({transfer.to_user_id})\n"
+                f"💰 المبلغ: {transfer.amount} نقطة\n"
+                f"💸 العمولة: {transfer.fee_amount} نقطة ({transfer.fee_percent}%)\n"
+                f"🕒 الوقت: {transfer.transfer_date.strftime('%Y-%m-%d %H:%M')}\n"
+                f"────────────────────\n"
+            )
     
-    try:
-        # جلب آخر 10 تحويلات
-        transfers = db.query(PointsTransfer).order_by(desc(PointsTransfer.transfer_date)).limit(10).all()
-        
-        if not transfers:
-            text = "📋 لا توجد تحويلات سابقة."
-        else:
-            text = "📋 آخر 10 تحويلات:\n\n"
-            for transfer in transfers:
-                from_user = db.query(User).filter_by(user_id=transfer.from_user_id).first()
-                to_user = db.query(User).filter_by(user_id=transfer.to_user_id).first()
-                
-                from_name = from_user.first_name if from_user else "مجهول"
-                to_name = to_user.first_name if to_user else "مجهول"
-                
-                text += (
-                    f"🔄 التحويل #{transfer.id}\n"
-                    f"📤 من: {from_name} ({transfer.from_user_id})\n"
-                    f"📥 إلى: {to_name} ({transfer.to_user_id})\n"
-                    f"💰 المبلغ: {transfer.amount} نقطة\n"
-                    f"💸 العمولة: {transfer.fee_amount} نقطة ({transfer.fee_percent}%)\n"
-                    f"🕒 الوقت: {transfer.transfer_date.strftime('%Y-%m-%d %H:%M')}\n"
-                    f"────────────────────\n"
-                )
-        
-        keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="admin_transfer")]]
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        db.close()
-
-async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """معالجة استدعاءات الإدارة"""
-    query = update.callback_query
-    await query.answer()
-    data = query.data
-    
-    if data == "admin_stats":
-        await admin_stats(update, context)
-    elif data == "admin_users":
-        await admin_users(update, context)
-    elif data.startswith("show_all_users_"):
-        await show_all_users(update, context)
-    elif data == "admin_admins":
-        await admin_admins(update, context)
-    elif data == "list_admins":
-        await list_admins(update, context)
-    elif data == "admin_channels":
-        await admin_channels(update, context)
-    elif data == "admin_groups":
-        await admin_groups(update, context)
-    elif data == "admin_requests":
-        await admin_requests(update, context)
-    elif data == "admin_system":
-        await admin_system(update, context)
-    elif data == "admin_points":
-        await admin_points(update, context)
-    elif data == "admin_transfer":
-        await admin_transfer(update, context)
-    elif data == "admin_broadcast":
-        await admin_broadcast(update, context)
-    elif data == "toggle_maintenance":
-        await toggle_maintenance(update, context)
-    elif data == "toggle_transfer":
-        await toggle_transfer(update, context)
-    elif data == "edit_transfer_fee_menu":
-        await edit_transfer_fee_menu(update, context)
-    elif data == "edit_maintenance_msg":
-        await edit_maintenance_msg(update, context)
-    elif data == "view_transfers_log":
-        await view_transfers_log(update, context)
-    elif data.startswith("approve_request_"):
-        await approve_funding_request(update, context)
-    elif data.startswith("reject_request_"):
-        await reject_funding_request(update, context)
+    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="admin_transfer")]]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
+@router.route("approve_request_", prefix=True, admin_only=True, answer=False)
 async def approve_funding_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """الموافقة على طلب تمويل"""
     query = update.callback_query
     await query.answer()
+    db = context.db
     
     try:
         request_id = int(query.data.split("_")[2])
-        db = get_db()
         
-        request = db.query(FundingRequest).filter_by(id=request_id).first()
+        request = await db.scalar(select(FundingRequest).filter_by(id=request_id).limit(1))
         if not request:
             await query.answer("❌ الطلب غير موجود!", show_alert=True)
             return
@@ -556,124 +560,156 @@ async def approve_funding_request(update: Update, context: ContextTypes.DEFAULT_
         request.status = 'approved'
         request.approved_by = query.from_user.id
         request.updated_at = datetime.now()
-        db.commit()
-        
-        # إعلام المستخدم
-        try:
-            user = db.query(User).filter_by(user_id=request.user_id).first()
-            if user:
-                await context.bot.send_message(
-                    user.user_id,
-                    f"✅ تمت الموافقة على طلبك #{request_id}\n"
-                    f"👥 سيتم البدء بإضافة {request.requested_members} عضو قريباً."
-                )
-        except:
-            pass
-        
-        await query.answer(f"✅ تمت الموافقة على الطلب #{request_id}", show_alert=True)
-        await admin_requests(update, context)
-        
+        await db.flush()
     except Exception as e:
+        # لا نترك تغييرات جزئية لتحفظها وحدة العمل
+        await db.rollback()
         await query.answer(f"❌ خطأ: {str(e)}", show_alert=True)
-    finally:
-        db.close()
+        return
+    
+    # إعلام المستخدم
+    try:
+        user = await user_cache.get(db, request.user_id)
+        if user:
+            await context.bot.send_message(
+                user.user_id,
+                f"✅ تمت الموافقة على طلبك #{request_id}\n"
+                f"👥 سيتم البدء بإضافة {request.requested_members} عضو قريباً."
+            )
+    except TelegramError:
+        pass
+    
+    # فشل تحديث الواجهة لا يلغي قرار المشرف
+    try:
+        await query.answer(f"✅ تمت الموافقة على الطلب #{request_id}", show_alert=True)
+        await admin_requests(update, context)
+    except TelegramError as e:
+        print(f"Error refreshing admin requests: {e}")
 
+@router.route("reject_request_", prefix=True, admin_only=True, answer=False)
 async def reject_funding_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """رفض طلب تمويل"""
     query = update.callback_query
     await query.answer()
+    db = context.db
     
     try:
         request_id = int(query.data.split("_")[2])
-        db = get_db()
         
-        request = db.query(FundingRequest).filter_by(id=request_id).first()
+        request = await db.scalar(select(FundingRequest).filter_by(id=request_id).limit(1))
         if not request:
             await query.answer("❌ الطلب غير موجود!", show_alert=True)
             return
         
-        # استرجاع النقاط للمستخدم
-        user = db.query(User).filter_by(user_id=request.user_id).first()
-        if user:
-            user.points += request.points_cost
-        
-        request.status = 'rejected'
-        request.approved_by = query.from_user.id
-        db.commit()
-        
-        # إعلام المستخدم
-        try:
-            await context.bot.send_message(
-                user.user_id,
-                f"❌ تم رفض طلبك #{request_id}\n"
-                f"💰 تم إرجاع {request.points_cost} نقطة لحسابك."
-            )
-        except:
-            pass
-        
-        await query.answer(f"❌ تم رفض الطلب #{request_id}", show_alert=True)
-        await admin_requests(update, context)
-        
+        # تغيير الحالة وإرجاع النقاط في خطوة واحدة مشروطة (الضغط المزدوج لا يعيد النقاط مرتين)
+        if not await reject_and_refund(db, request_id, query.from_user.id):
+            await query.answer(f"⚠️ لا يمكن رفض الطلب (الحالة: {request.status})", show_alert=True)
+            return
     except Exception as e:
+        # لا نترك تغييرات جزئية لتحفظها وحدة العمل
+        await db.rollback()
         await query.answer(f"❌ خطأ: {str(e)}", show_alert=True)
-    finally:
-        db.close()
+        return
+    
+    # إعلام المستخدم
+    try:
+        await context.bot.send_message(
+            request.user_id,
+            f"❌ تم رفض طلبك #{request_id}\n"
+            f"💰 تم إرجاع {request.points_cost} نقطة لحسابك."
+        )
+    except TelegramError:
+        pass
+    
+    # فشل تحديث الواجهة لا يلغي قرار المشرف
+    try:
+        await query.answer(f"❌ تم رفض الطلب #{request_id}", show_alert=True)
+        await admin_requests(update, context)
+    except TelegramError as e:
+        print(f"Error refreshing admin requests: {e}")
+
+# مفاتيح user_data التي تعني أن المشرف ينتظر إدخالاً نصياً
+ADMIN_INPUT_KEYS = ('awaiting_transfer_fee', 'awaiting_maintenance_msg', 'awaiting_broadcast')
+
+async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """معالجة مدخلات الإدارة؛ يرجع True إذا كانت الرسالة مدخلاً للوحة التحكم
 
-async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """معالجة مدخلات الإدارة"""
+    يستدعيها handle_message قبل تدفقات المستخدم: معالجان للرسائل النصية في نفس المجموعة
+    لا يعمل منهما إلا الأول.
+    """
+    if not any(key in context.user_data for key in ADMIN_INPUT_KEYS):
+        return False
     text = update.message.text.strip()
     user_id = update.effective_user.id
     
-    db = get_db()
-    try:
-        user = db.query(User).filter_by(user_id=user_id).first()
-        if not user or not user.is_admin:
-            return
-        
-        # معالجة عمولة التحويل
-        if 'awaiting_transfer_fee' in context.user_data:
-            try:
-                fee_percent = int(text)
-                
-                if fee_percent < 0 or fee_percent > 50:
-                    await update.message.reply_text("❌ النسبة يجب أن تكون بين 0 و 50!")
-                    return
-                
-                settings = db.query(SystemSettings).first()
-                if settings:
-                    old_fee = settings.transfer_fee_percent
-                    settings.transfer_fee_percent = fee_percent
-                    settings.updated_at = datetime.now()
-                    settings.updated_by = user_id
-                    db.commit()
-                    
-                    await update.message.reply_text(
-                        f"✅ تم تغيير عمولة التحويل من {old_fee}% إلى {fee_percent}%"
-                    )
-                
-                del context.user_data['awaiting_transfer_fee']
-                
-            except ValueError:
-                await update.message.reply_text("❌ الرجاء إدخال رقم صحيح!")
-        
-        # معالجة رسالة الصيانة
-        elif 'awaiting_maintenance_msg' in context.user_data:
-            new_message = text
+    db = context.db
+    user = await user_cache.get(db, user_id)
+    if not user or not user.is_admin:
+        return False
+    
+    # معالجة عمولة التحويل
+    if 'awaiting_transfer_fee' in context.user_data:
+        try:
+            fee_percent = int(text)
             
-            if not new_message:
-                await update.message.reply_text("❌ الرسالة لا يمكن أن تكون فارغة!")
-                return
+            if fee_percent < 0 or fee_percent > 50:
+                await update.message.reply_text("❌ النسبة يجب أن تكون بين 0 و 50!")
+                return True
             
-            settings = db.query(SystemSettings).first()
+            settings = await db.scalar(select(SystemSettings).limit(1))
             if settings:
-                settings.maintenance_message = new_message
-                settings.updated_at = datetime.now()
-                settings.updated_by = user_id
-                db.commit()
+                old_fee = settings.transfer_fee_percent
+                await settings_cache.update_system(db, user_id, transfer_fee_percent=fee_percent)
                 
-                await update.message.reply_text(f"✅ تم تحديث رسالة الصيانة:\n\n{new_message}")
+                await update.message.reply_text(
+                    f"✅ تم تغيير عمولة التحويل من {old_fee}% إلى {fee_percent}%"
+                )
             
-            del context.user_data['awaiting_maintenance_msg']
+            del context.user_data['awaiting_transfer_fee']
+            
+        except ValueError:
+            await update.message.reply_text("❌ الرجاء إدخال رقم صحيح!")
+    
+    # معالجة رسالة الصيانة
+    elif 'awaiting_maintenance_msg' in context.user_data:
+        new_message = text
+        
+        if not new_message:
+            await update.message.reply_text("❌ الرسالة لا يمكن أن تكون فارغة!")
+            return True
+        
+        settings = await db.scalar(select(SystemSettings).limit(1))
+        if settings:
+            await settings_cache.update_system(db, user_id, maintenance_message=new_message)
+            
+            await update.message.reply_text(f"✅ تم تحديث رسالة الصيانة:\n\n{new_message}")
+        
+        del context.user_data['awaiting_maintenance_msg']
+    
+    # معالجة نص البث
+    elif 'awaiting_broadcast' in context.user_data:
+        points = 0
+        message = text
+        if context.user_data['awaiting_broadcast']['points']:
+            first_line, _, message = text.partition('\n')
+            if not first_line.strip().isdigit() or not message.strip():
+                await update.message.reply_text("❌ الصيغة: عدد النقاط في السطر الأول ثم نص الرسالة")
+                return True
+            points = int(first_line)
+            message = message.strip()
+        
+        if not message:
+            await update.message.reply_text("❌ الرسالة لا يمكن أن تكون فارغة!")
+            return True
+        
+        # عدد المستلمين التقريبي من عدادات الإحصائيات لعرض النسبة
+        stats = await read_stats(context.read_db)
+        job = await create_broadcast(db, user_id, message, points=points, total=stats.users)
+        progress = await update.message.reply_text(progress_text(job), reply_markup=progress_keyboard(job))
+        job.progress_chat_id = progress.chat_id
+        job.progress_message_id = progress.message_id
+        
+        del context.user_data['awaiting_broadcast']
+    
+    return True
     
-    finally:
-        db.close()
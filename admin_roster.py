@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from sqlalchemy import event, select, inspect
+from sqlalchemy.orm import Session
+from telegram.error import TelegramError
+from config import Config
+from database import User
+from rate_limiter import ADMIN
+
+logger = logging.getLogger(__name__)
+
+# مفتاح session.info: تغير مشرف في هذه المعاملة فتُمسح القائمة بعد commit
+PENDING_KEY = 'admin_roster_pending'
+
+ADMIN_FIELDS = ('user_id', 'username', 'first_name', 'created_at')
+
+class AdminRoster:
+    """قائمة المشرفين في الذاكرة مع سجل فشل توصيل الإشعارات لكل مشرف
+
+    تُمسح بعد حفظ أي تغيير على مشرف في هذه العملية، ومدة الصلاحية تلتقط تغييرات
+    العمليات الأخرى.
+    """
+
+    def __init__(self, ttl: float = 300, concurrency: int = 10):
+        self.ttl = ttl
+        self._admins = None
+        self._expires = 0.0
+        self._lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # {user_id: (عدد مرات الفشل المتتالية، آخر خطأ، وقته)}
+        self.failures = {}
+
+    async def get(self, db) -> list:
+        """المشرفون مرتبون بتاريخ التسجيل"""
+        if self._admins is None or self._expires < time.monotonic():
+            async with self._lock:
+                if self._admins is None or self._expires < time.monotonic():
+                    rows = (await db.scalars(select(User).filter_by(is_admin=True).order_by(User.created_at))).all()
+                    self._admins = [
+                        SimpleNamespace(**{name: getattr(row, name) for name in ADMIN_FIELDS}) for row in rows
+                    ]
+                    self._expires = time.monotonic() + self.ttl
+        return self._admins
+
+    def invalidate(self):
+        self._admins = None
+
+    async def _send(self, bot, admin_id: int, text: str, kwargs: dict) -> bool:
+        async with self._semaphore:
+            try:
+                await bot.send_message(admin_id, text, rate_limit_args={'priority': ADMIN}, **kwargs)
+            except TelegramError as e:
+                count = self.failures.get(admin_id, (0,))[0] + 1
+                self.failures[admin_id] = (count, str(e), datetime.now())
+                logger.warning(f"فشل إشعار المشرف {admin_id} ({count} مرة متتالية): {e}")
+                return False
+        self.failures.pop(admin_id, None)
+        return True
+
+    async def notify(self, bot, db, text: str, **kwargs) -> tuple:
+        """إرسال نفس الرسالة لكل المشرفين معاً؛ يرجع (عدد الناجح، عدد الفاشل)"""
+        admins = await self.get(db)
+        results = await asyncio.gather(*[self._send(bot, admin.user_id, text, kwargs) for admin in admins])
+        sent = sum(results)
+        return sent, len(results) - sent
+
+admin_roster = AdminRoster(Config.ADMIN_ROSTER_TTL, Config.ADMIN_NOTIFY_CONCURRENCY)
+
+@event.listens_for(Session, 'before_flush')
+def _collect_admin_changes(session, flush_context, instances):
+    for obj in (*session.new, *session.deleted):
+        if isinstance(obj, User) and obj.is_admin:
+            session.info[PENDING_KEY] = True
+            return
+    for obj in session.dirty:
+        # تغير صلاحية الإشراف أو بيانات مشرف حالي (الاسم المعروض في القوائم)
+        if isinstance(obj, User) and (obj.is_admin or inspect(obj).attrs.is_admin.history.has_changes()):
+            session.info[PENDING_KEY] = True
+            return
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop(PENDING_KEY, False):
+        admin_roster.invalidate()
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    if previous_transaction.nested:
+        return
+    session.info.pop(PENDING_KEY, None)
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete, func, literal, union_all, or_
+from config import Config
+from database import FundingRequest, FundingRequestArchive, PointsTransfer, PointsTransferArchive, get_db
+
+logger = logging.getLogger(__name__)
+
+# حالات الطلب التي لن تتغير بعد الآن
+FINISHED_STATUSES = ('completed', 'failed', 'rejected')
+
+# ==================== النقل للأرشيف ====================
+async def _move(db, hot, archive, condition, batch_size: int) -> int:
+    """نقل دفعة من الجدول الساخن للأرشيف في نفس المعاملة وإرجاع عددها"""
+    ids = (await db.scalars(select(hot.id).where(condition).order_by(hot.id).limit(batch_size))).all()
+    if not ids:
+        return 0
+    columns = [column.name for column in hot.__table__.columns]
+    await db.execute(
+        insert(archive).from_select(
+            columns + ['archived_at'],
+            select(*[hot.__table__.c[name] for name in columns], literal(datetime.now()))
+            .where(hot.id.in_(ids)),
+        )
+    )
+    await db.execute(delete(hot).where(hot.id.in_(ids)).execution_options(synchronize_session=False))
+    return len(ids)
+
+async def archive_finished(session_factory=None, now: datetime = None) -> dict:
+    """نقل الطلبات المنتهية والتحويلات القديمة للأرشيف على دفعات
+
+    كل دفعة معاملة مستقلة حتى لا يُحجز قفل الكتابة طويلاً. الحذف بجمل مباشرة لا يمر
+    بمستمعي ORM، فعدادات الإحصائيات (التي تشمل الأرشيف) لا تتغير.
+    """
+    session_factory = session_factory or get_db
+    now = now or datetime.now()
+    jobs = {
+        'requests': (
+            FundingRequest, FundingRequestArchive,
+            (FundingRequest.status.in_(FINISHED_STATUSES)
+             & (FundingRequest.updated_at < now - timedelta(days=Config.ARCHIVE_REQUESTS_AFTER_DAYS))),
+        ),
+        'transfers': (
+            PointsTransfer, PointsTransferArchive,
+            PointsTransfer.transfer_date < now - timedelta(days=Config.ARCHIVE_TRANSFERS_AFTER_DAYS),
+        ),
+    }
+    moved = {}
+    for name, (hot, archive, condition) in jobs.items():
+        moved[name] = 0
+        while True:
+            db = session_factory()
+            try:
+                count = await _move(db, hot, archive, condition, Config.ARCHIVE_BATCH_SIZE)
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+            finally:
+                await db.close()
+            moved[name] += count
+            if count < Config.ARCHIVE_BATCH_SIZE:
+                break
+    return moved
+
+async def archive_periodically(interval: int = 6 * 3600):
+    """مهمة خلفية: أرشفة دورية"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            moved = await archive_finished()
+            if any(moved.values()):
+                logger.info(f"الأرشفة: {moved['requests']} طلب، {moved['transfers']} تحويل")
+        except Exception as e:
+            logger.error(f"خطأ في الأرشفة: {e}")
+
+# ==================== القراءة من الجدولين ====================
+def _both(hot, archive, columns, condition, order, limit):
+    """أحدث الصفوف من الجدول الساخن والأرشيف معاً
+
+    كل فرع مرتب ومحدود بنفسه (يستخدم فهرسه) ثم يُدمجان، فلا يُقرأ الأرشيف كله.
+    """
+    branches = []
+    for model in (hot, archive):
+        branch = select(*[getattr(model, name) for name in columns])
+        if condition is not None:
+            branch = branch.where(condition(model))
+        branches.append(select(branch.order_by(getattr(model, order).desc()).limit(limit).subquery()))
+    merged = union_all(*branches).subquery()
+    return select(merged).order_by(merged.c[order].desc()).limit(limit)
+
+REQUEST_COLUMNS = ('id', 'user_id', 'target_channel', 'target_type', 'requested_members',
+                   'points_cost', 'status', 'completed_members', 'created_at')
+TRANSFER_COLUMNS = ('id', 'from_user_id', 'to_user_id', 'amount', 'fee_percent', 'fee_amount',
+                    'net_amount', 'transfer_date')
+
+async def user_requests(db, user_id: int, limit: int = 5) -> list:
+    """آخر طلبات المستخدم من الجدولين"""
+    stmt = _both(FundingRequest, FundingRequestArchive, REQUEST_COLUMNS,
+                 lambda model: model.user_id == user_id, 'created_at', limit)
+    return (await db.execute(stmt)).all()
+
+async def recent_transfers(db, user_id: int = None, limit: int = 10) -> list:
+    """آخر التحويلات (للمستخدم أو للكل) من الجدولين"""
+    condition = None
+    if user_id is not None:
+        condition = lambda model: or_(model.from_user_id == user_id, model.to_user_id == user_id)
+    stmt = _both(PointsTransfer, PointsTransferArchive, TRANSFER_COLUMNS, condition, 'transfer_date', limit)
+    return (await db.execute(stmt)).all()
+
+async def transfer_totals(db) -> tuple:
+    """(عدد التحويلات، مجموع المبالغ، مجموع العمولات) للجدولين"""
+    totals = [0, 0, 0]
+    for model in (PointsTransfer, PointsTransferArchive):
+        row = (await db.execute(
+            select(func.count(), func.coalesce(func.sum(model.amount), 0), func.coalesce(func.sum(model.fee_amount), 0))
+        )).one()
+        totals = [total + value for total, value in zip(totals, row)]
+    return tuple(totals)
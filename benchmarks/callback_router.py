@@ -0,0 +1,68 @@
+"""قياس تكلفة توجيه ضغطة زر: سلسلة if/elif مقابل الموجه (قاموس + شجرة بادئات)
+
+الاستخدام:
+    python benchmarks/callback_router.py [عدد_المسارات] [عدد_الضغطات]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+from callback_router import CallbackRouter
+
+async def noop(update, context):
+    pass
+
+def build(routes: int):
+    """مسارات ثابتة وربعها ببادئات ذات معاملات، كما في لوحة الإدارة"""
+    exact = [f"screen_{i}" for i in range(routes - routes // 4)]
+    prefixes = [f"action_{i}_" for i in range(routes // 4)]
+    router = CallbackRouter()
+    for data in exact:
+        router.add(data, noop)
+    for data in prefixes:
+        router.add(data, noop, prefix=True)
+    # السلسلة القديمة: مقارنة بعد مقارنة بترتيب التسجيل (== للثابت وstartswith للبادئة)
+    chain = [(data, False) for data in exact] + [(data, True) for data in prefixes]
+    return router, chain, exact, prefixes
+
+def resolve_chain(chain, data):
+    for key, prefix in chain:
+        if (data.startswith(key) if prefix else data == key):
+            return key
+    return None
+
+def run(resolve, presses) -> float:
+    start = time.perf_counter()
+    for data in presses:
+        resolve(data)
+    return (time.perf_counter() - start) / len(presses) * 1e9
+
+def main():
+    routes = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    router, chain, exact, prefixes = build(routes)
+    random.seed(1)
+    # نفس الخليط لكل الطرق: ثلاث ضغطات على شاشات ثابتة مقابل ضغطة بمعامل
+    presses = [
+        random.choice(exact) if random.random() < 0.75 else f"{random.choice(prefixes)}{random.randint(1, 10**6)}"
+        for _ in range(count)
+    ]
+    # أسوأ حالة للسلسلة: آخر مسار مسجل
+    worst = [f"{prefixes[-1]}{i}" for i in range(count)]
+
+    chain_avg = run(lambda data: resolve_chain(chain, data), presses)
+    router_avg = run(router.resolve, presses)
+    chain_worst = run(lambda data: resolve_chain(chain, data), worst)
+    router_worst = run(router.resolve, worst)
+
+    print(f"routes: {len(router)} ({len(exact)} exact, {len(prefixes)} prefix); presses: {count:,}")
+    print(f"if/elif chain: {chain_avg:,.0f} ns/press (worst case {chain_worst:,.0f} ns)")
+    print(f"router:        {router_avg:,.0f} ns/press (worst case {router_worst:,.0f} ns)")
+    print(f"speedup: {chain_avg / router_avg:.1f}x (worst case {chain_worst / router_worst:.1f}x)")
+
+if __name__ == '__main__':
+    main()
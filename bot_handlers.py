@@ -1,25 +1,29 @@
+import functools
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CallbackQueryHandler, MessageHandler, filters
-from database import get_db, User, Channel, FundingRequest, PointsSettings, SystemSettings, PointsTransfer
+from telegram.error import TelegramError
+from database import User, FundingRequest, PointsTransfer
+from settings_cache import settings_cache
+from user_cache import user_cache
+from points_service import credit, debit, credit_referral, claim_daily_gift, transfer_points
+from write_queue import write_queue
+from archive import recent_transfers, user_requests
+from subscriptions import mandatory_channels, missing_channels, record_membership
 from config import Config
+from admin_roster import admin_roster
+from callback_router import router
+from admin_panel_handlers import handle_admin_input
+from sqlalchemy import select, update as update_
 from datetime import datetime, timedelta
 
 # ==================== دوال المساعدة ====================
 async def check_mandatory_channels(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    """التحقق من اشتراك المستخدم في القنوات الإجبارية"""
-    db = get_db()
-    try:
-        channels = db.query(Channel).filter_by(is_mandatory=True).all()
-        for channel in channels:
-            try:
-                member = await context.bot.get_chat_member(channel.channel_id, user_id)
-                if member.status in ['left', 'kicked']:
-                    return False
-            except:
-                continue
-        return True
-    finally:
-        db.close()
+    """التحقق من اشتراك المستخدم في القنوات الإجبارية (فحص متزامن مع ذاكرة مؤقتة)"""
+    return not await missing_channels(context.bot, context.db, user_id)
+
+async def track_channel_membership(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """تحديثات chat_member من القنوات الإجبارية: تحديث سجل الاشتراكات بدلاً من سؤال Telegram لاحقاً"""
+    await record_membership(context.db, update.chat_member)
 
 def extract_channel_id(link: str) -> str:
     """استخراج معرف القناة من الرابط"""
@@ -36,21 +40,41 @@ def extract_channel_id(link: str) -> str:
     return None
 
 # ==================== معالجة الأوامر ====================
+async def register_user(db, user_id, username, first_name, last_name, referrer_id=None, referral_points=0):
+    """تسجيل مستخدم جديد مع مكافأة الإحالة (عملية في طابور الكتابة)؛ يرجع False إذا كان مسجلاً"""
+    if await db.scalar(select(User.id).filter_by(user_id=user_id).limit(1)) is not None:
+        return False
+    
+    user = User(
+        user_id=user_id,
+        username=username,
+        first_name=first_name,
+        last_name=last_name,
+        created_at=datetime.now()
+    )
+    if referrer_id and referral_points and await credit_referral(db, referrer_id, referral_points, user_id) is not None:
+        user.referred_by = referrer_id
+    
+    db.add(user)
+    await db.flush()
+    return True
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالجة أمر /start"""
     user_id = update.effective_user.id
-    db = get_db()
+    db = context.db
     
     try:
         # التحقق من وضع الصيانة
-        settings = db.query(SystemSettings).first()
+        settings = await settings_cache.system(db)
         if settings and settings.maintenance_mode:
             await update.message.reply_text(f"🔧 {settings.maintenance_message}")
             return
         
         # التحقق من الاشتراك الإجباري
         if not await check_mandatory_channels(user_id, context):
-            channels = db.query(Channel).filter_by(is_mandatory=True).all()
+            # القائمة محملة في الذاكرة من الفحص السابق
+            channels = await mandatory_channels.get(db)
             if channels:
                 keyboard = []
                 for channel in channels:
@@ -71,45 +95,50 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         # تسجيل/جلب المستخدم
-        user = db.query(User).filter_by(user_id=user_id).first()
+        user = await user_cache.get(db, user_id)
         if not user:
-            user = User(
-                user_id=user_id,
-                username=update.effective_user.username or "",
-                first_name=update.effective_user.first_name or "",
-                last_name=update.effective_user.last_name or "",
-                created_at=datetime.now()
-            )
-            
             # معالجة الإحالة
+            referrer_id, referral_points = None, 0
             if context.args:
                 try:
                     referrer_id = int(context.args[0])
-                    referrer = db.query(User).filter_by(user_id=referrer_id).first()
-                    if referrer and referrer_id != user_id:
-                        points_settings = db.query(PointsSettings).first()
-                        if points_settings:
-                            referrer.points += points_settings.points_per_referral
-                            referrer.referrals += 1
-                            user.referred_by = referrer_id
-                except:
-                    pass
+                except ValueError:
+                    referrer_id = None
+                if referrer_id == user_id:
+                    referrer_id = None
+                if referrer_id:
+                    points_settings = await settings_cache.points(db)
+                    referral_points = points_settings.points_per_referral if points_settings else 0
             
-            db.add(user)
-            db.commit()
+            # التسجيلات في أوقات الذروة تُحفظ معاً في commit واحد
+            await write_queue.submit(
+                register_user,
+                user_id,
+                update.effective_user.username or "",
+                update.effective_user.first_name or "",
+                update.effective_user.last_name or "",
+                referrer_id,
+                referral_points,
+            )
+            user = await user_cache.get(db, user_id)
         
         # التحقق من الحظر
         if user.is_banned:
             await update.message.reply_text(f"❌ حسابك محظور. السبب: {user.ban_reason}")
             return
         
+        # أرسل /start فقد ألغى حظره للبوت: يعود للبث
+        if user.bot_blocked:
+            await db.execute(update_(User).filter_by(user_id=user_id).values(bot_blocked=False))
+            user_cache.invalidate_on_commit(db, user_id)
+        
         # عرض القائمة الرئيسية
         await show_main_menu(update, context, user)
         
     except Exception as e:
+        # لا نترك تسجيلاً أو مكافأة إحالة جزئية لتحفظها وحدة العمل
+        await db.rollback()
         print(f"Error in start_command: {e}")
-    finally:
-        db.close()
 
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
     """عرض القائمة الرئيسية"""
@@ -151,119 +180,91 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, use
         )
 
 # ==================== معالجة الأزرار ====================
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """معالجة ضغطات الأزرار"""
+def _query_view(view):
+    """مسار لشاشة تستقبل (query, context) لأن الشاشات تستدعي بعضها بالـquery أيضاً"""
+    @functools.wraps(view)
+    async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await view(update.callback_query, context)
+    return callback
+
+@router.route("check_subscription")
+async def check_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """إعادة فحص الاشتراك الإجباري"""
     query = update.callback_query
-    await query.answer()
-    data = query.data
-    user_id = query.from_user.id
-    db = get_db()
+    if await check_mandatory_channels(query.from_user.id, context):
+        user = await user_cache.get(context.db, query.from_user.id)
+        if user:
+            await show_main_menu(update, context, user)
+    else:
+        await query.answer("❌ لم تشترك في كل القنوات بعد!", show_alert=True)
+
+@router.route("back_to_main")
+async def back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await user_cache.get(context.db, update.callback_query.from_user.id)
+    if user:
+        await show_main_menu(update, context, user)
+
+@router.route("funding_type_", prefix=True)
+async def choose_funding_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """funding_type_<channel|group>: بدء طلب تمويل"""
+    query = update.callback_query
+    funding_type = query.data.split("_")[2]
+    context.user_data['funding_type'] = funding_type
+    points_settings = await settings_cache.points(context.db)
+    points_per_member = points_settings.points_per_member if points_settings else Config.POINTS_PER_MEMBER
     
-    try:
-        # التحقق من وضع الصيانة
-        settings = db.query(SystemSettings).first()
-        if settings and settings.maintenance_mode and not data.startswith("admin_"):
-            await query.message.reply_text(f"🔧 {settings.maintenance_message}")
-            return
-        
-        if data == "admin_panel":
-            user = db.query(User).filter_by(user_id=user_id).first()
-            if user and user.is_admin:
-                await show_admin_panel(query, context)
-            else:
-                await query.answer("❌ ليس لديك صلاحية!", show_alert=True)
-        elif data == "increase_members":
-            await show_increase_members(query, context)
-        elif data == "my_points":
-            await show_my_points(query, context)
-        elif data == "transfer_points":
-            await show_transfer_points(query, context)
-        elif data == "mandatory_channels":
-            await show_mandatory_channels_menu(query, context)
-        elif data == "contact_admin":
-            await show_contact_admin(query, context)
-        elif data == "invite_link":
-            await show_invite_link(query, context)
-        elif data == "daily_gift":
-            await give_daily_gift(query, context)
-        elif data == "my_requests":
-            await show_my_requests(query, context)
-        elif data == "check_subscription":
-            if await check_mandatory_channels(user_id, context):
-                user = db.query(User).filter_by(user_id=user_id).first()
-                if user:
-                    await show_main_menu(update, context, user)
-            else:
-                await query.answer("❌ لم تشترك في كل القنوات بعد!", show_alert=True)
-        elif data == "back_to_main":
-            user = db.query(User).filter_by(user_id=user_id).first()
-            if user:
-                await show_main_menu(update, context, user)
-        elif data.startswith("funding_type_"):
-            funding_type = data.split("_")[2]
-            context.user_data['funding_type'] = funding_type
-            points_settings = db.query(PointsSettings).first()
-            points_per_member = points_settings.points_per_member if points_settings else Config.POINTS_PER_MEMBER
-            
-            await query.edit_message_text(
-                f"📝 ارسل عدد الأعضاء المطلوب ({funding_type}):\n\n"
-                f"💎 سعر العضو الواحد: {points_per_member} نقطة\n"
-                f"💰 احسب التكلفة: (العدد × {points_per_member})"
-            )
-        elif data == "start_transfer":
-            await query.edit_message_text(
-                "🔄 تحويل النقاط\n\n"
-                "ارسل رسالة بالشكل التالي:\n"
-                "`تحويل [المبلغ] [إيدي المستخدم]`\n\n"
-                "مثال: `تحويل 100 123456789`\n\n"
-                "💡 عمولة التحويل: 5% (قابلة للتغيير من لوحة التحكم)"
-            )
-        elif data == "transfer_history":
-            await show_transfer_history(query, context)
-        
-    finally:
-        db.close()
+    await query.edit_message_text(
+        f"📝 ارسل عدد الأعضاء المطلوب ({funding_type}):\n\n"
+        f"💎 سعر العضو الواحد: {points_per_member} نقطة\n"
+        f"💰 احسب التكلفة: (العدد × {points_per_member})"
+    )
+
+@router.route("start_transfer")
+async def start_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(
+        "🔄 تحويل النقاط\n\n"
+        "ارسل رسالة بالشكل التالي:\n"
+        "`تحويل [المبلغ] [إيدي المستخدم]`\n\n"
+        "مثال: `تحويل 100 123456789`\n\n"
+        "💡 عمولة التحويل: 5% (قابلة للتغيير من لوحة التحكم)"
+    )
 
 # ==================== دوال العرض ====================
 async def show_increase_members(query, context):
     """عرض واجهة زيادة الأعضاء"""
-    db = get_db()
-    try:
-        user = db.query(User).filter_by(user_id=query.from_user.id).first()
-        if not user:
-            return
-        
-        points_settings = db.query(PointsSettings).first()
-        min_points = points_settings.min_points_for_funding if points_settings else Config.MIN_POINTS_FOR_FUNDING
-        
-        if user.points < min_points:
-            await query.answer(f"❌ تحتاج على الأقل {min_points} نقطة لطلب التمويل!", show_alert=True)
-            return
-        
-        keyboard = [
-            [InlineKeyboardButton("📢 قناة عامة", callback_data="funding_type_channel")],
-            [InlineKeyboardButton("👥 مجموعة", callback_data="funding_type_group")],
-            [InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]
-        ]
-        
-        await query.edit_message_text(
-            "اختر نوع القناة/المجموعة التي تريد زيادة أعضائها:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    finally:
-        db.close()
+    db = context.db
+    user = await user_cache.get(db, query.from_user.id)
+    if not user:
+        return
+    
+    points_settings = await settings_cache.points(db)
+    min_points = points_settings.min_points_for_funding if points_settings else Config.MIN_POINTS_FOR_FUNDING
+    
+    if user.points < min_points:
+        await query.answer(f"❌ تحتاج على الأقل {min_points} نقطة لطلب التمويل!", show_alert=True)
+        return
+    
+    keyboard = [
+        [InlineKeyboardButton("📢 قناة عامة", callback_data="funding_type_channel")],
+        [InlineKeyboardButton("👥 مجموعة", callback_data="funding_type_group")],
+        [InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]
+    ]
+    
+    await query.edit_message_text(
+        "اختر نوع القناة/المجموعة التي تريد زيادة أعضائها:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
 
 async def show_my_points(query, context):
     """عرض نقاط المستخدم"""
-    db = get_db()
-    try:
-        user = db.query(User).filter_by(user_id=query.from_user.id).first()
-        if not user:
-            return
-        
-        points_settings = db.query(PointsSettings).first()
-        
-        points_text = f"""
+    db = context.db
+    user = await user_cache.get(db, query.from_user.id)
+    if not user:
+        return
+    
+    points_settings = await settings_cache.points(db)
+    
+    points_text = f"""
 ⭐ نقاطك الحالية: {user.points}
 
 طرق زيادة النقاط:
@@ -274,136 +275,126 @@ async def show_my_points(query, context):
 
 أقل حد للتمويل: {points_settings.min_points_for_funding if points_settings else 25} نقطة
 """
-        
-        keyboard = [
-            [InlineKeyboardButton("🔄 تحويل النقاط", callback_data="transfer_points")],
-            [InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]
-        ]
-        
-        await query.edit_message_text(
-            points_text,
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    finally:
-        db.close()
+    
+    keyboard = [
+        [InlineKeyboardButton("🔄 تحويل النقاط", callback_data="transfer_points")],
+        [InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]
+    ]
+    
+    await query.edit_message_text(
+        points_text,
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
 
 async def show_transfer_points(query, context):
     """عرض واجهة تحويل النقاط"""
-    db = get_db()
-    try:
-        settings = db.query(SystemSettings).first()
-        if not settings or not settings.transfer_enabled:
-            await query.answer("❌ خدمة تحويل النقاط معطلة حالياً!", show_alert=True)
-            return
-        
-        user = db.query(User).filter_by(user_id=query.from_user.id).first()
-        if not user:
-            return
-        
-        keyboard = [
-            [InlineKeyboardButton("🚀 بدء التحويل", callback_data="start_transfer")],
-            [InlineKeyboardButton("📋 سجل التحويلات", callback_data="transfer_history")],
-            [InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]
-        ]
-        
-        await query.edit_message_text(
-            f"🔄 تحويل النقاط\n\n"
-            f"⭐ نقاطك الحالية: {user.points}\n"
-            f"💸 عمولة التحويل: {settings.transfer_fee_percent}%\n"
-            f"📤 أقصى مبلغ للتحويل: لا يوجد حد\n\n"
-            f"اختر الإجراء:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    finally:
-        db.close()
+    db = context.db
+    settings = await settings_cache.system(db)
+    if not settings or not settings.transfer_enabled:
+        await query.answer("❌ خدمة تحويل النقاط معطلة حالياً!", show_alert=True)
+        return
+    
+    user = await user_cache.get(db, query.from_user.id)
+    if not user:
+        return
+    
+    keyboard = [
+        [InlineKeyboardButton("🚀 بدء التحويل", callback_data="start_transfer")],
+        [InlineKeyboardButton("📋 سجل التحويلات", callback_data="transfer_history")],
+        [InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]
+    ]
+    
+    await query.edit_message_text(
+        f"🔄 تحويل النقاط\n\n"
+        f"⭐ نقاطك الحالية: {user.points}\n"
+        f"💸 عمولة التحويل: {settings.transfer_fee_percent}%\n"
+        f"📤 أقصى مبلغ للتحويل: لا يوجد حد\n\n"
+        f"اختر الإجراء:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
 
 async def show_transfer_history(query, context):
     """عرض سجل تحويلات المستخدم"""
-    db = get_db()
-    try:
-        user_id = query.from_user.id
-        transfers = db.query(PointsTransfer).filter(
-            (PointsTransfer.from_user_id == user_id) | (PointsTransfer.to_user_id == user_id)
-        ).order_by(PointsTransfer.transfer_date.desc()).limit(10).all()
-        
-        if not transfers:
-            text = "📋 لا توجد تحويلات سابقة."
-        else:
-            text = "📋 آخر 10 تحويلات:\n\n"
-            for transfer in transfers:
-                if transfer.from_user_id == user_id:
-                    direction = "📤 مرسل"
-                    target = transfer.to_user_id
-                else:
-                    direction = "📥 مستلم"
-                    target = transfer.from_user_id
-                
-                text += (
-                    f"{direction}\n"
-                    f"💰 المبلغ: {transfer.amount} نقطة\n"
-                    f"💸 العمولة: {transfer.fee_amount} نقطة\n"
-                    f"👤 الطرف الآخر: {target}\n"
-                    f"🕒 الوقت: {transfer.transfer_date.strftime('%Y-%m-%d %H:%M')}\n"
-                    f"────────────────────\n"
-                )
-        
-        keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="transfer_points")]]
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        db.close()
+    db = context.db
+    user_id = query.from_user.id
+    transfers = await recent_transfers(db, user_id, limit=10)
+    
+    if not transfers:
+        text = "📋 لا توجد تحويلات سابقة."
+    else:
+        text = "📋 آخر 10 تحويلات:\n\n"
+        # أسماء الأطراف الأخرى باستعلام واحد
+        users = await user_cache.get_many(
+            db, [t.to_user_id if t.from_user_id == user_id else t.from_user_id for t in transfers]
+        )
+        for transfer in transfers:
+            if transfer.from_user_id == user_id:
+                direction = "📤 مرسل"
+                target = transfer.to_user_id
+            else:
+                direction = "📥 مستلم"
+                target = transfer.from_user_id
+            other = users.get(target)
+            
+            text += (
+                f"{direction}\n"
+                f"💰 المبلغ: {transfer.amount} نقطة\n"
+                f"💸 العمولة: {transfer.fee_amount} نقطة\n"
+                f"👤 الطرف الآخر: {other.first_name if other else 'مجهول'} ({target})\n"
+                f"🕒 الوقت: {transfer.transfer_date.strftime('%Y-%m-%d %H:%M')}\n"
+                f"────────────────────\n"
+            )
+    
+    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="transfer_points")]]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def show_mandatory_channels_menu(query, context):
     """عرض قنوات الاشتراك الإجباري"""
-    db = get_db()
-    try:
-        channels = db.query(Channel).filter_by(is_mandatory=True).all()
-        
-        if not channels:
-            text = "✅ لا توجد قنوات إجبارية حالياً."
-        else:
-            text = "📢 قنوات الاشتراك الإجباري:\n\n"
-            for i, channel in enumerate(channels, 1):
-                is_subscribed = await check_mandatory_channels(query.from_user.id, context)
-                status = "✅ مشترك" if is_subscribed else "❌ غير مشترك"
-                username = channel.channel_username or channel.channel_id
-                text += f"{i}. {channel.channel_title or username}\n{status}\n\n"
-        
-        keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]]
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        db.close()
+    db = context.db
+    channels = await mandatory_channels.get(db)
+    
+    if not channels:
+        text = "✅ لا توجد قنوات إجبارية حالياً."
+    else:
+        text = "📢 قنوات الاشتراك الإجباري:\n\n"
+        # فحص واحد لكل القنوات بدلاً من فحص الكل لكل قناة
+        missing = {channel.channel_id for channel in await missing_channels(context.bot, db, query.from_user.id)}
+        for i, channel in enumerate(channels, 1):
+            is_subscribed = channel.channel_id not in missing
+            status = "✅ مشترك" if is_subscribed else "❌ غير مشترك"
+            username = channel.channel_username or channel.channel_id
+            text += f"{i}. {channel.channel_title or username}\n{status}\n\n"
+    
+    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def show_contact_admin(query, context):
     """عرض جهات اتصال المسؤولين"""
-    db = get_db()
-    try:
-        admins = db.query(User).filter_by(is_admin=True).all()
-        
-        if not admins:
-            text = "📞 لا يوجد مسؤولين متاحين حالياً."
-        else:
-            text = "📞 قائمة المسؤولين:\n\n"
-            for admin in admins:
-                username = admin.username or f"المستخدم {admin.user_id}"
-                text += f"• {username} - إيدي: {admin.user_id}\n"
-            text += "\nراسل أي مسؤول للشحن أو الاستفسار."
-        
-        keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]]
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        db.close()
+    db = context.db
+    admins = await admin_roster.get(db)
+    
+    if not admins:
+        text = "📞 لا يوجد مسؤولين متاحين حالياً."
+    else:
+        text = "📞 قائمة المسؤولين:\n\n"
+        for admin in admins:
+            username = admin.username or f"المستخدم {admin.user_id}"
+            text += f"• {username} - إيدي: {admin.user_id}\n"
+        text += "\nراسل أي مسؤول للشحن أو الاستفسار."
+    
+    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def show_invite_link(query, context):
     """عرض رابط الدعوة"""
     bot_username = context.bot.username
     invite_link = f"https://t.me/{bot_username}?start={query.from_user.id}"
     
-    db = get_db()
-    try:
-        points_settings = db.query(PointsSettings).first()
-        points_per_referral = points_settings.points_per_referral if points_settings else Config.POINTS_PER_REFERRAL
-        
-        text = f"""
+    db = context.db
+    points_settings = await settings_cache.points(db)
+    points_per_referral = points_settings.points_per_referral if points_settings else Config.POINTS_PER_REFERRAL
+    
+    text = f"""
 🔗 رابط دعوتك الخاص:
 
 `{invite_link}`
@@ -411,119 +402,125 @@ async def show_invite_link(query, context):
 📊 لكل صديق تدعوه: {points_per_referral} نقاط
 ⭐ النقاط تخصم فور اشتراك صديقك
 """
-        
-        keyboard = [
-            [InlineKeyboardButton("🔗 نسخ الرابط", callback_data="copy_link")],
-            [InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]
-        ]
-        
-        await query.edit_message_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
-        )
-    finally:
-        db.close()
+    
+    keyboard = [
+        [InlineKeyboardButton("🔗 نسخ الرابط", callback_data="copy_link")],
+        [InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]
+    ]
+    
+    await query.edit_message_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode='Markdown'
+    )
 
 async def show_my_requests(query, context):
     """عرض طلبات المستخدم"""
-    db = get_db()
-    try:
-        requests = db.query(FundingRequest).filter_by(user_id=query.from_user.id).order_by(FundingRequest.created_at.desc()).limit(5).all()
-        
-        if not requests:
-            text = "📋 لا توجد طلبات سابقة."
-        else:
-            text = "📋 آخر 5 طلبات:\n\n"
-            for req in requests:
-                status_emoji = {
-                    'pending': '⏳',
-                    'approved': '✅',
-                    'completed': '🎉',
-                    'rejected': '❌'
-                }.get(req.status, '📝')
-                
-                text += (
-                    f"طلب #{req.id}\n"
-                    f"{status_emoji} الحالة: {req.status}\n"
-                    f"👥 الأعضاء: {req.requested_members}\n"
-                    f"💰 التكلفة: {req.points_cost} نقطة\n"
-                    f"🕒 الوقت: {req.created_at.strftime('%Y-%m-%d %H:%M')}\n"
-                    f"────────────────────\n"
-                )
-        
-        keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]]
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        db.close()
+    db = context.db
+    requests = await user_requests(db, query.from_user.id, limit=5)
+    
+    if not requests:
+        text = "📋 لا توجد طلبات سابقة."
+    else:
+        text = "📋 آخر 5 طلبات:\n\n"
+        for req in requests:
+            status_emoji = {
+                'pending': '⏳',
+                'approved': '✅',
+                'completed': '🎉',
+                'rejected': '❌'
+            }.get(req.status, '📝')
+            
+            text += (
+                f"طلب #{req.id}\n"
+                f"{status_emoji} الحالة: {req.status}\n"
+                f"👥 الأعضاء: {req.requested_members}\n"
+                f"💰 التكلفة: {req.points_cost} نقطة\n"
+                f"🕒 الوقت: {req.created_at.strftime('%Y-%m-%d %H:%M')}\n"
+                f"────────────────────\n"
+            )
+    
+    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def give_daily_gift(query, context):
     """منح الهدية اليومية"""
-    db = get_db()
-    try:
-        user = db.query(User).filter_by(user_id=query.from_user.id).first()
-        if not user:
+    db = context.db
+    user = await db.scalar(select(User).filter_by(user_id=query.from_user.id).limit(1))
+    if not user:
+        return
+    
+    now = datetime.now()
+    
+    # التحقق إذا أخذ الهدية اليوم
+    if user.last_daily_gift:
+        last_gift_date = user.last_daily_gift.date()
+        if last_gift_date == now.date():
+            next_gift = user.last_daily_gift + timedelta(days=1)
+            remaining = next_gift - now
+            hours = remaining.seconds // 3600
+            minutes = (remaining.seconds % 3600) // 60
+            
+            await query.answer(f"⏳ الهدية متاحة بعد {hours} ساعة و {minutes} دقيقة", show_alert=True)
             return
-        
-        now = datetime.now()
-        
-        # التحقق إذا أخذ الهدية اليوم
-        if user.last_daily_gift:
-            last_gift_date = user.last_daily_gift.date()
-            if last_gift_date == now.date():
-                next_gift = user.last_daily_gift + timedelta(days=1)
-                remaining = next_gift - now
-                hours = remaining.seconds // 3600
-                minutes = (remaining.seconds % 3600) // 60
-                
-                await query.answer(f"⏳ الهدية متاحة بعد {hours} ساعة و {minutes} دقيقة", show_alert=True)
-                return
-        
-        # منح النقاط
-        points_settings = db.query(PointsSettings).first()
-        points = points_settings.daily_gift_points if points_settings else Config.DAILY_GIFT_POINTS
-        
-        user.points += points
-        user.last_daily_gift = now
-        db.commit()
-        
-        await query.answer(f"🎁 حصلت على {points} نقاط!", show_alert=True)
-        await show_my_points(query, context)
-    finally:
-        db.close()
+    
+    # منح النقاط
+    points_settings = await settings_cache.points(db)
+    points = points_settings.daily_gift_points if points_settings else Config.DAILY_GIFT_POINTS
+    
+    # الشرط في قاعدة البيانات يمنع أخذ الهدية مرتين عند الضغط المزدوج،
+    # وطابور الكتابة يجمع مطالبات وقت الذروة في commit واحد
+    if await write_queue.submit(claim_daily_gift, user.user_id, points, now) is None:
+        await query.answer("⏳ لقد حصلت على هدية اليوم بالفعل!", show_alert=True)
+        return
+    
+    await query.answer(f"🎁 حصلت على {points} نقاط!", show_alert=True)
+    await show_my_points(query, context)
 
 async def show_admin_panel(query, context):
     """عرض لوحة تحكم المشرف"""
-    db = get_db()
-    try:
-        user = db.query(User).filter_by(user_id=query.from_user.id).first()
-        if not user or not user.is_admin:
-            await query.answer("❌ ليس لديك صلاحية الدخول!", show_alert=True)
-            return
-        
-        text = """
+    db = context.db
+    user = await user_cache.get(db, query.from_user.id)
+    if not user or not user.is_admin:
+        await query.answer("❌ ليس لديك صلاحية الدخول!", show_alert=True)
+        return
+    
+    text = """
 👑 لوحة تحكم المشرف
 
 اختر القسم:
 """
-        
-        keyboard = [
-            [InlineKeyboardButton("📊 الإحصائيات", callback_data="admin_stats")],
-            [InlineKeyboardButton("👥 إدارة المستخدمين", callback_data="admin_users")],
-            [InlineKeyboardButton("👑 إدارة المشرفين", callback_data="admin_admins")],
-            [InlineKeyboardButton("📢 إدارة القنوات", callback_data="admin_channels")],
-            [InlineKeyboardButton("👥 إدارة المجموعات", callback_data="admin_groups")],
-            [InlineKeyboardButton("📋 طلبات التمويل", callback_data="admin_requests")],
-            [InlineKeyboardButton("⚙️ إعدادات النظام", callback_data="admin_system")],
-            [InlineKeyboardButton("⭐ إعدادات النقاط", callback_data="admin_points")],
-            [InlineKeyboardButton("🔄 إعدادات التحويل", callback_data="admin_transfer")],
-            [InlineKeyboardButton("📨 إرسال للجميع", callback_data="admin_broadcast")],
-            [InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]
-        ]
-        
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-    finally:
-        db.close()
+    
+    keyboard = [
+        [InlineKeyboardButton("📊 الإحصائيات", callback_data="admin_stats")],
+        [InlineKeyboardButton("👥 إدارة المستخدمين", callback_data="admin_users")],
+        [InlineKeyboardButton("👑 إدارة المشرفين", callback_data="admin_admins")],
+        [InlineKeyboardButton("📢 إدارة القنوات", callback_data="admin_channels")],
+        [InlineKeyboardButton("👥 إدارة المجموعات", callback_data="admin_groups")],
+        [InlineKeyboardButton("📋 طلبات التمويل", callback_data="admin_requests")],
+        [InlineKeyboardButton("⚙️ إعدادات النظام", callback_data="admin_system")],
+        [InlineKeyboardButton("⭐ إعدادات النقاط", callback_data="admin_points")],
+        [InlineKeyboardButton("🔄 إعدادات التحويل", callback_data="admin_transfer")],
+        [InlineKeyboardButton("📨 إرسال للجميع", callback_data="admin_broadcast")],
+        [InlineKeyboardButton("🔙 رجوع", callback_data="back_to_main")]
+    ]
+    
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+# شاشات المستخدم (تسجل بعد تعريفها)
+for _data, _view in {
+    "increase_members": show_increase_members,
+    "my_points": show_my_points,
+    "transfer_points": show_transfer_points,
+    "mandatory_channels": show_mandatory_channels_menu,
+    "contact_admin": show_contact_admin,
+    "invite_link": show_invite_link,
+    "daily_gift": give_daily_gift,
+    "my_requests": show_my_requests,
+    "transfer_history": show_transfer_history,
+}.items():
+    router.add(_data, _query_view(_view))
+router.add("admin_panel", _query_view(show_admin_panel), admin_only=True)
 
 # ==================== معالجة الرسائل النصية ====================
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -532,44 +529,44 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
     
     # التحقق من وضع الصيانة
-    db = get_db()
-    try:
-        settings = db.query(SystemSettings).first()
-        if settings and settings.maintenance_mode:
-            # استثناء: يمكن للمشرفين استخدام الأوامر أثناء الصيانة
-            user = db.query(User).filter_by(user_id=user_id).first()
-            if not user or not user.is_admin:
-                await update.message.reply_text(f"🔧 {settings.maintenance_message}")
-                return
-        
-        # إذا كان المستخدم في مرحلة إدخال عدد الأعضاء
-        if 'funding_type' in context.user_data and 'requested_members' not in context.user_data:
-            await handle_funding_request(update, context)
-        
-        # إذا كان المستخدم في مرحلة إدخال الرابط
-        elif 'requested_members' in context.user_data and 'points_needed' in context.user_data:
-            await handle_channel_link(update, context)
-        
-        # إذا كان طلب تحويل نقاط
-        elif text.startswith('تحويل '):
-            await handle_points_transfer(update, context)
+    db = context.db
+    settings = await settings_cache.system(db)
+    if settings and settings.maintenance_mode:
+        # استثناء: يمكن للمشرفين استخدام الأوامر أثناء الصيانة
+        user = await user_cache.get(db, user_id)
+        if not user or not user.is_admin:
+            await update.message.reply_text(f"🔧 {settings.maintenance_message}")
+            return
+    
+    # مدخلات لوحة التحكم (عمولة التحويل، رسالة الصيانة، نص البث)
+    if await handle_admin_input(update, context):
+        return
+    
+    # إذا كان المستخدم في مرحلة إدخال عدد الأعضاء
+    if 'funding_type' in context.user_data and 'requested_members' not in context.user_data:
+        await handle_funding_request(update, context)
+    
+    # إذا كان المستخدم في مرحلة إدخال الرابط
+    elif 'requested_members' in context.user_data and 'points_needed' in context.user_data:
+        await handle_channel_link(update, context)
+    
+    # إذا كان طلب تحويل نقاط
+    elif text.startswith('تحويل '):
+        await handle_points_transfer(update, context)
+    
+    # إذا كان رسالة عادية
+    else:
+        # التحقق من الاشتراك الإجباري أولاً
+        if not await check_mandatory_channels(user_id, context):
+            await update.message.reply_text("⛔ يجب الاشتراك في القنوات الإجبارية أولاً! استخدم /start")
+            return
         
-        # إذا كان رسالة عادية
+        # إذا كان المستخدم مشرف ويرسل أمر
+        user = await user_cache.get(db, user_id)
+        if user and user.is_admin and text.startswith('/'):
+            await handle_admin_commands(update, context)
         else:
-            # التحقق من الاشتراك الإجباري أولاً
-            if not await check_mandatory_channels(user_id, context):
-                await update.message.reply_text("⛔ يجب الاشتراك في القنوات الإجبارية أولاً! استخدم /start")
-                return
-            
-            # إذا كان المستخدم مشرف ويرسل أمر
-            user = db.query(User).filter_by(user_id=user_id).first()
-            if user and user.is_admin and text.startswith('/'):
-                await handle_admin_commands(update, context)
-            else:
-                await update.message.reply_text("استخدم الأزرار في القائمة أو /start للبدء")
-    
-    finally:
-        db.close()
+            await update.message.reply_text("استخدم الأزرار في القائمة أو /start للبدء")
 
 async def handle_funding_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالجة طلب التمويل"""
@@ -581,110 +578,111 @@ async def handle_funding_request(update: Update, context: ContextTypes.DEFAULT_T
         return
     
     requested_members = int(text)
-    db = get_db()
+    db = context.db
     
-    try:
-        user = db.query(User).filter_by(user_id=user_id).first()
-        if not user:
-            return
-        
-        points_settings = db.query(PointsSettings).first()
-        points_per_member = points_settings.points_per_member if points_settings else Config.POINTS_PER_MEMBER
-        
-        # حساب التكلفة
-        points_needed = requested_members * points_per_member
-        
-        if user.points < points_needed:
-            await update.message.reply_text(
-                f"❌ نقاطك غير كافية!\n"
-                f"💎 لديك: {user.points} نقطة\n"
-                f"💰 تحتاج: {points_needed} نقطة\n"
-                f"⭐ الناقص: {points_needed - user.points} نقطة"
-            )
-            return
-        
-        context.user_data['requested_members'] = requested_members
-        context.user_data['points_needed'] = points_needed
-        
+    user = await user_cache.get(db, user_id)
+    if not user:
+        return
+    
+    points_settings = await settings_cache.points(db)
+    points_per_member = points_settings.points_per_member if points_settings else Config.POINTS_PER_MEMBER
+    
+    # حساب التكلفة
+    points_needed = requested_members * points_per_member
+    
+    if user.points < points_needed:
         await update.message.reply_text(
-            f"✅ الطلب مقبول!\n"
-            f"📊 عدد الأعضاء: {requested_members}\n"
-            f"💰 التكلفة: {points_needed} نقطة\n\n"
-            f"📝 الآن ارسل رابط قناتك/مجموعتك:\n"
-            f"(يبدأ بـ @ أو https://t.me/)"
+            f"❌ نقاطك غير كافية!\n"
+            f"💎 لديك: {user.points} نقطة\n"
+            f"💰 تحتاج: {points_needed} نقطة\n"
+            f"⭐ الناقص: {points_needed - user.points} نقطة"
         )
-    finally:
-        db.close()
+        return
+    
+    context.user_data['requested_members'] = requested_members
+    context.user_data['points_needed'] = points_needed
+    
+    await update.message.reply_text(
+        f"✅ الطلب مقبول!\n"
+        f"📊 عدد الأعضاء: {requested_members}\n"
+        f"💰 التكلفة: {points_needed} نقطة\n\n"
+        f"📝 الآن ارسل رابط قناتك/مجموعتك:\n"
+        f"(يبدأ بـ @ أو https://t.me/)"
+    )
 
 async def handle_channel_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالجة رابط القناة"""
     user_id = update.effective_user.id
     link = update.message.text
-    db = get_db()
+    db = context.db
     
+    user = await db.scalar(select(User).filter_by(user_id=user_id).limit(1))
+    if not user or 'requested_members' not in context.user_data:
+        return
+    
+    # استخراج معرف القناة
+    channel_id = extract_channel_id(link)
+    if not channel_id:
+        await update.message.reply_text("❌ رابط غير صالح! تأكد من الرابط وأرسله مرة أخرى.")
+        return
+    
+    # التحقق من أن البوت أدمن في القناة
     try:
-        user = db.query(User).filter_by(user_id=user_id).first()
-        if not user or 'requested_members' not in context.user_data:
-            return
-        
-        # استخراج معرف القناة
-        channel_id = extract_channel_id(link)
-        if not channel_id:
-            await update.message.reply_text("❌ رابط غير صالح! تأكد من الرابط وأرسله مرة أخرى.")
-            return
-        
-        # التحقق من أن البوت أدمن في القناة
-        try:
-            chat_member = await context.bot.get_chat_member(channel_id, context.bot.id)
-            if chat_member.status not in ['administrator', 'creator']:
-                await update.message.reply_text("❌ البوت ليس أدمن في القناة! ارفع البوت كأدمن أولاً.")
-                return
-        except Exception as e:
-            print(f"Error checking admin status: {e}")
-            await update.message.reply_text("❌ لا يمكن الوصول للقناة! تأكد من صلاحيات البوت.")
+        chat_member = await context.bot.get_chat_member(channel_id, context.bot.id)
+        if chat_member.status not in ['administrator', 'creator']:
+            await update.message.reply_text("❌ البوت ليس أدمن في القناة! ارفع البوت كأدمن أولاً.")
             return
-        
-        # خصم النقاط وإنشاء الطلب
-        requested_members = context.user_data['requested_members']
-        points_needed = context.user_data['points_needed']
-        
-        user.points -= points_needed
-        funding_request = FundingRequest(
-            user_id=user_id,
-            target_channel=channel_id,
-            target_type=context.user_data['funding_type'],
-            requested_members=requested_members,
-            points_cost=points_needed,
-            status='pending',
-            created_at=datetime.now()
-        )
-        
-        db.add(funding_request)
-        db.commit()
-        
-        # إرسال إشعار للمشرفين
-        await notify_admins_about_request(context.bot, funding_request, user)
-        
+    except Exception as e:
+        print(f"Error checking admin status: {e}")
+        await update.message.reply_text("❌ لا يمكن الوصول للقناة! تأكد من صلاحيات البوت.")
+        return
+    
+    # خصم النقاط وإنشاء الطلب
+    requested_members = context.user_data['requested_members']
+    points_needed = context.user_data['points_needed']
+    
+    balance = await debit(db, user_id, points_needed, 'funding')
+    if balance is None:
         await update.message.reply_text(
-            f"✅ تم استلام طلبك!\n"
-            f"📊 رقم الطلب: {funding_request.id}\n"
-            f"👥 الأعضاء: {requested_members}\n"
-            f"💰 النقاط المخصومة: {points_needed}\n"
-            f"⭐ نقاطك المتبقية: {user.points}\n\n"
-            f"⏳ الطلب قيد الانتظار للموافقة..."
+            f"❌ نقاطك غير كافية!\n"
+            f"💰 تحتاج: {points_needed} نقطة"
         )
-        
-        # تنظيف البيانات المؤقتة
         context.user_data.clear()
-        
-    finally:
-        db.close()
+        return
+    
+    funding_request = FundingRequest(
+        user_id=user_id,
+        target_channel=channel_id,
+        target_type=context.user_data['funding_type'],
+        requested_members=requested_members,
+        points_cost=points_needed,
+        status='pending',
+        created_at=datetime.now()
+    )
+    
+    db.add(funding_request)
+    await db.flush()
+    
+    # إرسال إشعار للمشرفين
+    await notify_admins_about_request(context.bot, funding_request, user, db)
+    
+    await update.message.reply_text(
+        f"✅ تم استلام طلبك!\n"
+        f"📊 رقم الطلب: {funding_request.id}\n"
+        f"👥 الأعضاء: {requested_members}\n"
+        f"💰 النقاط المخصومة: {points_needed}\n"
+        f"⭐ نقاطك المتبقية: {balance}\n\n"
+        f"⏳ الطلب قيد الانتظار للموافقة..."
+    )
+    
+    # تنظيف البيانات المؤقتة
+    context.user_data.clear()
 
 async def handle_points_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالجة طلب تحويل النقاط"""
     user_id = update.effective_user.id
     text = update.message.text.strip()
-    db = get_db()
+    db = context.db
     
     try:
         # التحقق من صيغة الرسالة
@@ -700,7 +698,7 @@ async def handle_points_transfer(update: Update, context: ContextTypes.DEFAULT_T
         target_user_id = int(parts[2])
         
         # التحقق من الإعدادات
-        settings = db.query(SystemSettings).first()
+        settings = await settings_cache.system(db)
         if not settings or not settings.transfer_enabled:
             await update.message.reply_text("❌ خدمة تحويل النقاط معطلة حالياً!")
             return
@@ -711,7 +709,7 @@ async def handle_points_transfer(update: Update, context: ContextTypes.DEFAULT_T
             return
         
         # جلب بيانات المرسل
-        sender = db.query(User).filter_by(user_id=user_id).first()
+        sender = await db.scalar(select(User).filter_by(user_id=user_id).limit(1))
         if not sender:
             await update.message.reply_text("❌ حسابك غير موجود!")
             return
@@ -730,14 +728,17 @@ async def handle_points_transfer(update: Update, context: ContextTypes.DEFAULT_T
             return
         
         # جلب بيانات المستقبل
-        receiver = db.query(User).filter_by(user_id=target_user_id).first()
+        receiver = await db.scalar(select(User).filter_by(user_id=target_user_id).limit(1))
         if not receiver:
             await update.message.reply_text("❌ المستخدم الهدف غير موجود!")
             return
         
-        # تنفيذ التحويل
-        sender.points -= total_deduct
-        receiver.points += amount
+        # تنفيذ التحويل (الخصم مشروط بالرصيد داخل قاعدة البيانات)
+        balances = await transfer_points(db, user_id, target_user_id, amount, fee_amount)
+        if balances is None:
+            await update.message.reply_text("❌ نقاطك غير كافية!")
+            return
+        sender_balance, receiver_balance = balances
         
         # تسجيل العملية
         transfer = PointsTransfer(
@@ -750,7 +751,6 @@ async def handle_points_transfer(update: Update, context: ContextTypes.DEFAULT_T
             transfer_date=datetime.now()
         )
         db.add(transfer)
-        db.commit()
         
         # إرسال إشعارات
         await update.message.reply_text(
@@ -758,7 +758,7 @@ async def handle_points_transfer(update: Update, context: ContextTypes.DEFAULT_T
             f"📤 إلى: {receiver.first_name or 'مستخدم'} (إيدي: {target_user_id})\n"
             f"💸 العمولة: {fee_amount} نقطة ({fee_percent}%)\n"
             f"💰 المبلغ الإجمالي: {total_deduct} نقطة\n"
-            f"⭐ رصيدك الجديد: {sender.points} نقطة"
+            f"⭐ رصيدك الجديد: {sender_balance} نقطة"
         )
         
         # إشعار المستقبل
@@ -768,147 +768,134 @@ async def handle_points_transfer(update: Update, context: ContextTypes.DEFAULT_T
                 f"🎉 استلمت تحويل نقاط!\n\n"
                 f"📥 من: {sender.first_name or 'مستخدم'} (إيدي: {user_id})\n"
                 f"💰 المبلغ: {amount} نقطة\n"
-                f"⭐ رصيدك الجديد: {receiver.points} نقطة"
+                f"⭐ رصيدك الجديد: {receiver_balance} نقطة"
             )
-        except:
+        except TelegramError:
             pass  # قد يكون المستقبل حظر البوت
         
     except ValueError:
+        await db.rollback()
         await update.message.reply_text("❌ الرجاء إدخال أرقام صحيحة!")
     except Exception as e:
+        await db.rollback()
         await update.message.reply_text(f"❌ حدث خطأ: {str(e)}")
-    finally:
-        db.close()
 
 async def handle_admin_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالجة أوامر المشرفين"""
     text = update.message.text
     user_id = update.effective_user.id
-    db = get_db()
+    db = context.db
     
-    try:
-        user = db.query(User).filter_by(user_id=user_id).first()
-        if not user or not user.is_admin:
+    user = await user_cache.get(db, user_id)
+    if not user or not user.is_admin:
+        return
+    
+    if text.startswith('/add_admin'):
+        parts = text.split()
+        if len(parts) < 2:
+            await update.message.reply_text("❌ صيغة خاطئة: /add_admin @username أو user_id")
             return
         
-        if text.startswith('/add_admin'):
-            parts = text.split()
-            if len(parts) < 2:
-                await update.message.reply_text("❌ صيغة خاطئة: /add_admin @username أو user_id")
-                return
-            
-            target = parts[1].replace('@', '')
-            if target.isdigit():
-                target_user = db.query(User).filter_by(user_id=int(target)).first()
-            else:
-                target_user = db.query(User).filter_by(username=target).first()
-            
-            if not target_user:
-                await update.message.reply_text("❌ المستخدم غير موجود!")
-                return
-            
-            target_user.is_admin = True
-            db.commit()
-            
-            await update.message.reply_text(f"✅ تمت ترقية {target_user.first_name} إلى مشرف")
+        target = parts[1].replace('@', '')
+        if target.isdigit():
+            target_user = await db.scalar(select(User).filter_by(user_id=int(target)).limit(1))
+        else:
+            target_user = await db.scalar(select(User).filter_by(username=target).limit(1))
         
-        elif text.startswith('/ban'):
-            parts = text.split()
-            if len(parts) < 3:
-                await update.message.reply_text("❌ صيغة خاطئة: /ban @username السبب")
-                return
-            
-            target = parts[1].replace('@', '')
-            reason = ' '.join(parts[2:])
-            
-            if target.isdigit():
-                target_user = db.query(User).filter_by(user_id=int(target)).first()
-            else:
-                target_user = db.query(User).filter_by(username=target).first()
-            
-            if not target_user:
-                await update.message.reply_text("❌ المستخدم غير موجود!")
-                return
-            
-            target_user.is_banned = True
-            target_user.ban_reason = reason
-            db.commit()
-            
-            await update.message.reply_text(f"✅ تم حظر {target_user.first_name}\nالسبب: {reason}")
+        if not target_user:
+            await update.message.reply_text("❌ المستخدم غير موجود!")
+            return
         
-        elif text.startswith('/add_points'):
-            parts = text.split()
-            if len(parts) < 3:
-                await update.message.reply_text("❌ صيغة خاطئة: /add_points @username العدد")
-                return
-            
-            target = parts[1].replace('@', '')
-            points = int(parts[2])
-            
-            if target.isdigit():
-                target_user = db.query(User).filter_by(user_id=int(target)).first()
-            else:
-                target_user = db.query(User).filter_by(username=target).first()
-            
-            if not target_user:
-                await update.message.reply_text("❌ المستخدم غير موجود!")
-                return
-            
-            target_user.points += points
-            db.commit()
-            
-            await update.message.reply_text(f"✅ تم إضافة {points} نقطة لـ {target_user.first_name}")
+        target_user.is_admin = True
+        user_cache.invalidate_on_commit(db, target_user.user_id)
+        
+        await update.message.reply_text(f"✅ تمت ترقية {target_user.first_name} إلى مشرف")
+    
+    elif text.startswith('/ban'):
+        parts = text.split()
+        if len(parts) < 3:
+            await update.message.reply_text("❌ صيغة خاطئة: /ban @username السبب")
+            return
+        
+        target = parts[1].replace('@', '')
+        reason = ' '.join(parts[2:])
+        
+        if target.isdigit():
+            target_user = await db.scalar(select(User).filter_by(user_id=int(target)).limit(1))
+        else:
+            target_user = await db.scalar(select(User).filter_by(username=target).limit(1))
         
-        elif text.startswith('/maintenance'):
-            parts = text.split()
-            if len(parts) < 2:
-                await update.message.reply_text("❌ صيغة خاطئة: /maintenance on/off")
+        if not target_user:
+            await update.message.reply_text("❌ المستخدم غير موجود!")
+            return
+        
+        target_user.is_banned = True
+        target_user.ban_reason = reason
+        user_cache.invalidate_on_commit(db, target_user.user_id)
+        
+        await update.message.reply_text(f"✅ تم حظر {target_user.first_name}\nالسبب: {reason}")
+    
+    elif text.startswith('/add_points'):
+        parts = text.split()
+        if len(parts) < 3:
+            await update.message.reply_text("❌ صيغة خاطئة: /add_points @username العدد")
+            return
+        
+        target = parts[1].replace('@', '')
+        points = int(parts[2])
+        
+        if target.isdigit():
+            target_user = await db.scalar(select(User).filter_by(user_id=int(target)).limit(1))
+        else:
+            target_user = await db.scalar(select(User).filter_by(username=target).limit(1))
+        
+        if not target_user:
+            await update.message.reply_text("❌ المستخدم غير موجود!")
+            return
+        
+        await credit(db, target_user.user_id, points, 'admin_grant', user_id)
+        
+        await update.message.reply_text(f"✅ تم إضافة {points} نقطة لـ {target_user.first_name}")
+    
+    elif text.startswith('/maintenance'):
+        parts = text.split()
+        if len(parts) < 2:
+            await update.message.reply_text("❌ صيغة خاطئة: /maintenance on/off")
+            return
+        
+        mode = parts[1].lower()
+        settings = await settings_cache.system(db)
+        if settings:
+            if mode == 'on':
+                await settings_cache.update_system(db, user_id, maintenance_mode=True)
+                await update.message.reply_text("✅ تم تفعيل وضع الصيانة")
+            elif mode == 'off':
+                await settings_cache.update_system(db, user_id, maintenance_mode=False)
+                await update.message.reply_text("✅ تم تعطيل وضع الصيانة")
+    
+    elif text.startswith('/set_fee'):
+        parts = text.split()
+        if len(parts) < 2:
+            await update.message.reply_text("❌ صيغة خاطئة: /set_fee النسبة")
+            return
+        
+        try:
+            fee = int(parts[1])
+            if fee < 0 or fee > 50:
+                await update.message.reply_text("❌ النسبة يجب أن تكون بين 0 و 50!")
                 return
             
-            mode = parts[1].lower()
-            settings = db.query(SystemSettings).first()
+            settings = await settings_cache.system(db)
             if settings:
-                if mode == 'on':
-                    settings.maintenance_mode = True
-                    await update.message.reply_text("✅ تم تفعيل وضع الصيانة")
-                elif mode == 'off':
-                    settings.maintenance_mode = False
-                    await update.message.reply_text("✅ تم تعطيل وضع الصيانة")
-                db.commit()
-        
-        elif text.startswith('/set_fee'):
-            parts = text.split()
-            if len(parts) < 2:
-                await update.message.reply_text("❌ صيغة خاطئة: /set_fee النسبة")
-                return
-            
-            try:
-                fee = int(parts[1])
-                if fee < 0 or fee > 50:
-                    await update.message.reply_text("❌ النسبة يجب أن تكون بين 0 و 50!")
-                    return
-                
-                settings = db.query(SystemSettings).first()
-                if settings:
-                    old_fee = settings.transfer_fee_percent
-                    settings.transfer_fee_percent = fee
-                    db.commit()
-                    await update.message.reply_text(f"✅ تم تغيير عمولة التحويل من {old_fee}% إلى {fee}%")
-            except ValueError:
-                await update.message.reply_text("❌ الرجاء إدخال رقم صحيح!")
-    
-    finally:
-        db.close()
-
-async def notify_admins_about_request(bot, request, user):
-    """إرسال إشعار للمشرفين بطلب جديد"""
-    db = get_db()
-    try:
-        admins = db.query(User).filter_by(is_admin=True).all()
-        
-        for admin in admins:
-            try:
-                text = f"""
+                old_fee = settings.transfer_fee_percent
+                await settings_cache.update_system(db, user_id, transfer_fee_percent=fee)
+                await update.message.reply_text(f"✅ تم تغيير عمولة التحويل من {old_fee}% إلى {fee}%")
+        except ValueError:
+            await update.message.reply_text("❌ الرجاء إدخال رقم صحيح!")
+
+async def notify_admins_about_request(bot, request, user, db):
+    """إرسال إشعار للمشرفين بطلب جديد (لكل المشرفين معاً)"""
+    text = f"""
 📋 طلب تمويل جديد!
 
 👤 المستخدم: {user.first_name or 'مجهول'}
@@ -919,20 +906,12 @@ async def notify_admins_about_request(bot, request, user):
 📢 الهدف: {request.target_channel}
 🕒 الوقت: {request.created_at.strftime('%Y-%m-%d %H:%M:%S')}
 """
-                
-                keyboard = [
-                    [
-                        InlineKeyboardButton("✅ قبول", callback_data=f"approve_request_{request.id}"),
-                        InlineKeyboardButton("❌ رفض", callback_data=f"reject_request_{request.id}")
-                    ]
-                ]
-                
-                await bot.send_message(
-                    admin.user_id,
-                    text,
-                    reply_markup=InlineKeyboardMarkup(keyboard)
-                )
-            except:
-                pass
-    finally:
-        db.close()
+    
+    keyboard = [
+        [
+            InlineKeyboardButton("✅ قبول", callback_data=f"approve_request_{request.id}"),
+            InlineKeyboardButton("❌ رفض", callback_data=f"reject_request_{request.id}")
+        ]
+    ]
+    
+    return await admin_roster.notify(bot, db, text, reply_markup=InlineKeyboardMarkup(keyboard))
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from sqlalchemy import select, update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError, Forbidden, BadRequest
+from config import Config
+from database import BroadcastJob, User, get_db
+from points_service import credit_many
+from rate_limiter import ADMIN, BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('pending', 'running')
+
+# ==================== إنشاء المهام ====================
+async def create_broadcast(db, created_by: int, text: str, points: int = 0, total: int = 0,
+                           progress_chat_id: int = None, progress_message_id: int = None) -> BroadcastJob:
+    """إضافة مهمة بث (تبدأ عند الفحص التالي بعد حفظ المعاملة)"""
+    job = BroadcastJob(
+        created_by=created_by,
+        text=text,
+        points=points,
+        total=total,
+        progress_chat_id=progress_chat_id,
+        progress_message_id=progress_message_id,
+        status='pending',
+    )
+    db.add(job)
+    await db.flush()
+    return job
+
+async def cancel_broadcast(db, job_id: int) -> bool:
+    """إيقاف مهمة لم تنتهِ؛ المرسل يتوقف قبل الصفحة التالية"""
+    result = await db.execute(
+        update(BroadcastJob)
+        .where(BroadcastJob.id == job_id, BroadcastJob.status.in_(ACTIVE_STATUSES))
+        .values(status='cancelled', finished_at=datetime.now(), updated_at=datetime.now())
+    )
+    return result.rowcount > 0
+
+def progress_keyboard(job):
+    """زر الإيقاف ما دام البث نشطاً"""
+    if job.status not in ACTIVE_STATUSES:
+        return None
+    return InlineKeyboardMarkup([[InlineKeyboardButton("⛔ إيقاف البث", callback_data=f"cancel_broadcast_{job.id}")]])
+
+def progress_text(job) -> str:
+    done = job.sent + job.failed + job.blocked
+    percent = min(100, done * 100 // job.total) if job.total else 0
+    titles = {'pending': '⏳ في الانتظار', 'running': '📤 جاري الإرسال', 'completed': '✅ اكتمل', 'cancelled': '⛔ أُلغي'}
+    text = (
+        f"📨 البث #{job.id}: {titles.get(job.status, job.status)}\n\n"
+        f"📊 التقدم: {done} من ~{job.total} ({percent}%)\n"
+        f"✅ وصلت: {job.sent}\n"
+        f"🚫 حظروا البوت: {job.blocked}\n"
+        f"❌ فشلت: {job.failed}"
+    )
+    if job.points:
+        text += f"\n⭐ نقاط لكل مستلم: {job.points}"
+    return text
+
+# ==================== الإرسال ====================
+class Broadcaster:
+    """إرسال مهام البث صفحة بعد صفحة بالمؤشر على User.id
+
+    كل صفحة تُرسل بتزامن محدود (الحد الفعلي للمعدل من مجدول الطلبات بأولوية الخلفية)،
+    ثم تُحفظ في معاملة واحدة: المؤشر والعدادات، علامة من حظروا البوت، ونقاط المستلمين.
+    بعد انقطاع تُعاد الصفحة الأخيرة فقط: الرسالة قد تصل مرتين والنقاط لا تضاف مرتين.
+    """
+
+    def __init__(self, bot, session_factory=None, page_size: int = None, concurrency: int = None,
+                 progress_interval: float = None):
+        self.bot = bot
+        self._session_factory = session_factory or get_db
+        self.page_size = page_size or Config.BROADCAST_PAGE_SIZE
+        self._semaphore = asyncio.Semaphore(concurrency or Config.BROADCAST_CONCURRENCY)
+        self.progress_interval = Config.BROADCAST_PROGRESS_INTERVAL if progress_interval is None else progress_interval
+        self._reported = {}
+
+    async def _deliver(self, user_id: int, text: str) -> str:
+        async with self._semaphore:
+            try:
+                await self.bot.send_message(user_id, text, rate_limit_args={'priority': BACKGROUND})
+                return 'sent'
+            except Forbidden:
+                return 'blocked'
+            except BadRequest as e:
+                # حساب محذوف أو لم يبدأ محادثة مع البوت
+                return 'blocked' if 'chat not found' in str(e).lower() else 'failed'
+            except TelegramError as e:
+                logger.warning(f"فشل إرسال البث للمستخدم {user_id}: {e}")
+                return 'failed'
+
+    async def _report(self, job, force: bool = False):
+        """تحديث رسالة التقدم عند المشرف (مرة كل progress_interval ثانية على الأكثر)"""
+        if not job.progress_chat_id or not job.progress_message_id:
+            return
+        now = time.monotonic()
+        if not force and now - self._reported.get(job.id, 0) < self.progress_interval:
+            return
+        self._reported[job.id] = now
+        try:
+            await self.bot.edit_message_text(
+                progress_text(job),
+                chat_id=job.progress_chat_id,
+                message_id=job.progress_message_id,
+                reply_markup=progress_keyboard(job),
+                rate_limit_args={'priority': ADMIN},
+            )
+        except TelegramError as e:
+            logger.debug(f"تعذر تحديث رسالة تقدم البث #{job.id}: {e}")
+
+    async def run_page(self, job_id: int):
+        """إرسال صفحة واحدة وحفظ نتيجتها؛ يرجع المهمة بعد الحفظ أو None إذا لم تعد نشطة"""
+        db = self._session_factory()
+        try:
+            job = await db.get(BroadcastJob, job_id)
+            if job is None or job.status not in ACTIVE_STATUSES:
+                return None
+            recipients = (await db.execute(
+                select(User.id, User.user_id)
+                .where(User.id > job.last_user_pk, User.is_banned == False, User.bot_blocked == False)
+                .order_by(User.id)
+                .limit(self.page_size)
+            )).all()
+            if not recipients:
+                job.status = 'completed'
+                job.finished_at = job.updated_at = datetime.now()
+                await db.commit()
+                return job
+            if job.status == 'pending':
+                job.status = 'running'
+            # لا نبقي المعاملة مفتوحة أثناء الإرسال الطويل
+            await db.commit()
+
+            results = await asyncio.gather(*[self._deliver(user_id, job.text) for _, user_id in recipients])
+
+            # قد يكون المشرف ألغى المهمة أثناء الإرسال: نحفظ ما أُرسل فعلاً
+            await db.refresh(job)
+            delivered = [user_id for (_, user_id), result in zip(recipients, results) if result == 'sent']
+            blocked = [user_id for (_, user_id), result in zip(recipients, results) if result == 'blocked']
+            if blocked:
+                await db.execute(
+                    update(User).where(User.user_id.in_(blocked)).values(bot_blocked=True)
+                    .execution_options(synchronize_session=False)
+                )
+            if job.points:
+                await credit_many(db, delivered, job.points, 'broadcast', job.id)
+            job.last_user_pk = recipients[-1].id
+            job.sent += len(delivered)
+            job.blocked += len(blocked)
+            job.failed += len(results) - len(delivered) - len(blocked)
+            job.updated_at = datetime.now()
+            await db.commit()
+            return job
+        except Exception:
+            await db.rollback()
+            raise
+        finally:
+            await db.close()
+
+    async def run(self, job_id: int):
+        """إرسال المهمة حتى تنتهي أو تُلغى"""
+        while True:
+            job = await self.run_page(job_id)
+            if job is None:
+                return
+            finished = job.status not in ACTIVE_STATUSES
+            await self._report(job, force=finished)
+            if finished:
+                self._reported.pop(job.id, None)
+                logger.info(f"انتهى البث #{job.id}: {job.sent} وصلت، {job.blocked} محظور، {job.failed} فشلت")
+                return
+
+async def process_broadcasts(bot, interval: int = 5):
+    """مهمة خلفية: تشغيل مهام البث الجديدة واستئناف غير المكتملة بعد إعادة التشغيل"""
+    broadcaster = Broadcaster(bot)
+    while True:
+        try:
+            db = get_db()
+            try:
+                job_ids = (await db.scalars(
+                    select(BroadcastJob.id).where(BroadcastJob.status.in_(ACTIVE_STATUSES)).order_by(BroadcastJob.id)
+                )).all()
+            finally:
+                await db.close()
+            for job_id in job_ids:
+                await broadcaster.run(job_id)
+        except Exception as e:
+            logger.error(f"خطأ في معالجة البث: {e}")
+        await asyncio.sleep(interval)
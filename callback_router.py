@@ -0,0 +1,102 @@
+import logging
+from typing import NamedTuple, Callable
+from telegram import Update
+from telegram.ext import ContextTypes
+from settings_cache import settings_cache
+from user_cache import user_cache
+from metrics import measure_handler, self_measured
+
+logger = logging.getLogger(__name__)
+
+# مفتاح نهاية المسار في عقد شجرة البادئات (لا يتعارض مع مفاتيح الحروف)
+_END = ''
+
+class Route(NamedTuple):
+    callback: Callable
+    admin_only: bool
+    # الرد على الزر قبل الاستدعاء (المعالجات التي ترد بنفسها تمرر False)
+    answer: bool
+
+class CallbackRouter:
+    """توجيه ضغطات الأزرار من جدول واحد
+
+    البيانات الثابتة (admin_stats) في قاموس بتكلفة ثابتة، وذات المعاملات
+    (approve_request_<id>) في شجرة بادئات حرفية: تكلفة البحث بطول البيانات لا بعدد
+    المسارات، ويفوز أطول بادئة مطابقة. كل معالج يسجل نفسه بـ @router.route.
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._trie = {}
+        self._prefixes = 0
+
+    def __len__(self):
+        return len(self._exact) + self._prefixes
+
+    def add(self, data: str, callback, prefix: bool = False, admin_only: bool = False, answer: bool = True):
+        route = Route(callback, admin_only, answer)
+        if not prefix:
+            if data in self._exact:
+                raise ValueError(f"مسار مكرر: {data}")
+            self._exact[data] = route
+            return callback
+        node = self._trie
+        for char in data:
+            node = node.setdefault(char, {})
+        if _END in node:
+            raise ValueError(f"بادئة مكررة: {data}")
+        node[_END] = route
+        self._prefixes += 1
+        return callback
+
+    def route(self, *data: str, prefix: bool = False, admin_only: bool = False, answer: bool = True):
+        """مزخرف لتسجيل معالج لقيمة أو أكثر من callback_data"""
+        def register(callback):
+            for value in data:
+                self.add(value, callback, prefix=prefix, admin_only=admin_only, answer=answer)
+            return callback
+        return register
+
+    def resolve(self, data: str):
+        """المسار المطابق أو None"""
+        route = self._exact.get(data)
+        if route is not None:
+            return route
+        node = self._trie
+        for char in data:
+            node = node.get(char)
+            if node is None:
+                break
+            route = node.get(_END, route)
+        return route
+
+    @self_measured
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """معالج PTB الوحيد لكل ضغطات الأزرار"""
+        query = update.callback_query
+        route = self.resolve(query.data or '')
+        if route is None:
+            # زر قديم أو بلا معالج: إيقاف مؤشر التحميل فقط
+            await query.answer()
+            return
+
+        db = context.db
+        if route.admin_only:
+            user = await user_cache.get(db, query.from_user.id)
+            if not user or not user.is_admin:
+                await query.answer("❌ ليس لديك صلاحية!", show_alert=True)
+                return
+        else:
+            # وضع الصيانة يوقف أزرار المستخدمين فقط (المشرف يستطيع إيقافه من اللوحة)
+            settings = await settings_cache.system(db)
+            if settings and settings.maintenance_mode:
+                await query.answer()
+                await query.message.reply_text(f"🔧 {settings.maintenance_message}")
+                return
+
+        if route.answer:
+            await query.answer()
+        with measure_handler(getattr(route.callback, '__name__', 'callback')):
+            await route.callback(update, context)
+
+router = CallbackRouter()
@@ -10,6 +10,19 @@ class Config:
     
     # إعدادات قاعدة البيانات
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///bot_database.db")
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+    # شاشات التقارير تقرأ عبر مجمع اتصالات مستقل: نسخة قراءة (replica) إن وجدت وإلا نفس القاعدة
+    DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", "")
+    DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 2))
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 64 * 1024))
+    # ملفات SQLite مستقلة (ATTACH) لجداول الكتابة الكثيفة؛ الفارغ يبقيها في الملف الرئيسي
+    SQLITE_LEDGER_DATABASE = os.getenv("SQLITE_LEDGER_DATABASE", "")
+    SQLITE_JOBS_DATABASE = os.getenv("SQLITE_JOBS_DATABASE", "")
     
     # إعدادات النظام
     MAINTENANCE_MODE = False
@@ -27,4 +40,58 @@ class Config:
     # إعدادات الأداء
     MAX_MEMBERS_PER_REQUEST = 50
     ADD_MEMBERS_DELAY = 1
-    PORT = 8080
+    # فترة التحقق من تعديل الإعدادات من عملية أخرى
+    SETTINGS_REFRESH_SECONDS = int(os.getenv("SETTINGS_REFRESH_SECONDS", 30))
+    # ذاكرة بيانات المستخدمين (عدد المستخدمين ومدة الصلاحية بالثواني)
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+    USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 60))
+    # قائمة القنوات الإجبارية والاشتراكات المؤكدة (مدة الصلاحية بالثواني)
+    MANDATORY_CHANNELS_TTL = int(os.getenv("MANDATORY_CHANNELS_TTL", 300))
+    MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", 50000))
+    MEMBERSHIP_CACHE_TTL = int(os.getenv("MEMBERSHIP_CACHE_TTL", 600))
+    # عمر سجل الاشتراك المحلي الذي يُعتمد عليه بدون سؤال Telegram (بالثواني)
+    MEMBERSHIP_RECORD_TTL = int(os.getenv("MEMBERSHIP_RECORD_TTL", 24 * 3600))
+    # لقطات أرصدة سجل النقاط (بالثواني) ومدة الاحتفاظ بالحركات بعد دخولها في لقطة (بالأيام)
+    LEDGER_SNAPSHOT_INTERVAL = int(os.getenv("LEDGER_SNAPSHOT_INTERVAL", 3600))
+    LEDGER_RETENTION_DAYS = int(os.getenv("LEDGER_RETENTION_DAYS", 90))
+    # فترة مطابقة عدادات الإحصائيات مع الجداول، وفترة كتابة الفروقات المجمعة في الذاكرة (بالثواني)
+    STATS_RECONCILE_INTERVAL = int(os.getenv("STATS_RECONCILE_INTERVAL", 3600))
+    STATS_FLUSH_INTERVAL = int(os.getenv("STATS_FLUSH_INTERVAL", 10))
+    # تجميع الكتابات الصغيرة (الهدية اليومية، التسجيل، الإحالات) في commit واحد
+    WRITE_QUEUE_DELAY_MS = int(os.getenv("WRITE_QUEUE_DELAY_MS", 5))
+    WRITE_QUEUE_MAX_BATCH = int(os.getenv("WRITE_QUEUE_MAX_BATCH", 200))
+    # أرشفة الطلبات المنتهية والتحويلات القديمة (الفترة بالثواني، العمر بالأيام)
+    ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", 6 * 3600))
+    ARCHIVE_REQUESTS_AFTER_DAYS = int(os.getenv("ARCHIVE_REQUESTS_AFTER_DAYS", 7))
+    ARCHIVE_TRANSFERS_AFTER_DAYS = int(os.getenv("ARCHIVE_TRANSFERS_AFTER_DAYS", 30))
+    ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 1000))
+    # قائمة المشرفين في الذاكرة (بالثواني) وعدد إشعارات المشرفين المرسلة معاً
+    ADMIN_ROSTER_TTL = int(os.getenv("ADMIN_ROSTER_TTL", 300))
+    ADMIN_NOTIFY_CONCURRENCY = int(os.getenv("ADMIN_NOTIFY_CONCURRENCY", 10))
+    # البث: مستخدمون لكل صفحة (يُحفظ التقدم بعد كل صفحة)، إرسال متزامن، فحص المهام وتحديث رسالة التقدم (بالثواني)
+    BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", 500))
+    BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 25))
+    BROADCAST_POLL_INTERVAL = int(os.getenv("BROADCAST_POLL_INTERVAL", 5))
+    BROADCAST_PROGRESS_INTERVAL = int(os.getenv("BROADCAST_PROGRESS_INTERVAL", 5))
+    # حدود Bot API: رسائل في الثانية لكل البوت، لكل محادثة خاصة، ولكل مجموعة/قناة في الدقيقة
+    RATE_LIMIT_OVERALL = float(os.getenv("RATE_LIMIT_OVERALL", 30))
+    RATE_LIMIT_PER_CHAT = float(os.getenv("RATE_LIMIT_PER_CHAT", 1))
+    RATE_LIMIT_GROUP_PER_MINUTE = float(os.getenv("RATE_LIMIT_GROUP_PER_MINUTE", 20))
+    RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", 2))
+    # تحديثات تُعالج معاً (تحديثات المستخدم الواحد دائماً بالترتيب)، والحد الأقصى للتحديثات المقبولة بما فيها المنتظرة
+    # آمن مع SQLite لأن كتابات التحديث تُحفظ قبل كل طلب Bot API فلا يُحجز القفل أثناء الانتظار
+    CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", 16))
+    MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", 1000))
+    # حفظ user_data في قاعدة البيانات كل عدة ثوانٍ (المفاتيح المتغيرة فقط)؛ SHARED يعيد قراءة
+    # حالة المستخدم قبل كل تحديث عند تشغيل أكثر من عملية بوت على نفس القاعدة
+    PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", 5))
+    PERSISTENCE_SHARED = os.getenv("PERSISTENCE_SHARED", "false").lower() == "true"
+    # خادم HTTP (الصحة وwebhook) على نفس حلقة البوت
+    PORT = int(os.getenv("PORT", 8080))
+    # عنوان HTTPS العام للبوت؛ فارغ = استقبال التحديثات بالـpolling
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+    # رمز التحقق في رأس طلبات تليجرام (A-Z a-z 0-9 _ -)؛ فارغ = رمز عشوائي عند كل تشغيل
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+    # رمز Bearer مطلوب لقراءة /metrics؛ فارغ = مفتوحة
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
@@ -1,11 +1,20 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, BigInteger, DateTime, Text, Float
+from sqlalchemy import Column, Integer, String, Boolean, BigInteger, DateTime, Text, Float, Index, select, func, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+from config import Config
+from metrics import instrument_engine
 from datetime import datetime
 import json
 
 Base = declarative_base()
 
+# مخططات رمزية لجداول الكتابة الكثيفة. في SQLite يمكن وضع كل منها في ملف مستقل مرفق
+# (ATTACH) بقفل كتابة وWAL خاص به؛ وإلا تُترجم إلى المخطط الافتراضي (انظر schema_map)
+LEDGER_SCHEMA = 'ledger'  # سجل النقاط واللقطات والتحويلات
+JOBS_SCHEMA = 'jobs'      # طلبات التمويل وتقدم إضافة الأعضاء
+
 class User(Base):
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True)
@@ -21,7 +30,17 @@ class User(Base):
     is_admin = Column(Boolean, default=False)
     admin_permissions = Column(String(500), default='[]')
     last_daily_gift = Column(DateTime, nullable=True)
+    # المستخدم حظر البوت (فشل الإرسال بـ Forbidden)؛ يتخطاه البث حتى يعود
+    bot_blocked = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        # البحث بالمعرف في أوامر المشرفين (/ban @username ...)
+        Index('ix_users_username', 'username'),
+        Index('ix_users_is_admin', 'is_admin'),
+        # ترقيم قائمة المستخدمين بالمؤشر (created_at, id)
+        Index('ix_users_created_id', 'created_at', 'id'),
+    )
 
 class Channel(Base):
     __tablename__ = 'channels'
@@ -35,6 +54,19 @@ class Channel(Base):
     current_members = Column(Integer, default=0)
     added_by_admin = Column(BigInteger)
     created_at = Column(DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        Index('ix_channels_is_mandatory', 'is_mandatory'),
+    )
+
+class ChannelMembership(Base):
+    """اشتراك المستخدم في قناة إجبارية: من تحديثات chat_member أو آخر فحص عبر API"""
+    __tablename__ = 'channel_memberships'
+    user_id = Column(BigInteger, primary_key=True)
+    # نفس قيمة Channel.channel_id
+    channel_id = Column(String(100), primary_key=True)
+    status = Column(String(20), nullable=False)
+    updated_at = Column(DateTime, default=datetime.now)
 
 class GroupSource(Base):
     __tablename__ = 'group_sources'
@@ -62,6 +94,16 @@ class FundingRequest(Base):
     notes = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    __table_args__ = (
+        # الطلبات حسب الحالة مرتبة بالوقت (لوحة الطلبات ومعالج الطلبات المعتمدة)
+        Index('ix_funding_requests_status_created', 'status', 'created_at'),
+        # طلبات المستخدم مرتبة بالوقت (طلباتي)
+        Index('ix_funding_requests_user_created', 'user_id', 'created_at'),
+        # الأرشفة تحذف أعلى الأرقام أحياناً؛ بدون AUTOINCREMENT يعيدها SQLite لطلبات جديدة
+        # (تتصادم في الأرشيف وفي أزرار approve_request_<id>)
+        {'schema': JOBS_SCHEMA, 'sqlite_autoincrement': True},
+    )
 
 class PointsTransfer(Base):
     __tablename__ = 'points_transfers'
@@ -73,6 +115,103 @@ class PointsTransfer(Base):
     fee_amount = Column(Integer, nullable=False)
     net_amount = Column(Integer, nullable=False)
     transfer_date = Column(DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        # سجل المستخدم: طرفا التحويل كل منهما مع الوقت حتى يُقرأ OR كاتحاد فهرسين
+        Index('ix_points_transfers_from_date', 'from_user_id', 'transfer_date'),
+        Index('ix_points_transfers_to_date', 'to_user_id', 'transfer_date'),
+        Index('ix_points_transfers_date', 'transfer_date'),
+        {'schema': LEDGER_SCHEMA, 'sqlite_autoincrement': True},
+    )
+
+class FundingRequestArchive(Base):
+    """طلبات التمويل المنتهية (مكتملة/فاشلة/مرفوضة) بعد نقلها من الجدول الساخن"""
+    __tablename__ = 'funding_requests_archive'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)
+    target_channel = Column(String(100), nullable=False)
+    target_type = Column(String(20), nullable=False)
+    requested_members = Column(Integer, nullable=False)
+    points_cost = Column(Integer, nullable=False)
+    status = Column(String(20))
+    approved_by = Column(BigInteger, nullable=True)
+    completed_members = Column(Integer, default=0)
+    notes = Column(Text, nullable=True)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        Index('ix_funding_requests_archive_user_created', 'user_id', 'created_at'),
+        Index('ix_funding_requests_archive_status', 'status'),
+        {'schema': JOBS_SCHEMA},
+    )
+
+class PointsTransferArchive(Base):
+    """التحويلات القديمة بعد نقلها من الجدول الساخن"""
+    __tablename__ = 'points_transfers_archive'
+    id = Column(Integer, primary_key=True)
+    from_user_id = Column(BigInteger, nullable=False)
+    to_user_id = Column(BigInteger, nullable=False)
+    amount = Column(Integer, nullable=False)
+    fee_percent = Column(Integer, nullable=False)
+    fee_amount = Column(Integer, nullable=False)
+    net_amount = Column(Integer, nullable=False)
+    transfer_date = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        Index('ix_points_transfers_archive_from_date', 'from_user_id', 'transfer_date'),
+        Index('ix_points_transfers_archive_to_date', 'to_user_id', 'transfer_date'),
+        Index('ix_points_transfers_archive_date', 'transfer_date'),
+        {'schema': LEDGER_SCHEMA},
+    )
+
+class PointsLedger(Base):
+    """سجل إلحاقي لكل حركة نقاط (لا يُعدل ولا يُحذف منه إلا بالضغط بعد اللقطة)"""
+    __tablename__ = 'points_ledger'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)
+    delta = Column(Integer, nullable=False)
+    balance_after = Column(Integer, nullable=False)
+    # opening, referral, daily_gift, funding, refund, transfer_in, transfer_out, admin_grant
+    reason = Column(String(30), nullable=False)
+    # الطلب أو المستخدم المرتبط بالحركة
+    ref_id = Column(BigInteger, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        # سجل المستخدم والرصيد منذ آخر لقطة: مسح فهرس واحد
+        Index('ix_points_ledger_user_id', 'user_id', 'id'),
+        Index('ix_points_ledger_created', 'created_at'),
+        # اللقطات تحفظ حدها بالرقم؛ بعد ضغط كل الحركات يجب ألا تعود الأرقام تحته
+        {'schema': LEDGER_SCHEMA, 'sqlite_autoincrement': True},
+    )
+
+class BalanceSnapshot(Base):
+    """رصيد كل مستخدم محسوب من السجل حتى الحركة ledger_id"""
+    __tablename__ = 'balance_snapshots'
+    __table_args__ = {'schema': LEDGER_SCHEMA}
+    user_id = Column(BigInteger, primary_key=True)
+    balance = Column(Integer, nullable=False, default=0)
+    ledger_id = Column(Integer, nullable=False, default=0)
+    taken_at = Column(DateTime, default=datetime.now)
+
+class SystemStats(Base):
+    """عدادات لوحة الإحصائيات (صف واحد تُكتب فيه فروقات المعاملات دورياً وتصححه مهمة المطابقة)"""
+    __tablename__ = 'system_stats'
+    id = Column(Integer, primary_key=True)
+    users = Column(Integer, default=0)
+    admins = Column(Integer, default=0)
+    banned = Column(Integer, default=0)
+    points = Column(BigInteger, default=0)
+    requests = Column(Integer, default=0)
+    requests_pending = Column(Integer, default=0)
+    requests_completed = Column(Integer, default=0)
+    transfers = Column(Integer, default=0)
+    channels = Column(Integer, default=0)
+    groups = Column(Integer, default=0)
+    reconciled_at = Column(DateTime, nullable=True)
 
 class SystemSettings(Base):
     __tablename__ = 'system_settings'
@@ -83,6 +222,8 @@ class SystemSettings(Base):
     transfer_fee_percent = Column(Integer, default=5)
     updated_by = Column(BigInteger, nullable=True)
     updated_at = Column(DateTime, default=datetime.now)
+    # يزيد مع كل تعديل حتى تكتشف العمليات الأخرى أن نسختها المخزنة قديمة
+    version = Column(Integer, default=0)
 
 class PointsSettings(Base):
     __tablename__ = 'points_settings'
@@ -94,6 +235,7 @@ class PointsSettings(Base):
     min_points_for_funding = Column(Integer, default=25)
     updated_by = Column(BigInteger, nullable=True)
     updated_at = Column(DateTime, default=datetime.now)
+    version = Column(Integer, default=0)
 
 class AdminContact(Base):
     __tablename__ = 'admin_contacts'
@@ -104,36 +246,225 @@ class AdminContact(Base):
     added_by = Column(BigInteger)
     added_at = Column(DateTime, default=datetime.now)
 
-# إنشاء المحرك والجلسة
-engine = create_engine('sqlite:///bot_database.db', echo=False)
-SessionLocal = sessionmaker(bind=engine)
+class BroadcastJob(Base):
+    """رسالة جماعية وتقدمها؛ last_user_pk هو مؤشر آخر User.id عولج فيُستأنف منه بعد إعادة التشغيل"""
+    __tablename__ = 'broadcast_jobs'
+    __table_args__ = {'schema': JOBS_SCHEMA}
+    id = Column(Integer, primary_key=True)
+    created_by = Column(BigInteger, nullable=False)
+    text = Column(Text, nullable=False)
+    # نقاط تضاف لكل من وصلته الرسالة (0 لرسالة نصية فقط)
+    points = Column(Integer, default=0)
+    status = Column(String(20), default='pending')  # pending, running, completed, cancelled
+    last_user_pk = Column(Integer, default=0)
+    total = Column(Integer, default=0)  # تقدير عند الإنشاء لعرض النسبة
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    blocked = Column(Integer, default=0)
+    # رسالة التقدم عند المشرف
+    progress_chat_id = Column(BigInteger)
+    progress_message_id = Column(Integer)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
+
+class PersistentState(Base):
+    """حالة PTB المحفوظة: صف لكل مفتاح في user_data أو chat_data أو bot_data أو حالة محادثة
+
+    القيم JSON، وتُكتب المفاتيح التي تغيرت فقط (انظر persistence.py).
+    """
+    __tablename__ = 'persistent_state'
+    kind = Column(String(64), primary_key=True)  # user, chat, bot, conversation:<name>
+    owner = Column(String(64), primary_key=True)  # معرف المستخدم/المحادثة، '' لـbot_data
+    key = Column(String(255), primary_key=True)
+    value = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now)
+
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+    version = Column(Integer, primary_key=True)
+    description = Column(String(200))
+    applied_at = Column(DateTime, default=datetime.now)
+
+# ==================== المحرك ====================
+# المشغلات غير المتزامنة الافتراضية لكل نوع قاعدة بيانات
+ASYNC_DRIVERS = {
+    'sqlite': 'aiosqlite',
+    'postgresql': 'asyncpg',
+    'mysql': 'aiomysql',
+}
+# مشغلات غير متزامنة يحددها المستخدم صراحة ونتركها كما هي
+KNOWN_ASYNC_DRIVERS = {'aiosqlite', 'asyncpg', 'psycopg', 'psycopg_async', 'aiomysql', 'asyncmy'}
+# أسماء بديلة شائعة (مثل روابط Heroku التي تبدأ بـ postgres://)
+BACKEND_ALIASES = {'postgres': 'postgresql'}
+
+def to_async_url(url: str):
+    """تحويل رابط قاعدة البيانات إلى مشغل غير متزامن (مع استبدال أي مشغل متزامن صريح)"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    backend = BACKEND_ALIASES.get(backend, backend)
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"نوع قاعدة البيانات غير مدعوم في DATABASE_URL: {url.drivername}")
+    
+    driver = url.get_driver_name() if '+' in url.drivername else None
+    if driver not in KNOWN_ASYNC_DRIVERS:
+        driver = ASYNC_DRIVERS[backend]
+    return url.set(drivername=f"{backend}+{driver}")
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """ضبط SQLite عند فتح كل اتصال جديد"""
+    cursor = dbapi_connection.cursor()
+    try:
+        # WAL: القراءة لا تنتظر الكتابة، و NORMAL يكتفي بـ fsync عند نقاط التفتيش
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={Config.SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={Config.SQLITE_MMAP_SIZE}")
+        # القيمة السالبة تعني الحجم بالكيلوبايت بدلاً من عدد الصفحات
+        cursor.execute(f"PRAGMA cache_size=-{Config.SQLITE_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+def sqlite_attachments() -> dict:
+    """ملفات SQLite المرفقة لكل مخطط رمزي حسب الإعدادات (الفارغ يبقى في الملف الرئيسي)"""
+    paths = {LEDGER_SCHEMA: Config.SQLITE_LEDGER_DATABASE, JOBS_SCHEMA: Config.SQLITE_JOBS_DATABASE}
+    return {schema: path for schema, path in paths.items() if path}
+
+def schema_map(attached: dict) -> dict:
+    """ترجمة المخططات الرمزية: اسم الملف المرفق أو المخطط الافتراضي"""
+    return {schema: (schema if schema in attached else None) for schema in (LEDGER_SCHEMA, JOBS_SCHEMA)}
+
+def attach_sqlite_databases(attached: dict):
+    """مستمع connect يرفق الملفات الإضافية بكل اتصال جديد مع WAL مستقل لكل ملف"""
+    def attach(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for schema, path in attached.items():
+                cursor.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+                cursor.execute(f"PRAGMA {schema}.journal_mode=WAL")
+                cursor.execute(f"PRAGMA {schema}.synchronous=NORMAL")
+        finally:
+            cursor.close()
+    return attach
 
-def get_db():
-    """الحصول على جلسة قاعدة البيانات"""
-    db = SessionLocal()
+def set_sqlite_query_only(dbapi_connection, connection_record):
+    """اتصالات القراءة: SQLite نفسه يرفض أي كتابة تصل عبرها"""
+    cursor = dbapi_connection.cursor()
     try:
-        return db
+        cursor.execute("PRAGMA query_only=ON")
     finally:
-        db.close()
+        cursor.close()
+
+def is_in_memory(url) -> bool:
+    url = to_async_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+def create_db_engine(url: str = None, echo: bool = False, attached: dict = None,
+                     read_only: bool = False, pool_size: int = None):
+    """إنشاء محرك قاعدة البيانات حسب DATABASE_URL مع مجمع اتصالات مضبوط
+
+    attached: {مخطط رمزي: مسار ملف} لـ SQLite (الافتراضي من الإعدادات). كل ملف مرفق له
+    قفل كتابة مستقل، فتيارات الكتابة المنفصلة لا تنتظر بعضها. في وضع WAL تكون المعاملة
+    التي تكتب في أكثر من ملف ذرية لكل ملف على حدة فقط عند انقطاع مفاجئ.
+    read_only: اتصالات ترفض الكتابة (query_only في SQLite، معاملات READ ONLY في PostgreSQL).
+    """
+    url = to_async_url(url or Config.DATABASE_URL)
+    pool_size = pool_size or Config.DB_POOL_SIZE
+    
+    if url.get_backend_name() != 'sqlite':
+        engine = create_async_engine(
+            url,
+            echo=echo,
+            pool_size=pool_size,
+            max_overflow=Config.DB_MAX_OVERFLOW,
+            pool_timeout=Config.DB_POOL_TIMEOUT,
+            pool_recycle=Config.DB_POOL_RECYCLE,
+            pool_pre_ping=True
+        )
+        options = {'schema_translate_map': schema_map({})}
+        if read_only and url.get_backend_name() == 'postgresql':
+            options['postgresql_readonly'] = True
+        return engine.execution_options(**options)
+    
+    attached = sqlite_attachments() if attached is None else attached
+    if is_in_memory(url):
+        # قاعدة في الذاكرة: يجب مشاركة اتصال واحد وإلا يرى كل اتصال قاعدة فارغة
+        engine = create_async_engine(url, echo=echo, poolclass=StaticPool)
+        attached = {}
+    else:
+        engine = create_async_engine(
+            url,
+            echo=echo,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=pool_size,
+            max_overflow=Config.DB_MAX_OVERFLOW,
+            pool_timeout=Config.DB_POOL_TIMEOUT,
+            connect_args={'timeout': Config.SQLITE_BUSY_TIMEOUT_MS / 1000}
+        )
+    event.listen(engine.sync_engine, 'connect', apply_sqlite_pragmas)
+    if attached:
+        event.listen(engine.sync_engine, 'connect', attach_sqlite_databases(attached))
+    if read_only:
+        event.listen(engine.sync_engine, 'connect', set_sqlite_query_only)
+    return engine.execution_options(schema_translate_map=schema_map(attached))
+
+def create_read_engine(url: str = None, replica_url: str = None, attached: dict = None):
+    """محرك القراءة لشاشات التقارير بمجمع اتصالات مستقل عن مسار الكتابة
+
+    يستخدم DATABASE_READ_URL (نسخة قراءة في PostgreSQL) إن وجد، وإلا نفس القاعدة باتصالات
+    للقراءة فقط (في SQLite مع WAL لا ينتظر القارئ الكاتب). قاعدة الذاكرة لا يمكن فتحها
+    باتصال ثانٍ، فيرجع None ويبقى المحرك الرئيسي.
+    """
+    url = url or Config.DATABASE_URL
+    replica_url = Config.DATABASE_READ_URL if replica_url is None else replica_url
+    source = replica_url or url
+    if is_in_memory(source):
+        return None
+    return create_db_engine(source, attached=attached, read_only=True, pool_size=Config.DB_READ_POOL_SIZE)
+
+# علامة في session.info لجلسات القراءة (لا تكتب ولا تملأ الذاكرات المؤقتة المشتركة)
+READ_ONLY_KEY = 'read_only'
 
-def init_database():
+# إنشاء المحرك والجلسة
+engine = create_db_engine()
+# expire_on_commit=False: الكائنات تبقى صالحة بعد commit بدون إعادة جلبها (ضروري مع AsyncSession)
+SessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
+# جلسات شاشات التقارير (المحرك الرئيسي نفسه إذا لم يمكن فتح محرك قراءة مستقل)
+read_engine = create_read_engine() or engine
+instrument_engine(engine, 'write')
+if read_engine is not engine:
+    instrument_engine(read_engine, 'read')
+ReadSessionLocal = async_sessionmaker(bind=read_engine, expire_on_commit=False, info={READ_ONLY_KEY: True})
+
+def get_db() -> AsyncSession:
+    """الحصول على جلسة قاعدة البيانات (يجب إغلاقها بـ await db.close())"""
+    return SessionLocal()
+
+async def init_database():
     """تهيئة قاعدة البيانات"""
-    Base.metadata.create_all(engine)
+    # استيراد متأخر لأن ملف الترحيلات يعتمد على النماذج المعرفة هنا
+    from migrations import run_migrations
+    
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    # create_all لا يضيف الفهارس الجديدة لجداول موجودة مسبقاً
+    await run_migrations(engine)
     db = get_db()
     
     try:
         # إعدادات النظام
-        if db.query(SystemSettings).count() == 0:
+        if await db.scalar(select(func.count()).select_from(SystemSettings)) == 0:
             system_settings = SystemSettings()
             db.add(system_settings)
         
         # إعدادات النقاط
-        if db.query(PointsSettings).count() == 0:
+        if await db.scalar(select(func.count()).select_from(PointsSettings)) == 0:
             points_settings = PointsSettings()
             db.add(points_settings)
         
         # المدير الرئيسي
-        admin_user = db.query(User).filter_by(user_id=6130994941).first()
+        admin_user = await db.scalar(select(User).filter_by(user_id=6130994941))
         if not admin_user:
             admin_user = User(
                 user_id=6130994941,
@@ -144,10 +475,10 @@ def init_database():
             )
             db.add(admin_user)
         
-        db.commit()
+        await db.commit()
         print("✅ تم تهيئة قاعدة البيانات بنجاح")
     except Exception as e:
         print(f"❌ خطأ في تهيئة قاعدة البيانات: {e}")
-        db.rollback()
+        await db.rollback()
     finally:
-        db.close()
+        await db.close()
@@ -1,12 +1,24 @@
 import asyncio
 import logging
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler
+import secrets
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ChatMemberHandler, ContextTypes
 from config import Config
-from database import init_database
-from bot_handlers import start_command, handle_message, button_handler
-from admin_handlers import handle_admin_callback, handle_admin_input, approve_funding_request, reject_funding_request
+from database import init_database, engine, read_engine
+from bot_handlers import start_command, handle_message, track_channel_membership
+from callback_router import router
 from member_adder import process_pending_requests
-from keep_alive import keep_alive
+from settings_cache import watch_settings
+from points_ledger import snapshot_ledger
+from stats_counters import reconcile_stats, flush_stats
+from write_queue import write_queue
+from archive import archive_periodically
+from broadcast import process_broadcasts
+from web_server import ALLOWED_UPDATES, create_web_app, start_web_server
+from unit_of_work import BotApplication, BotContext, UnitOfWorkBot
+from rate_limiter import PriorityRateLimiter
+from update_processor import PerUserUpdateProcessor
+from persistence import DatabasePersistence
+from metrics import registry
 
 # إعداد التسجيل
 logging.basicConfig(
@@ -25,46 +37,104 @@ async def main():
     
     # تهيئة قاعدة البيانات
     print("🔄 جاري تهيئة قاعدة البيانات...")
-    init_database()
-    
-    # بدء خدمات البقاء نشط (للسيرفرات المجانية)
-    keep_alive()
-    print("✅ تم تشغيل خدمات البقاء نشط")
+    await init_database()
     
     # إنشاء تطبيق البوت
     print("🤖 جاري إنشاء تطبيق البوت...")
-    application = Application.builder().token(Config.BOT_TOKEN).build()
+    # كل طلبات Bot API تمر عبر جدولة واحدة بالأولوية
+    rate_limiter = PriorityRateLimiter()
+    registry.register(rate_limiter.collect)
+    # المستخدمون المختلفون بالتوازي، وتحديثات المستخدم الواحد بالترتيب
+    update_processor = PerUserUpdateProcessor(Config.CONCURRENT_UPDATES, Config.MAX_PENDING_UPDATES)
+    registry.register(update_processor.collect)
+    # كل تحديث يحصل على جلسة قاعدة بيانات واحدة عبر context.db، تُحفظ كتاباتها قبل كل طلب Bot API
+    application = (
+        Application.builder()
+        .bot(UnitOfWorkBot(Config.BOT_TOKEN, rate_limiter=rate_limiter))
+        .concurrent_updates(update_processor)
+        # user_data (تدفق طلب التمويل ومدخلات المشرف) ينجو من إعادة التشغيل
+        .persistence(DatabasePersistence())
+        .application_class(BotApplication)
+        .context_types(ContextTypes(context=BotContext))
+        .build()
+    )
     
     # إضافة المعالجات
     application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CallbackQueryHandler(button_handler))
-    application.add_handler(CallbackQueryHandler(handle_admin_callback))
+    # كل الأزرار عبر موجه واحد (المسارات تسجلها وحدات المعالجات عند استيرادها)
+    application.add_handler(CallbackQueryHandler(router.dispatch))
     
-    # معالجات الطلبات
-    application.add_handler(CallbackQueryHandler(approve_funding_request, pattern="^approve_request_"))
-    application.add_handler(CallbackQueryHandler(reject_funding_request, pattern="^reject_request_"))
+    # تغير اشتراكات القنوات الإجبارية (يتطلب chat_member في allowed_updates)
+    application.add_handler(ChatMemberHandler(track_channel_membership, ChatMemberHandler.CHAT_MEMBER))
     
-    # معالجة الرسائل النصية
+    # معالجة الرسائل النصية (ومنها مدخلات الإدارة)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
-    # معالجة مدخلات الإدارة
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_input))
-    
     # بدء معالجة الطلبات في الخلفية
     async def start_background_tasks():
         """بدء المهام في الخلفية"""
         logger.info("بدء مهام الخلفية...")
         asyncio.create_task(process_pending_requests(application.bot))
+        asyncio.create_task(watch_settings(Config.SETTINGS_REFRESH_SECONDS))
+        asyncio.create_task(snapshot_ledger(Config.LEDGER_SNAPSHOT_INTERVAL))
+        asyncio.create_task(reconcile_stats(Config.STATS_RECONCILE_INTERVAL, Config.STATS_FLUSH_INTERVAL))
+        asyncio.create_task(archive_periodically(Config.ARCHIVE_INTERVAL))
+        asyncio.create_task(process_broadcasts(application.bot, Config.BROADCAST_POLL_INTERVAL))
     
     # بدء البوت
     print("🚀 جاري تشغيل البوت...")
     print(f"👑 المدير الرئيسي: {Config.ADMIN_ID}")
     
-    # بدء المهام الخلفية
-    await start_background_tasks()
+    # run_polling تنشئ حلقة أحداث خاصة بها ولا يمكن استدعاؤها من داخل asyncio.run،
+    # لذلك نشغل دورة حياة التطبيق يدوياً على نفس الحلقة التي تعمل عليها قاعدة البيانات
+    # خادم HTTP واحد على نفس الحلقة: الصحة و/metrics دائماً، ومسار webhook عند تحديد WEBHOOK_URL
+    use_webhook = bool(Config.WEBHOOK_URL)
+    secret_token = Config.WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    web_app = create_web_app(application, secret_token, Config.WEBHOOK_PATH if use_webhook else None,
+                             metrics_token=Config.METRICS_TOKEN)
     
-    # بدء الاستماع للتحديثات
-    await application.run_polling(allowed_updates="all")
+    try:
+        await run_application(application, web_app, use_webhook, secret_token, start_background_tasks)
+    finally:
+        # بعد shutdown التطبيق: آخر حفظ لـuser_data يمر عبر طابور الكتابة
+        await write_queue.close()
+        try:
+            await flush_stats()
+        except Exception as e:
+            logger.error(f"تعذر كتابة عدادات الإحصائيات عند الإيقاف: {e}")
+        if read_engine is not engine:
+            await read_engine.dispose()
+        await engine.dispose()
+
+async def run_application(application, web_app, use_webhook: bool, secret_token: str, start_background_tasks):
+    """تشغيل البوت حتى الإيقاف؛ الخروج من async with يحفظ حالة المستخدمين (persistence)"""
+    async with application:
+        await application.start()
+        runner = await start_web_server(web_app, Config.PORT)
+        print(f"✅ خادم HTTP يعمل على المنفذ {Config.PORT}")
+        
+        # بدء المهام الخلفية
+        await start_background_tasks()
+        
+        # بدء الاستماع للتحديثات
+        if use_webhook:
+            await application.bot.set_webhook(
+                url=Config.WEBHOOK_URL + Config.WEBHOOK_PATH,
+                secret_token=secret_token,
+                allowed_updates=ALLOWED_UPDATES,
+            )
+            print(f"📡 استقبال التحديثات عبر webhook: {Config.WEBHOOK_URL}{Config.WEBHOOK_PATH}")
+        else:
+            # start_polling يحذف أي webhook سابق قبل البدء
+            await application.updater.start_polling(allowed_updates=ALLOWED_UPDATES)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            # لا نحذف الـwebhook عند الإيقاف: تليجرام يحتفظ بالتحديثات حتى نعود
+            if application.updater.running:
+                await application.updater.stop()
+            await runner.cleanup()
+            await application.stop()
 
 if __name__ == '__main__':
     # تشغيل البوت
@@ -1,9 +1,12 @@
 import asyncio
 import logging
 from telegram import Bot
-from telegram.error import TelegramError, UserPrivacyRestrictedError
-from database import get_db, GroupSource, FundingRequest, User
+from telegram.error import TelegramError, Forbidden, BadRequest
+from database import get_db, GroupSource, FundingRequest, User, ReadSessionLocal
+from sqlalchemy import select, func
 from config import Config
+from rate_limiter import BACKGROUND
+from metrics import registry, members_added
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,11 +19,11 @@ class MemberAdder:
         """إضافة أعضاء للقناة من المجموعات المصدر"""
         db = get_db()
         try:
-            request = db.query(FundingRequest).filter_by(id=request_id).first()
+            request = await db.scalar(select(FundingRequest).filter_by(id=request_id).limit(1))
             if not request or request.status != 'approved':
                 return
             
-            user = db.query(User).filter_by(user_id=request.user_id).first()
+            user = await db.scalar(select(User).filter_by(user_id=request.user_id).limit(1))
             if not user:
                 return
             
@@ -35,13 +38,14 @@ class MemberAdder:
                 await self.bot.send_message(
                     user.user_id,
                     f"🚀 بدأت عملية إضافة الأعضاء لطلبك #{request_id}\n"
-                    f"👥 العدد المطلوب: {needed_members} عضو"
+                    f"👥 العدد المطلوب: {needed_members} عضو",
+                    rate_limit_args={'priority': BACKGROUND}
                 )
-            except:
+            except TelegramError:
                 pass
             
             # الحصول على المجموعات المصدر النشطة
-            source_groups = db.query(GroupSource).filter_by(is_active=True).all()
+            source_groups = (await db.scalars(select(GroupSource).filter_by(is_active=True))).all()
             
             for group in source_groups:
                 if added_count >= needed_members:
@@ -49,18 +53,18 @@ class MemberAdder:
                 
                 try:
                     # جلب أعضاء المجموعة
-                    members_added = await self.add_members_from_group(
+                    group_added = await self.add_members_from_group(
                         group.group_id,
                         target_channel,
                         needed_members - added_count
                     )
                     
-                    added_count += members_added
-                    logger.info(f"تمت إضافة {members_added} عضو من مجموعة {group.group_title}")
+                    added_count += group_added
+                    logger.info(f"تمت إضافة {group_added} عضو من مجموعة {group.group_title}")
                     
                     # تحديث حالة الطلب
                     request.completed_members = added_count
-                    db.commit()
+                    await db.commit()
                     
                     # تأخير بين المجموعات
                     await asyncio.sleep(5)
@@ -77,12 +81,12 @@ class MemberAdder:
                 request.status = 'failed'
                 success_message = f"❌ فشل طلبك #{request.id}\n⚠️ لم تتم إضافة أي عضو."
             
-            db.commit()
+            await db.commit()
             
             # إعلام المستخدم
             try:
-                await self.bot.send_message(user.user_id, success_message)
-            except:
+                await self.bot.send_message(user.user_id, success_message, rate_limit_args={'priority': BACKGROUND})
+            except TelegramError:
                 pass
             
             return added_count
@@ -91,7 +95,7 @@ class MemberAdder:
             logger.error(f"خطأ في إضافة الأعضاء: {e}")
             return 0
         finally:
-            db.close()
+            await db.close()
     
     async def add_members_from_group(self, source_group_id: str, target_channel: str, max_members: int):
         """إضافة أعضاء من مجموعة مصدر معينة"""
@@ -111,23 +115,44 @@ class MemberAdder:
                     # محاولة إضافة العضو للقناة
                     await self.bot.add_chat_members(
                         chat_id=target_channel,
-                        user_ids=[member.user.id]
+                        user_ids=[member.user.id],
+                        rate_limit_args={'priority': BACKGROUND}
                     )
                     
                     added_count += 1
+                    members_added.inc(result='added')
                     logger.info(f"تمت إضافة العضو {member.user.id} بنجاح")
                     
                     # تأخير بين كل إضافة لتجنب الحظر
                     await asyncio.sleep(Config.ADD_MEMBERS_DELAY)
                     
-                except UserPrivacyRestrictedError:
-                    logger.debug(f"العضو {member.user.id} مقيد الخصوصية")
+                except Forbidden as e:
+                    # المستخدم حظر البوت أو يقيد الخصوصية، أو البوت ليس أدمن في الهدف
+                    if "CHAT_ADMIN_REQUIRED" in str(e) or "not enough rights" in str(e).lower():
+                        logger.error(f"البوت ليس أدمن في القناة الهدف")
+                        break
+                    logger.debug(f"العضو {member.user.id} مقيد الخصوصية: {e}")
+                    continue
+                    
+                except BadRequest as e:
+                    if "USER_ALREADY_PARTICIPANT" in str(e):
+                        logger.debug(f"العضو {member.user.id} موجود بالفعل")
+                        added_count += 1
+                        members_added.inc(result='already_member')
+                    elif "USER_PRIVACY_RESTRICTED" in str(e) or "USER_NOT_MUTUAL_CONTACT" in str(e):
+                        logger.debug(f"العضو {member.user.id} لا يمكن إضافته: {e}")
+                    elif "CHAT_ADMIN_REQUIRED" in str(e):
+                        logger.error(f"البوت ليس أدمن في القناة الهدف")
+                        break
+                    else:
+                        logger.warning(f"خطأ في إضافة العضو {member.user.id}: {e}")
                     continue
                     
                 except TelegramError as e:
                     if "USER_ALREADY_PARTICIPANT" in str(e):
                         logger.debug(f"العضو {member.user.id} موجود بالفعل")
                         added_count += 1
+                        members_added.inc(result='already_member')
                     elif "USER_NOT_MUTUAL_CONTACT" in str(e):
                         logger.debug(f"العضو {member.user.id} ليس جهة اتصال متبادلة")
                     elif "CHAT_ADMIN_REQUIRED" in str(e):
@@ -164,6 +189,21 @@ class MemberAdder:
         
         return members
 
+@registry.register
+async def funding_queue_metrics():
+    """طلبات التمويل المنتظرة: بانتظار موافقة المشرف (pending) أو الإضافة (approved)"""
+    db = ReadSessionLocal()
+    try:
+        counts = dict((await db.execute(
+            select(FundingRequest.status, func.count())
+            .where(FundingRequest.status.in_(('pending', 'approved')))
+            .group_by(FundingRequest.status)
+        )).all())
+    finally:
+        await db.close()
+    return [('bot_funding_queue_depth', 'gauge', "Funding requests waiting by status",
+             [({'status': status}, counts.get(status, 0)) for status in ('pending', 'approved')])]
+
 async def process_pending_requests(bot: Bot):
     """معالجة طلبات التمويل المعلقة"""
     adder = MemberAdder(bot)
@@ -174,15 +214,15 @@ async def process_pending_requests(bot: Bot):
             db = get_db()
             
             # البحث عن طلبات معتمدة تحتاج معالجة
-            pending_requests = db.query(FundingRequest).filter_by(status='approved').all()
-            
-            logger.info(f"وجدت {len(pending_requests)} طلب معتمد للمعالجة")
+            pending_ids = (await db.scalars(select(FundingRequest.id).filter_by(status='approved'))).all()
+            # إغلاق الجلسة قبل المعالجة الطويلة حتى لا تبقى المعاملة مفتوحة
+            await db.close()
             
-            for request in pending_requests:
-                logger.info(f"معالجة الطلب #{request.id}")
-                await adder.add_members_to_channel(request.id)
+            logger.info(f"وجدت {len(pending_ids)} طلب معتمد للمعالجة")
             
-            db.close()
+            for request_id in pending_ids:
+                logger.info(f"معالجة الطلب #{request_id}")
+                await adder.add_members_to_channel(request_id)
             
             # انتظار 5 دقائق بين كل جولة
             await asyncio.sleep(300)
@@ -0,0 +1,235 @@
+import contextlib
+import functools
+import inspect
+import logging
+import math
+import time
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# حدود فئات المدد بالثواني (تغطي استعلاماً سريعاً حتى معالجاً ينتظر Bot API)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+# ==================== أنواع المقاييس ====================
+class Counter:
+    """عداد تراكمي لكل مجموعة قيم تسميات"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, '')) for name in self.labelnames), 0)
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name + '_total', dict(zip(self.labelnames, key)), value
+
+class Histogram:
+    """توزيع المدد على فئات تراكمية مع المجموع والعدد"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (math.inf,)
+        # {تسميات: [عدد كل فئة، المجموع، العدد]}
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][index] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(tuple(str(labels.get(name, '')) for name in self.labelnames))
+        return entry[2] if entry else 0
+
+    def samples(self):
+        for key, (counts, total, count) in self._values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield self.name + '_bucket', labels | {'le': _format_value(float(bound))}, cumulative
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, count
+
+class Registry:
+    """سجل المقاييس وعرضها بصيغة Prometheus النصية
+
+    المقاييس الحية (أطوال الطوابير، نسب الذاكرة المؤقتة) تُقرأ عند الطلب من دوال جمع
+    تسجلها الوحدات المعنية؛ كل دالة (عادية أو async) ترجع قائمة
+    (الاسم، النوع، الوصف، [(التسميات، القيمة)]).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._caches = {}
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register(self, collector):
+        self._collectors.append(collector)
+        return collector
+
+    def unregister(self, collector):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def cache(self, name: str, cache):
+        """تسجيل ذاكرة مؤقتة لها العدادان hits وmisses (وطول اختياري)"""
+        self._caches[name] = cache
+        return cache
+
+    def _cache_families(self):
+        caches = self._caches.items()
+        ratio = lambda cache: cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else 0.0
+        return [
+            ('bot_cache_hits_total', 'counter', "Cache lookups served from memory",
+             [({'cache': name}, cache.hits) for name, cache in caches]),
+            ('bot_cache_misses_total', 'counter', "Cache lookups that went to the database or API",
+             [({'cache': name}, cache.misses) for name, cache in caches]),
+            ('bot_cache_hit_ratio', 'gauge', "Hits over all lookups since start",
+             [({'cache': name}, ratio(cache)) for name, cache in caches]),
+            ('bot_cache_entries', 'gauge', "Entries currently held",
+             [({'cache': name}, len(cache)) for name, cache in caches if hasattr(cache, '__len__')]),
+        ]
+
+    async def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            # في الصيغة النصية الكلاسيكية اسم عائلة العداد يحمل اللاحقة _total
+            family = metric.name + '_total' if metric.kind == 'counter' else metric.name
+            lines.append(f"# HELP {family} {metric.documentation}")
+            lines.append(f"# TYPE {family} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in [self._cache_families, *self._collectors]:
+            try:
+                families = collector()
+                if inspect.isawaitable(families):
+                    families = await families
+            except Exception as e:
+                # مقياس معطل لا يُسقط الصفحة كلها
+                logger.warning(f"فشل جمع المقاييس من {getattr(collector, '__qualname__', collector)}: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+# ==================== مقاييس التشغيل ====================
+handler_updates = registry.counter('bot_handler_updates', "Updates processed by each handler", ('handler', 'status'))
+handler_seconds = registry.histogram('bot_handler_duration_seconds', "Handler callback latency", ('handler',))
+db_queries = registry.counter('bot_db_queries', "SQL statements executed", ('engine', 'statement'))
+db_errors = registry.counter('bot_db_errors', "SQL statements that raised", ('engine',))
+db_seconds = registry.histogram('bot_db_query_duration_seconds', "SQL statement latency", ('engine', 'statement'))
+api_requests = registry.counter('bot_api_requests', "Bot API calls by method and outcome", ('method', 'error'))
+api_seconds = registry.histogram('bot_api_request_duration_seconds', "Bot API call latency (excluding rate-limit wait)", ('method',))
+members_added = registry.counter('bot_members_added', "Members added to funded channels", ('result',))
+
+@contextlib.contextmanager
+def measure_handler(name: str):
+    """قياس عدد ومدة استدعاء معالج واحد"""
+    started = time.perf_counter()
+    status = 'ok'
+    try:
+        yield
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        handler_seconds.observe(time.perf_counter() - started, handler=name)
+        handler_updates.inc(handler=name, status=status)
+
+def self_measured(callback):
+    """علامة لمعالج يقيس ما يوجهه بنفسه (مثل موجه الأزرار) فلا يُغلف مرة أخرى"""
+    callback._instrumented = True
+    return callback
+
+def instrument_handler(handler):
+    """قياس عدد ومدة استدعاءات معالج PTB (باسم دالته)"""
+    callback = getattr(handler, 'callback', None)
+    if callback is None or getattr(callback, '_instrumented', False):
+        return handler
+    name = getattr(callback, '__name__', type(callback).__name__)
+
+    @functools.wraps(callback)
+    async def timed(update, context):
+        with measure_handler(name):
+            return await callback(update, context)
+
+    timed._instrumented = True
+    handler.callback = timed
+    return handler
+
+def instrument_engine(engine, name: str):
+    """قياس عدد ومدة جمل SQL على المحرك (مع نوع الجملة: SELECT، INSERT...)"""
+    target = getattr(engine, 'sync_engine', engine)
+
+    @event.listens_for(target, 'before_cursor_execute')
+    def _started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    @event.listens_for(target, 'after_cursor_execute')
+    def _finished(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['metrics_started'].pop()
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+        db_seconds.observe(time.perf_counter() - started, engine=name, statement=verb)
+        db_queries.inc(engine=name, statement=verb)
+
+    @event.listens_for(target, 'handle_error')
+    def _failed(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('metrics_started'):
+            connection.info['metrics_started'].pop()
+        db_errors.inc(engine=name)
+
+    return engine
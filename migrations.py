@@ -0,0 +1,259 @@
+import logging
+from sqlalchemy import inspect, select, text, func, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.schema import CreateIndex
+from database import engine as default_engine, Base, SchemaMigration, User, Channel, ChannelMembership, BroadcastJob, PersistentState, FundingRequest, FundingRequestArchive, PointsTransfer, PointsTransferArchive, PointsLedger, BalanceSnapshot, SystemStats, SystemSettings, PointsSettings
+
+logger = logging.getLogger(__name__)
+
+# ==================== الأدوات ====================
+def _index(model, name):
+    """جلب تعريف الفهرس من النموذج حتى يبقى المصدر واحداً"""
+    for index in model.__table__.indexes:
+        if index.name == name:
+            return index
+    raise KeyError(name)
+
+async def _create_indexes(engine, indexes):
+    """إنشاء فهارس على جداول موجودة بدون إعادة بناء الجدول
+
+    SQLite: CREATE INDEX يقرأ الجدول مرة واحدة ويبني الفهرس بجانبه.
+    PostgreSQL: CONCURRENTLY حتى لا يُقفل الجدول للكتابة أثناء البناء (يتطلب العمل خارج معاملة).
+    """
+    if engine.dialect.name == 'postgresql':
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+            # النص يُبنى يدوياً فنطبق خريطة المخططات بأنفسنا؛ None تعني المخطط الافتراضي للاتصال
+            translate = {
+                symbolic: schema or conn.dialect.default_schema_name
+                for symbolic, schema in (engine.get_execution_options().get('schema_translate_map') or {}).items()
+            }
+            for index in indexes:
+                ddl = str(CreateIndex(index, if_not_exists=True).compile(
+                    dialect=engine.dialect, schema_translate_map=translate, render_schema_translate=True
+                ))
+                await conn.execute(text(ddl.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1)))
+        return
+
+    async with engine.begin() as conn:
+        for index in indexes:
+            await conn.run_sync(lambda sync_conn, index=index: index.create(sync_conn, checkfirst=True))
+        if engine.dialect.name == 'sqlite':
+            # تحديث إحصائيات المخطط للجداول التي تغيرت فقط (أرخص من ANALYZE كامل)
+            await conn.execute(text("PRAGMA optimize"))
+
+async def _add_columns(engine, model, *names):
+    """إضافة أعمدة جديدة لجدول موجود (ALTER TABLE ADD COLUMN لا يعيد كتابة الصفوف)"""
+    table = model.__table__
+    async with engine.begin() as conn:
+        schema = conn.sync_connection.schema_for_object(table)
+        existing = await conn.run_sync(
+            lambda sync_conn: {column['name'] for column in inspect(sync_conn).get_columns(table.name, schema=schema)}
+        )
+        qualified = f"{schema}.{table.name}" if schema else table.name
+        for name in names:
+            if name in existing:
+                continue
+            column = table.columns[name]
+            column_type = column.type.compile(dialect=engine.dialect)
+            ddl = f"ALTER TABLE {qualified} ADD COLUMN {name} {column_type}"
+            if column.default is not None and column.default.is_scalar:
+                ddl += f" DEFAULT {column.default.arg!r}"
+            await conn.execute(text(ddl))
+
+async def _rebuild_with_autoincrement(engine, model, *floors):
+    """إعادة بناء جدول SQLite بمفتاح AUTOINCREMENT حتى لا تعود أرقام الصفوف المحذوفة
+
+    بدونه يعطي SQLite الصف الجديد max(id)+1، فإذا حُذفت أعلى الصفوف (أرشفة، ضغط) أُعيدت
+    أرقامها. floors: أعمدة أخرى تحمل أرقاماً من نفس التسلسل (الأرشيف، اللقطات) فيبدأ العداد
+    بعد أكبرها. البناء في معاملة واحدة (BEGIN IMMEDIATE) فالانقطاع لا يترك نسخة ناقصة.
+    PostgreSQL: التسلسلات لا تعيد الأرقام أصلاً.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    table = model.__table__
+    async with engine.begin() as conn:
+        # pysqlite لا يفتح معاملة قبل DDL بنفسه
+        await conn.execute(text("BEGIN IMMEDIATE"))
+        schema = conn.sync_connection.schema_for_object(table)
+        prefix = f"{schema}." if schema else ""
+        definition = await conn.scalar(
+            text(f"SELECT sql FROM {prefix}sqlite_master WHERE type = 'table' AND name = :name"), {'name': table.name}
+        )
+        if 'AUTOINCREMENT' not in definition.upper():
+            old_columns = {row[1] for row in (await conn.execute(text(f"PRAGMA {prefix}table_info({table.name})"))).all()}
+            # الفهارس تنتقل مع الجدول عند إعادة تسميته فتُحذف لتُنشأ مع الجدول الجديد
+            for index in table.indexes:
+                await conn.execute(text(f"DROP INDEX IF EXISTS {prefix}{index.name}"))
+            await conn.execute(text(f"ALTER TABLE {prefix}{table.name} RENAME TO {table.name}_rebuild"))
+            await conn.run_sync(lambda sync_conn: table.create(sync_conn))
+            columns = ', '.join(column.name for column in table.columns if column.name in old_columns)
+            await conn.execute(text(
+                f"INSERT INTO {prefix}{table.name} ({columns}) SELECT {columns} FROM {prefix}{table.name}_rebuild"
+            ))
+            await conn.execute(text(f"DROP TABLE {prefix}{table.name}_rebuild"))
+        highest = max([await conn.scalar(select(func.max(column))) or 0 for column in (table.c.id, *floors)])
+        current = await conn.scalar(
+            text(f"SELECT seq FROM {prefix}sqlite_sequence WHERE name = :name"), {'name': table.name}
+        )
+        if current is None:
+            await conn.execute(
+                text(f"INSERT INTO {prefix}sqlite_sequence (name, seq) VALUES (:name, :seq)"),
+                {'name': table.name, 'seq': highest},
+            )
+        elif current < highest:
+            await conn.execute(
+                text(f"UPDATE {prefix}sqlite_sequence SET seq = :seq WHERE name = :name"),
+                {'name': table.name, 'seq': highest},
+            )
+
+async def relocate_attached_tables(engine) -> list:
+    """نقل جداول المخططات الرمزية من الملف الرئيسي إلى ملفاتها المرفقة (SQLite)
+
+    يعمل عند كل تشغيل لأن إرفاق الملفات إعداد يمكن تفعيله في أي وقت. النسخ بـ INSERT OR IGNORE
+    على المفتاح الأساسي ثم حذف الجدول القديم، فإعادة التشغيل بعد انقطاع لا تكرر الصفوف.
+    إلغاء الإرفاق لاحقاً لا يعيد الجداول للملف الرئيسي تلقائياً.
+    """
+    if engine.dialect.name != 'sqlite':
+        return []
+    translate = engine.get_execution_options().get('schema_translate_map') or {}
+    moved = []
+    for table in Base.metadata.sorted_tables:
+        target = translate.get(table.schema) if table.schema else None
+        if target is None:
+            continue
+        async with engine.begin() as conn:
+            found = await conn.scalar(
+                text("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = :name"), {'name': table.name}
+            )
+            if not found:
+                continue
+            await conn.run_sync(lambda sync_conn, table=table: table.create(sync_conn, checkfirst=True))
+            old_columns = {row[1] for row in (await conn.execute(text(f"PRAGMA main.table_info({table.name})"))).all()}
+            columns = ', '.join(column.name for column in table.columns if column.name in old_columns)
+            await conn.execute(text(
+                f"INSERT OR IGNORE INTO {target}.{table.name} ({columns}) SELECT {columns} FROM main.{table.name}"
+            ))
+            await conn.execute(text(f"DROP TABLE main.{table.name}"))
+        logger.info(f"نُقل الجدول {table.name} إلى الملف المرفق {target}")
+        moved.append(table.name)
+    return moved
+
+# ==================== الترحيلات ====================
+async def migration_001_hot_path_indexes(engine):
+    """فهارس مسارات الاستعلام الساخنة"""
+    await _create_indexes(engine, [
+        _index(FundingRequest, 'ix_funding_requests_status_created'),
+        _index(FundingRequest, 'ix_funding_requests_user_created'),
+        _index(PointsTransfer, 'ix_points_transfers_from_date'),
+        _index(PointsTransfer, 'ix_points_transfers_to_date'),
+        _index(PointsTransfer, 'ix_points_transfers_date'),
+        _index(User, 'ix_users_username'),
+        _index(User, 'ix_users_is_admin'),
+        _index(Channel, 'ix_channels_is_mandatory'),
+    ])
+
+async def migration_002_settings_version(engine):
+    """عداد إصدار الإعدادات لذاكرة الإعدادات المؤقتة"""
+    await _add_columns(engine, SystemSettings, 'version')
+    await _add_columns(engine, PointsSettings, 'version')
+
+async def migration_003_points_ledger(engine):
+    """سجل النقاط: حركة افتتاحية لكل رصيد موجود حتى يطابق السجل جدول المستخدمين"""
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda sync_conn: PointsLedger.__table__.create(sync_conn, checkfirst=True))
+        if await conn.scalar(select(PointsLedger.id).limit(1)) is not None:
+            return
+        await conn.execute(
+            PointsLedger.__table__.insert().from_select(
+                ['user_id', 'delta', 'balance_after', 'reason', 'created_at'],
+                select(User.user_id, User.points, User.points, literal('opening'), func.now())
+                .where(User.points != 0),
+            )
+        )
+
+async def migration_004_system_stats(engine):
+    """عدادات الإحصائيات: حسابها مرة واحدة من الجداول ثم تُحدث بالفرق"""
+    from stats_counters import reconcile
+    
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda sync_conn: SystemStats.__table__.create(sync_conn, checkfirst=True))
+    async with AsyncSession(engine) as db:
+        await reconcile(db)
+        await db.commit()
+
+async def migration_005_users_keyset_index(engine):
+    """فهرس ترقيم قائمة المستخدمين بالمؤشر"""
+    await _create_indexes(engine, [_index(User, 'ix_users_created_id')])
+
+async def migration_006_archive_tables(engine):
+    """جداول أرشيف الطلبات المنتهية والتحويلات القديمة"""
+    async with engine.begin() as conn:
+        for model in (FundingRequestArchive, PointsTransferArchive):
+            await conn.run_sync(lambda sync_conn, table=model.__table__: table.create(sync_conn, checkfirst=True))
+
+async def migration_007_channel_memberships(engine):
+    """سجل اشتراكات القنوات الإجبارية"""
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda sync_conn: ChannelMembership.__table__.create(sync_conn, checkfirst=True))
+
+async def migration_008_broadcasts(engine):
+    """جدول مهام البث وعلامة المستخدمين الذين حظروا البوت"""
+    await _add_columns(engine, User, 'bot_blocked')
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda sync_conn: BroadcastJob.__table__.create(sync_conn, checkfirst=True))
+
+async def migration_009_persistent_state(engine):
+    """حالة المستخدمين المحفوظة (تدفقات متعددة الخطوات تنجو من إعادة التشغيل)"""
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda sync_conn: PersistentState.__table__.create(sync_conn, checkfirst=True))
+
+async def migration_010_archived_ids_not_reused(engine):
+    """أرقام الطلبات والتحويلات لا تعود بعد أرشفة أعلاها"""
+    await _rebuild_with_autoincrement(engine, FundingRequest, FundingRequestArchive.id)
+    await _rebuild_with_autoincrement(engine, PointsTransfer, PointsTransferArchive.id)
+
+async def migration_011_ledger_ids_not_reused(engine):
+    """أرقام سجل النقاط تبقى بعد حد آخر لقطة حتى لو ضُغطت كل الحركات"""
+    await _rebuild_with_autoincrement(engine, PointsLedger, BalanceSnapshot.ledger_id)
+
+# (الإصدار، الوصف، الدالة) - الإصدارات تزيد دائماً ولا يُعدل ترحيل بعد نشره
+MIGRATIONS = [
+    (1, "فهارس مسارات الاستعلام الساخنة", migration_001_hot_path_indexes),
+    (2, "عداد إصدار الإعدادات", migration_002_settings_version),
+    (3, "أرصدة افتتاحية لسجل النقاط", migration_003_points_ledger),
+    (4, "عدادات الإحصائيات", migration_004_system_stats),
+    (5, "فهرس ترقيم المستخدمين", migration_005_users_keyset_index),
+    (6, "جداول الأرشيف", migration_006_archive_tables),
+    (7, "سجل اشتراكات القنوات", migration_007_channel_memberships),
+    (8, "مهام البث", migration_008_broadcasts),
+    (9, "حالة المستخدمين المحفوظة", migration_009_persistent_state),
+    (10, "أرقام لا تتكرر بعد الأرشفة", migration_010_archived_ids_not_reused),
+    (11, "أرقام سجل النقاط لا تتكرر بعد الضغط", migration_011_ledger_ids_not_reused),
+]
+
+async def applied_versions(engine) -> set:
+    """الإصدارات المطبقة على قاعدة البيانات"""
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda sync_conn: SchemaMigration.__table__.create(sync_conn, checkfirst=True))
+        return set((await conn.scalars(select(SchemaMigration.version))).all())
+
+async def run_migrations(engine=None) -> list:
+    """تطبيق الترحيلات الناقصة بالترتيب وإرجاع الإصدارات التي طُبقت"""
+    engine = engine or default_engine
+    # الترحيلات تعمل على الجداول في مكانها النهائي
+    await relocate_attached_tables(engine)
+    done = await applied_versions(engine)
+    applied = []
+
+    for version, description, upgrade in MIGRATIONS:
+        if version in done:
+            continue
+        logger.info(f"تطبيق الترحيل {version}: {description}")
+        # كل ترحيل آمن لإعادة التشغيل (IF NOT EXISTS)، فتسجيله بعد نجاحه يكفي
+        await upgrade(engine)
+        async with engine.begin() as conn:
+            await conn.execute(SchemaMigration.__table__.insert().values(version=version, description=description))
+        applied.append(version)
+
+    return applied
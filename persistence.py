@@ -0,0 +1,223 @@
+import json
+import logging
+from datetime import datetime
+from sqlalchemy import select, delete, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from telegram.ext import BasePersistence, PersistenceInput
+from config import Config
+from database import PersistentState
+
+logger = logging.getLogger(__name__)
+
+USER = 'user'
+CHAT = 'chat'
+BOT = 'bot'
+
+def _encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+
+# ==================== الكتابة ====================
+async def _write_state(db, kind: str, owner: str, upserts: dict, deletes: list):
+    """عملية طابور الكتابة: تحديث المفاتيح المتغيرة وحذف المحذوفة لمالك واحد"""
+    if deletes:
+        await db.execute(
+            delete(PersistentState)
+            .where(PersistentState.kind == kind, PersistentState.owner == owner, PersistentState.key.in_(deletes))
+            .execution_options(synchronize_session=False)
+        )
+    if not upserts:
+        return
+    rows = [
+        {'kind': kind, 'owner': owner, 'key': key, 'value': value, 'updated_at': datetime.now()}
+        for key, value in upserts.items()
+    ]
+    dialect = db.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        statement = insert(PersistentState).values(rows)
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=['kind', 'owner', 'key'],
+            set_={'value': statement.excluded.value, 'updated_at': statement.excluded.updated_at},
+        ))
+    else:
+        await db.execute(
+            delete(PersistentState)
+            .where(tuple_(PersistentState.kind, PersistentState.owner, PersistentState.key)
+                   .in_([(kind, owner, key) for key in upserts]))
+            .execution_options(synchronize_session=False)
+        )
+        await db.execute(PersistentState.__table__.insert().values(rows))
+
+async def _drop_owner(db, kind: str, owner: str):
+    await db.execute(
+        delete(PersistentState)
+        .where(PersistentState.kind == kind, PersistentState.owner == owner)
+        .execution_options(synchronize_session=False)
+    )
+
+# ==================== الحفظ ====================
+class DatabasePersistence(BasePersistence):
+    """حفظ user_data (وchat_data وbot_data إن فُعلت) في جدول persistent_state (SQLite افتراضياً)
+
+    صف لكل مفتاح بقيمة JSON بدلاً من pickle للقاموس كله: تحتفظ الذاكرة بآخر نسخة
+    محفوظة لكل مالك، فلا يُكتب إلا ما تغير منذها. PTB يجمع المستخدمين الذين لُمست
+    بياناتهم ويستدعي update_* كل update_interval ثانية معاً، فتنتهي كل الجولة في
+    commit واحد عبر طابور الكتابة.
+
+    مع shared=True تُعاد قراءة صفوف المستخدم قبل معالجة تحديثه (استعلام واحد بالمفتاح
+    الأساسي)، وتُدمج مع المفاتيح التي تغيرت محلياً ولم تُحفظ بعد فلا تضيع.
+    القيم يجب أن تكون قابلة لـJSON؛ غيرها يبقى في الذاكرة فقط مع تحذير.
+    """
+
+    def __init__(self, session_factory=None, queue=None, update_interval: float = None, shared: bool = None):
+        super().__init__(
+            # البوت يستخدم user_data فقط؛ تفعيل الباقي يضيف نسخاً (وقراءة مع shared) لكل تحديث
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=Config.PERSISTENCE_INTERVAL if update_interval is None else update_interval,
+        )
+        self._session_factory = session_factory
+        self._queue = queue
+        self.shared = Config.PERSISTENCE_SHARED if shared is None else shared
+        # {(النوع، المالك): {المفتاح: JSON المحفوظ}}
+        self._saved = {}
+        self.writes = 0
+
+    def _sessions(self):
+        if self._session_factory is None:
+            from database import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+
+    def _write_queue(self):
+        if self._queue is None:
+            from write_queue import write_queue
+            self._queue = write_queue
+        return self._queue
+
+    async def _load(self, kind: str, owner: str = None) -> dict:
+        """{المالك: {المفتاح: JSON}} لنوع كامل أو لمالك واحد"""
+        query = select(PersistentState.owner, PersistentState.key, PersistentState.value).where(PersistentState.kind == kind)
+        if owner is not None:
+            query = query.where(PersistentState.owner == owner)
+        db = self._sessions()
+        try:
+            rows = (await db.execute(query)).all()
+        finally:
+            await db.close()
+        loaded = {}
+        for row_owner, key, value in rows:
+            loaded.setdefault(row_owner, {})[key] = value
+        return loaded
+
+    async def _get(self, kind: str, convert=int) -> dict:
+        data = {}
+        for owner, encoded in (await self._load(kind)).items():
+            self._saved[(kind, owner)] = dict(encoded)
+            data[convert(owner)] = {key: json.loads(value) for key, value in encoded.items()}
+        return data
+
+    async def _update(self, kind: str, owner: str, data: dict):
+        saved = self._saved.get((kind, owner), {})
+        current = {}
+        for key, value in data.items():
+            try:
+                current[str(key)] = _encode(value)
+            except (TypeError, ValueError):
+                logger.warning(f"قيمة غير قابلة للحفظ في {kind}_data[{key!r}] للمالك {owner}؛ تبقى في الذاكرة فقط")
+                if str(key) in saved:
+                    current[str(key)] = saved[str(key)]
+        upserts = {key: value for key, value in current.items() if saved.get(key) != value}
+        deletes = [key for key in saved if key not in current]
+        if not upserts and not deletes:
+            return
+        await self._write_queue().submit(_write_state, kind, owner, upserts, deletes)
+        self.writes += 1
+        if current:
+            self._saved[(kind, owner)] = current
+        else:
+            self._saved.pop((kind, owner), None)
+
+    async def _drop(self, kind: str, owner: str):
+        await self._write_queue().submit(_drop_owner, kind, owner)
+        self._saved.pop((kind, owner), None)
+
+    async def _refresh(self, kind: str, owner: str, data: dict):
+        """دمج نسخة قاعدة البيانات (من عملية أخرى) مع التغييرات المحلية غير المحفوظة"""
+        stored = (await self._load(kind, owner)).get(owner, {})
+        saved = self._saved.get((kind, owner), {})
+        for key in set(stored) | set(saved):
+            local = data.get(key)
+            try:
+                dirty = (_encode(local) if key in data else None) != saved.get(key)
+            except (TypeError, ValueError):
+                dirty = True
+            if dirty:
+                continue
+            if key in stored:
+                data[key] = json.loads(stored[key])
+            else:
+                data.pop(key, None)
+        if stored:
+            self._saved[(kind, owner)] = dict(stored)
+        else:
+            self._saved.pop((kind, owner), None)
+
+    # ==================== واجهة BasePersistence ====================
+    async def get_user_data(self) -> dict:
+        return await self._get(USER)
+
+    async def get_chat_data(self) -> dict:
+        return await self._get(CHAT)
+
+    async def get_bot_data(self) -> dict:
+        return (await self._get(BOT, convert=str)).get('', {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {
+            tuple(json.loads(key)): json.loads(value)
+            for key, value in (await self._load(f"conversation:{name}", '')).get('', {}).items()
+        }
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        encoded_key = _encode(list(key))
+        if new_state is None:
+            await self._write_queue().submit(_write_state, f"conversation:{name}", '', {}, [encoded_key])
+        else:
+            await self._write_queue().submit(_write_state, f"conversation:{name}", '', {encoded_key: _encode(new_state)}, [])
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await self._update(USER, str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        await self._update(CHAT, str(chat_id), data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        await self._update(BOT, '', data)
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._drop(USER, str(user_id))
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await self._drop(CHAT, str(chat_id))
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if self.shared:
+            await self._refresh(USER, str(user_id), user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        if self.shared:
+            await self._refresh(CHAT, str(chat_id), chat_data)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        if self.shared:
+            await self._refresh(BOT, '', bot_data)
+
+    async def flush(self) -> None:
+        # كل update_* ينتظر حفظ دفعته، فلا شيء معلق هنا
+        pass
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert, select, delete, func
+from sqlalchemy.orm import Session
+from config import Config
+from database import PointsLedger, BalanceSnapshot, get_db
+
+logger = logging.getLogger(__name__)
+
+# الحركات المنتظرة في session.info (تُكتب دفعة واحدة قبل commit)
+PENDING_KEY = 'points_ledger_pending'
+
+# ==================== التسجيل ====================
+def record(db, user_id: int, delta: int, balance_after: int, reason: str, ref_id: int = None):
+    """إضافة حركة للسجل؛ تُكتب مع باقي المعاملة ولا تُكتب عند التراجع"""
+    db.sync_session.info.setdefault(PENDING_KEY, []).append({
+        'user_id': user_id,
+        'delta': delta,
+        'balance_after': balance_after,
+        'reason': reason,
+        'ref_id': ref_id,
+        'created_at': datetime.now(),
+    })
+
+@event.listens_for(Session, 'before_commit')
+def _write_pending(session):
+    entries = session.info.pop(PENDING_KEY, None)
+    if entries:
+        # INSERT واحد بعدة صفوف (executemany) لكل معاملة؛ render_nulls يمنع تقسيم الدفعة حسب القيم الفارغة
+        session.execute(insert(PointsLedger).execution_options(render_nulls=True), entries)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    if previous_transaction.nested:
+        # التراجع إلى نقطة حفظ لا يلغي باقي المعاملة (write_queue يستعيد session.info بنفسه)
+        return
+    session.info.pop(PENDING_KEY, None)
+
+# ==================== القراءة ====================
+async def ledger_balance(db, user_id: int) -> int:
+    """الرصيد من السجل: آخر لقطة + الحركات بعدها"""
+    snapshot = await db.get(BalanceSnapshot, user_id)
+    since = snapshot.ledger_id if snapshot else 0
+    delta = await db.scalar(
+        select(func.coalesce(func.sum(PointsLedger.delta), 0))
+        .where(PointsLedger.user_id == user_id, PointsLedger.id > since)
+    )
+    return (snapshot.balance if snapshot else 0) + delta
+
+async def user_history(db, user_id: int, limit: int = 20) -> list:
+    """آخر حركات المستخدم"""
+    result = await db.scalars(
+        select(PointsLedger)
+        .where(PointsLedger.user_id == user_id)
+        .order_by(PointsLedger.id.desc())
+        .limit(limit)
+    )
+    return result.all()
+
+# ==================== اللقطات والضغط ====================
+async def take_snapshot(db) -> int:
+    """دمج الحركات الجديدة في أرصدة balance_snapshots وإرجاع عدد المستخدمين المحدثين
+
+    كل لقطة تنتهي عند نفس ledger_id لكل المستخدمين، فأكبر ledger_id هو حد اللقطة السابقة
+    وتُقرأ الحركات الجديدة فقط بمدى على المفتاح الأساسي.
+    """
+    last = await db.scalar(select(func.coalesce(func.max(BalanceSnapshot.ledger_id), 0)))
+    upto = await db.scalar(select(func.max(PointsLedger.id)))
+    if upto is None or upto <= last:
+        return 0
+
+    deltas = dict((await db.execute(
+        select(PointsLedger.user_id, func.sum(PointsLedger.delta))
+        .where(PointsLedger.id > last, PointsLedger.id <= upto)
+        .group_by(PointsLedger.user_id)
+    )).all())
+
+    now = datetime.now()
+    user_ids = list(deltas)
+    for start in range(0, len(user_ids), 500):
+        chunk = user_ids[start:start + 500]
+        existing = {
+            snapshot.user_id: snapshot
+            for snapshot in await db.scalars(select(BalanceSnapshot).where(BalanceSnapshot.user_id.in_(chunk)))
+        }
+        for user_id in chunk:
+            snapshot = existing.get(user_id)
+            if snapshot is None:
+                snapshot = BalanceSnapshot(user_id=user_id, balance=0)
+                db.add(snapshot)
+            snapshot.balance += deltas[user_id]
+            snapshot.ledger_id = upto
+            snapshot.taken_at = now
+        await db.flush()
+
+    return len(user_ids)
+
+async def compact(db, retention_days: int = None) -> int:
+    """حذف الحركات القديمة التي دخلت في لقطة وإرجاع عددها"""
+    retention_days = Config.LEDGER_RETENTION_DAYS if retention_days is None else retention_days
+    covered = await db.scalar(select(func.coalesce(func.max(BalanceSnapshot.ledger_id), 0)))
+    result = await db.execute(
+        delete(PointsLedger).where(
+            PointsLedger.id <= covered,
+            PointsLedger.created_at < datetime.now() - timedelta(days=retention_days),
+        )
+    )
+    return result.rowcount
+
+async def snapshot_ledger(interval: int = 3600):
+    """مهمة خلفية: لقطة أرصدة ثم ضغط السجل"""
+    while True:
+        await asyncio.sleep(interval)
+        db = get_db()
+        try:
+            users = await take_snapshot(db)
+            removed = await compact(db)
+            await db.commit()
+            if users or removed:
+                logger.info(f"لقطة سجل النقاط: {users} مستخدم، حذف {removed} حركة قديمة")
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"خطأ في لقطة سجل النقاط: {e}")
+        finally:
+            await db.close()
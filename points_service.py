@@ -0,0 +1,109 @@
+from datetime import datetime, time
+from sqlalchemy import update, or_
+from database import User, FundingRequest
+from user_cache import user_cache
+from points_ledger import record
+from stats_counters import bump
+
+# كل تعديل على الرصيد يتم بجملة UPDATE واحدة مشروطة في قاعدة البيانات بدلاً من
+# قراءة الرصيد في بايثون ثم كتابته، فلا يمكن لتحديثين متزامنين صرف نفس النقاط مرتين.
+# وكل تعديل ناجح يُسجل في سجل النقاط (points_ledger) ضمن نفس المعاملة.
+
+async def _apply(db, user_id: int, delta: int, reason: str, ref_id, condition, values: dict):
+    """تنفيذ تحديث مشروط على صف المستخدم وإرجاع الرصيد الجديد (None إذا لم يتحقق الشرط)"""
+    values = {'points': User.points + delta, **values}
+    where = [User.user_id == user_id]
+    if condition is not None:
+        where.append(condition)
+    result = await db.execute(
+        update(User).where(*where).values(**values).returning(User.points)
+    )
+    balance = result.scalar_one_or_none()
+    if balance is not None:
+        record(db, user_id, delta, balance, reason, ref_id)
+        bump(db, points=delta)
+        user_cache.invalidate_on_commit(db, user_id)
+    return balance
+
+async def credit(db, user_id: int, amount: int, reason: str, ref_id: int = None):
+    """إضافة نقاط؛ يرجع الرصيد الجديد أو None إذا لم يوجد المستخدم"""
+    return await _apply(db, user_id, amount, reason, ref_id, None, {})
+
+async def credit_many(db, user_ids, amount: int, reason: str, ref_id: int = None) -> int:
+    """إضافة نفس المبلغ لعدة مستخدمين بجملة UPDATE واحدة؛ يرجع عدد من أضيفت لهم"""
+    user_ids = list(user_ids)
+    if not user_ids or not amount:
+        return 0
+    result = await db.execute(
+        update(User).where(User.user_id.in_(user_ids)).values(points=User.points + amount)
+        .returning(User.user_id, User.points)
+    )
+    rows = result.all()
+    for user_id, balance in rows:
+        record(db, user_id, amount, balance, reason, ref_id)
+    if rows:
+        bump(db, points=amount * len(rows))
+        user_cache.invalidate_on_commit(db, *[user_id for user_id, _ in rows])
+    return len(rows)
+
+async def debit(db, user_id: int, amount: int, reason: str, ref_id: int = None):
+    """خصم نقاط إذا كان الرصيد كافياً؛ يرجع الرصيد الجديد أو None"""
+    return await _apply(db, user_id, -amount, reason, ref_id, User.points >= amount, {})
+
+async def credit_referral(db, referrer_id: int, amount: int, referred_id: int = None):
+    """مكافأة الإحالة: نقاط + زيادة عداد الإحالات في نفس الجملة"""
+    return await _apply(db, referrer_id, amount, 'referral', referred_id, None, {'referrals': User.referrals + 1})
+
+async def claim_daily_gift(db, user_id: int, amount: int, now: datetime = None):
+    """منح الهدية اليومية مرة واحدة في اليوم؛ يرجع الرصيد الجديد أو None إذا أخذها اليوم"""
+    now = now or datetime.now()
+    start_of_day = datetime.combine(now.date(), time.min)
+    return await _apply(
+        db,
+        user_id,
+        amount,
+        'daily_gift',
+        None,
+        or_(User.last_daily_gift.is_(None), User.last_daily_gift < start_of_day),
+        {'last_daily_gift': now},
+    )
+
+async def transfer_points(db, from_user_id: int, to_user_id: int, amount: int, fee_amount: int):
+    """خصم المبلغ والعمولة من المرسل وإضافة المبلغ للمستقبل
+
+    يرجع (رصيد المرسل، رصيد المستقبل) أو None إذا كان رصيد المرسل غير كافٍ.
+    يجب التأكد من وجود المستقبل قبل الاستدعاء.
+    """
+    sender_balance = await debit(db, from_user_id, amount + fee_amount, 'transfer_out', to_user_id)
+    if sender_balance is None:
+        return None
+    receiver_balance = await credit(db, to_user_id, amount, 'transfer_in', from_user_id)
+    if receiver_balance is None:
+        # المستقبل حُذف بين الفحص والتحويل: نعيد النقاط في نفس المعاملة
+        await credit(db, from_user_id, amount + fee_amount, 'refund', to_user_id)
+        return None
+    return sender_balance, receiver_balance
+
+async def reject_and_refund(db, request_id: int, rejected_by: int):
+    """رفض طلب تمويل وإرجاع نقاطه مرة واحدة فقط
+
+    تغيير الحالة مشروط بأن الطلب لم يُرفض أو يكتمل بعد، فالضغط المزدوج على "رفض" لا يعيد النقاط مرتين.
+    يرجع True إذا رُفض الطلب الآن، وFalse إذا كان مرفوضاً أو مكتملاً من قبل.
+    """
+    for status in ('pending', 'approved'):
+        # جملة لكل حالة سابقة حتى يُعرف أي عداد حالة ينقص
+        result = await db.execute(
+            update(FundingRequest)
+            .where(FundingRequest.id == request_id, FundingRequest.status == status)
+            .values(status='rejected', approved_by=rejected_by, updated_at=datetime.now())
+            .returning(FundingRequest.user_id, FundingRequest.points_cost)
+        )
+        row = result.one_or_none()
+        if row is not None:
+            break
+    else:
+        return False
+    if status == 'pending':
+        bump(db, requests_pending=-1)
+    await credit(db, row.user_id, row.points_cost, 'refund', request_id)
+    return True
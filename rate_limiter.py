@@ -0,0 +1,208 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import Config
+from metrics import api_requests, api_seconds
+
+logger = logging.getLogger(__name__)
+
+# فئات الأولوية (الأصغر أولاً): ردود المستخدمين، إشعارات المشرفين، الإضافة والبث في الخلفية
+INTERACTIVE = 0
+ADMIN = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', ADMIN: 'admin', BACKGROUND: 'background'}
+
+# الطلبات التي ترسل أو تعدل رسالة في محادثة (عليها حد المحادثة الواحدة)
+MESSAGE_ENDPOINTS = ('send', 'edit', 'copyMessage', 'forwardMessage')
+
+class TokenBucket:
+    """دلو رموز: rate رمز في الثانية بسعة capacity للدفعات القصيرة"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """الثواني حتى يتوفر رمز (0 إذا كان متوفراً الآن)"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """جدولة كل طلبات Bot API عبر دلو رموز عام ودلو لكل محادثة
+
+    الحد العام يُوزع بالأولوية: ينتظر الطلب في طابور مرتب بـ (الأولوية، ترتيب الوصول)
+    ويمرره مرسل واحد كلما توفر رمز، فلا تؤخر الإضافة في الخلفية ردود المستخدمين.
+    الأولوية تُمرر عبر rate_limit_args={'priority': BACKGROUND}؛ الافتراضي INTERACTIVE.
+    عند RetryAfter يتوقف الإرسال كله للمدة المطلوبة ثم يعاد الطلب حتى max_retries مرة.
+    """
+
+    def __init__(self, overall_rate: float = None, chat_rate: float = None, group_per_minute: float = None,
+                 max_retries: int = None):
+        overall_rate = overall_rate or Config.RATE_LIMIT_OVERALL
+        self.chat_rate = chat_rate or Config.RATE_LIMIT_PER_CHAT
+        self.group_rate = (group_per_minute or Config.RATE_LIMIT_GROUP_PER_MINUTE) / 60
+        self.max_retries = Config.RATE_LIMIT_MAX_RETRIES if max_retries is None else max_retries
+        self._overall = TokenBucket(overall_rate, overall_rate)
+        self._chats = {}
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self._task = None
+        # المقاييس لكل فئة أولوية
+        self.queued = {priority: 0 for priority in PRIORITY_NAMES}
+        self.requests = {priority: 0 for priority in PRIORITY_NAMES}
+        self.wait_total = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self.wait_max = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self.retries = 0
+
+    async def initialize(self) -> None:
+        self._ensure_dispatcher()
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for _, _, future in self._waiters:
+            future.cancel()
+        self._waiters.clear()
+
+    def _ensure_dispatcher(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def _dispatch(self):
+        """تمرير المنتظرين بالأولوية كلما توفر رمز في الدلو العام"""
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = max(self._paused_until - time.monotonic(), self._overall.delay())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # ألغي الطلب أثناء الانتظار
+                continue
+            self._overall.take()
+            future.set_result(None)
+
+    async def _acquire_overall(self, priority: int):
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._wakeup.set()
+        await future
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # دلاء المحادثات الخاملة ممتلئة ولا حاجة لها
+                self._chats = {key: value for key, value in self._chats.items() if not value.full}
+            # المجموعات والقنوات (معرف سالب أو @اسم) لها حد بالدقيقة
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(self.group_rate, 3) if is_group else TokenBucket(self.chat_rate, 3)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire_chat(self, chat_id):
+        bucket = self._chat_bucket(chat_id)
+        while True:
+            delay = bucket.delay()
+            if delay <= 0:
+                bucket.take()
+                return
+            await asyncio.sleep(delay)
+
+    async def _acquire(self, endpoint: str, data: dict, priority: int):
+        started = time.monotonic()
+        self.queued[priority] += 1
+        try:
+            chat_id = data.get('chat_id') if data else None
+            if chat_id is not None and endpoint.startswith(MESSAGE_ENDPOINTS):
+                await self._acquire_chat(chat_id)
+            await self._acquire_overall(priority)
+        finally:
+            self.queued[priority] -= 1
+        waited = time.monotonic() - started
+        self.requests[priority] += 1
+        self.wait_total[priority] += waited
+        self.wait_max[priority] = max(self.wait_max[priority], waited)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = (rate_limit_args or {}).get('priority', INTERACTIVE)
+        if priority not in PRIORITY_NAMES:
+            priority = BACKGROUND
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(endpoint, data, priority)
+            started = time.monotonic()
+            error = 'none'
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                error = 'RetryAfter'
+                if attempt == self.max_retries:
+                    raise
+                retry_after = exc.retry_after
+                seconds = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+                self.retries += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+                logger.warning(f"Telegram طلب الانتظار {seconds} ثانية ({endpoint})؛ إيقاف الإرسال مؤقتاً")
+            except Exception as exc:
+                error = type(exc).__name__
+                raise
+            finally:
+                api_seconds.observe(time.monotonic() - started, method=endpoint)
+                api_requests.inc(method=endpoint, error=error)
+
+    def stats(self) -> dict:
+        """مقاييس لكل فئة: المنتظرون الآن، عدد الطلبات، متوسط وأقصى انتظار بالثواني"""
+        return {
+            name: {
+                'queued': self.queued[priority],
+                'requests': self.requests[priority],
+                'wait_avg': self.wait_total[priority] / self.requests[priority] if self.requests[priority] else 0.0,
+                'wait_max': self.wait_max[priority],
+            }
+            for priority, name in PRIORITY_NAMES.items()
+        } | {'retries': self.retries}
+
+    def collect(self) -> list:
+        """حالة الجدولة لصفحة /metrics"""
+        return [
+            ('bot_api_queued', 'gauge', "Bot API calls waiting for a rate-limit token",
+             [({'priority': name}, self.queued[priority]) for priority, name in PRIORITY_NAMES.items()]),
+            ('bot_api_wait_seconds_total', 'counter', "Total time spent waiting for rate-limit tokens",
+             [({'priority': name}, self.wait_total[priority]) for priority, name in PRIORITY_NAMES.items()]),
+            ('bot_api_wait_seconds_max', 'gauge', "Longest rate-limit wait since start",
+             [({'priority': name}, self.wait_max[priority]) for priority, name in PRIORITY_NAMES.items()]),
+            ('bot_api_retries_total', 'counter', "Calls retried after RetryAfter", [({}, self.retries)]),
+        ]
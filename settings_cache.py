@@ -0,0 +1,136 @@
+import asyncio
+import logging
+from datetime import datetime
+from types import SimpleNamespace
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from database import SystemSettings, PointsSettings, get_db
+
+logger = logging.getLogger(__name__)
+
+# مفتاح التغييرات المنتظرة في session.info (تطبق على الذاكرة بعد commit فقط)
+PENDING_KEY = 'settings_cache_pending'
+
+def _snapshot(row):
+    """نسخة منفصلة عن الجلسة من صف الإعدادات (للقراءة فقط)"""
+    if row is None:
+        return None
+    return SimpleNamespace(**{column.name: getattr(row, column.name) for column in row.__table__.columns})
+
+class SettingsCache:
+    """ذاكرة مؤقتة لإعدادات النظام والنقاط على مستوى العملية
+
+    تحمل مرة واحدة، وتحدثها دوال المشرف مباشرة بعد حفظ التغيير (write-through).
+    عمود version في كل جدول يزيد مع كل تعديل حتى تكتشف العمليات الأخرى أن نسختها قديمة.
+    """
+
+    def __init__(self):
+        self._system = None
+        self._points = None
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    @property
+    def versions(self) -> tuple:
+        """(إصدار إعدادات النظام، إصدار إعدادات النقاط) المحملة في الذاكرة"""
+        return (
+            self._system.version if self._system else None,
+            self._points.version if self._points else None,
+        )
+
+    @property
+    def version(self) -> int:
+        """عداد واحد يزيد مع أي تعديل على الإعدادات"""
+        return sum(v or 0 for v in self.versions)
+
+    async def load(self, db):
+        """تحميل الإعدادات من قاعدة البيانات"""
+        self._system = _snapshot(await db.scalar(select(SystemSettings).limit(1)))
+        self._points = _snapshot(await db.scalar(select(PointsSettings).limit(1)))
+        self._loaded = True
+
+    async def _ensure_loaded(self, db):
+        if not self._loaded:
+            async with self._lock:
+                if not self._loaded:
+                    await self.load(db)
+
+    async def system(self, db):
+        """إعدادات النظام (بدون استعلام بعد التحميل الأول)"""
+        await self._ensure_loaded(db)
+        return self._system
+
+    async def points(self, db):
+        """إعدادات النقاط (بدون استعلام بعد التحميل الأول)"""
+        await self._ensure_loaded(db)
+        return self._points
+
+    async def update_system(self, db, updated_by: int, **changes):
+        """تعديل إعدادات النظام في الجلسة وتحديث الذاكرة بعد commit"""
+        return await self._update(db, SystemSettings, '_system', updated_by, changes)
+
+    async def update_points(self, db, updated_by: int, **changes):
+        """تعديل إعدادات النقاط في الجلسة وتحديث الذاكرة بعد commit"""
+        return await self._update(db, PointsSettings, '_points', updated_by, changes)
+
+    async def _update(self, db, model, attribute, updated_by, changes):
+        row = await db.scalar(select(model).limit(1))
+        if row is None:
+            row = model()
+            db.add(row)
+        for name, value in changes.items():
+            setattr(row, name, value)
+        row.updated_at = datetime.now()
+        row.updated_by = updated_by
+        row.version = (row.version or 0) + 1
+        await db.flush()
+        db.sync_session.info.setdefault(PENDING_KEY, []).append((self, attribute, _snapshot(row)))
+        return row
+
+    async def is_stale(self, db) -> bool:
+        """هل غيرت عملية أخرى الإعدادات منذ التحميل؟ (استعلامان على صف واحد)"""
+        current = (
+            await db.scalar(select(SystemSettings.version).limit(1)),
+            await db.scalar(select(PointsSettings.version).limit(1)),
+        )
+        return current != self.versions
+
+    async def refresh_if_stale(self, db) -> bool:
+        """إعادة التحميل إذا كانت النسخة في الذاكرة قديمة"""
+        if not self._loaded or await self.is_stale(db):
+            await self.load(db)
+            return True
+        return False
+
+    def invalidate(self):
+        """إجبار التحميل من قاعدة البيانات عند القراءة التالية"""
+        self._loaded = False
+
+@event.listens_for(Session, 'after_commit')
+def _apply_pending(session):
+    for cache, attribute, snapshot in session.info.pop(PENDING_KEY, []):
+        # إذا لم تحمل الذاكرة بعد فالقراءة التالية ستجلب القيمة المحفوظة كاملة
+        if cache._loaded:
+            setattr(cache, attribute, snapshot)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    if previous_transaction.nested:
+        # التراجع إلى نقطة حفظ لا يلغي باقي المعاملة (write_queue يستعيد session.info بنفسه)
+        return
+    session.info.pop(PENDING_KEY, None)
+
+settings_cache = SettingsCache()
+
+async def watch_settings(interval: int = 30):
+    """مراقبة دورية لإصدار الإعدادات لالتقاط تعديلات العمليات الأخرى"""
+    while True:
+        await asyncio.sleep(interval)
+        db = get_db()
+        try:
+            if await settings_cache.refresh_if_stale(db):
+                logger.info(f"تم تحديث الإعدادات من قاعدة البيانات (الإصدار {settings_cache.version})")
+        except Exception as e:
+            logger.error(f"خطأ في مراقبة الإعدادات: {e}")
+        finally:
+            await db.close()
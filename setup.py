@@ -1,5 +1,6 @@
 import os
 import sys
+import asyncio
 
 def setup():
     """إعداد النظام"""
@@ -27,7 +28,7 @@ def setup():
     print("\n3️⃣ إنشاء قاعدة البيانات...")
     try:
         from database import init_database
-        init_database()
+        asyncio.run(init_database())
         print("✅ تم إنشاء قاعدة البيانات")
     except Exception as e:
         print(f"❌ خطأ في إنشاء قاعدة البيانات: {e}")
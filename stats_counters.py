@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from sqlalchemy import event, select, update, func, inspect
+from sqlalchemy.orm import Session
+from database import SystemStats, User, FundingRequest, FundingRequestArchive, PointsTransfer, PointsTransferArchive, Channel, GroupSource, READ_ONLY_KEY, get_db
+
+logger = logging.getLogger(__name__)
+
+# فروقات العدادات المنتظرة في session.info حتى تنجح المعاملة
+PENDING_KEY = 'stats_counters_pending'
+# فروقات المعاملة التي يجري حفظها (تنتقل للذاكرة بعد commit)
+COMMITTING_KEY = 'stats_counters_committing'
+# المطابقة: ما كان في الذاكرة قبل العد (محسوب في القيم الجديدة فيُطرح بعد commit)
+RECONCILED_KEY = 'stats_counters_reconciled'
+STATS_ID = 1
+
+# فروقات محفوظة لم تُكتب في صف العدادات بعد (تكتبها flush_stats بجملة UPDATE واحدة)
+_unflushed = {}
+
+COUNTERS = ('users', 'admins', 'banned', 'points', 'requests', 'requests_pending',
+            'requests_completed', 'transfers', 'channels', 'groups')
+
+# عداد حالة الطلب لكل قيمة من status
+STATUS_COUNTERS = {'pending': 'requests_pending', 'completed': 'requests_completed'}
+
+def bump(db, **deltas):
+    """إضافة فروقات للعدادات ضمن المعاملة الحالية
+
+    تغييرات ORM (إضافة مستخدم، حظر، تغيير حالة طلب...) تُحسب تلقائياً عند flush؛
+    هذه الدالة للتعديلات المباشرة بجمل UPDATE مثل الأرصدة في points_service.
+    """
+    _add(db.sync_session, deltas)
+
+def _merge(target: dict, deltas: dict, sign: int = 1):
+    for name, delta in deltas.items():
+        value = target.get(name, 0) + sign * delta
+        if value:
+            target[name] = value
+        else:
+            target.pop(name, None)
+
+def _add(session, deltas):
+    _merge(session.info.setdefault(PENDING_KEY, {}), deltas)
+
+def _flag_change(state, attribute):
+    """(-1 أو 0 أو 1) حسب تغير قيمة عمود منطقي منذ آخر flush"""
+    history = state.attrs[attribute].history
+    if not history.has_changes():
+        return 0
+    before = bool(history.deleted[0]) if history.deleted else False
+    after = bool(history.added[0]) if history.added else False
+    return int(after) - int(before)
+
+def _status_change(state):
+    history = state.attrs['status'].history
+    deltas = {}
+    for old in history.deleted:
+        if old in STATUS_COUNTERS:
+            deltas[STATUS_COUNTERS[old]] = deltas.get(STATUS_COUNTERS[old], 0) - 1
+    for new in history.added:
+        if new in STATUS_COUNTERS:
+            deltas[STATUS_COUNTERS[new]] = deltas.get(STATUS_COUNTERS[new], 0) + 1
+    return deltas
+
+@event.listens_for(Session, 'before_flush')
+def _collect_orm_changes(session, flush_context, instances):
+    deltas = {}
+
+    def add(name, delta):
+        deltas[name] = deltas.get(name, 0) + delta
+
+    for obj in session.new:
+        if isinstance(obj, User):
+            add('users', 1)
+            add('admins', int(bool(obj.is_admin)))
+            add('banned', int(bool(obj.is_banned)))
+            add('points', obj.points or 0)
+        elif isinstance(obj, FundingRequest):
+            add('requests', 1)
+            # الحالة الافتراضية pending تُطبق عند الإدخال
+            counter = STATUS_COUNTERS.get(obj.status or 'pending')
+            if counter:
+                add(counter, 1)
+        elif isinstance(obj, PointsTransfer):
+            add('transfers', 1)
+        elif isinstance(obj, Channel):
+            add('channels', 1)
+        elif isinstance(obj, GroupSource):
+            add('groups', 1)
+
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            state = inspect(obj)
+            add('admins', _flag_change(state, 'is_admin'))
+            add('banned', _flag_change(state, 'is_banned'))
+        elif isinstance(obj, FundingRequest):
+            for name, delta in _status_change(inspect(obj)).items():
+                add(name, delta)
+
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            add('users', -1)
+            add('admins', -int(bool(obj.is_admin)))
+            add('banned', -int(bool(obj.is_banned)))
+            add('points', -(obj.points or 0))
+        elif isinstance(obj, FundingRequest):
+            add('requests', -1)
+            counter = STATUS_COUNTERS.get(obj.status)
+            if counter:
+                add(counter, -1)
+        elif isinstance(obj, PointsTransfer):
+            add('transfers', -1)
+        elif isinstance(obj, Channel):
+            add('channels', -1)
+        elif isinstance(obj, GroupSource):
+            add('groups', -1)
+
+    _add(session, deltas)
+
+@event.listens_for(Session, 'before_commit')
+def _collect_pending(session):
+    # before_commit يسبق flush الأخير، فنحسب تغييرات ORM المتبقية أولاً
+    session.flush()
+    deltas = session.info.pop(PENDING_KEY, None)
+    if deltas:
+        session.info[COMMITTING_KEY] = deltas
+
+@event.listens_for(Session, 'after_commit')
+def _keep_committed(session):
+    # لا كتابة في صف العدادات مع كل معاملة: صف واحد تتسلسل عليه كل الكتابات المتوازية
+    # (قفل صف في PostgreSQL). الفروقات تُجمع في الذاكرة وتكتبها flush_stats دورياً
+    _merge(_unflushed, session.info.pop(COMMITTING_KEY, {}))
+    reconciled = session.info.pop(RECONCILED_KEY, None)
+    if reconciled is not None:
+        _merge(_unflushed, reconciled, sign=-1)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    if previous_transaction.nested:
+        # التراجع إلى نقطة حفظ لا يلغي باقي المعاملة (write_queue يستعيد session.info بنفسه)
+        return
+    for key in (PENDING_KEY, COMMITTING_KEY, RECONCILED_KEY):
+        session.info.pop(key, None)
+
+async def flush_stats(session_factory=None) -> dict:
+    """كتابة الفروقات المجمعة في صف العدادات (جملة UPDATE واحدة) وإرجاعها
+
+    الفروقات تُضاف للقيم الموجودة، فعدة عمليات تكتب في نفس الصف بلا تعارض. ما لم يُكتب
+    عند توقف مفاجئ تصححه المطابقة التالية.
+    """
+    deltas = dict(_unflushed)
+    if not deltas:
+        return {}
+    _unflushed.clear()
+    db = (session_factory or get_db)()
+    try:
+        await db.execute(
+            update(SystemStats)
+            .where(SystemStats.id == STATS_ID)
+            .values({name: getattr(SystemStats, name) + delta for name, delta in deltas.items()})
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        _merge(_unflushed, deltas)
+        raise
+    finally:
+        await db.close()
+    return deltas
+
+# ==================== القراءة والمطابقة ====================
+async def read_stats(db):
+    """قيم العدادات: الصف مع الفروقات التي لم تُكتب فيه بعد (يُنشأ بالمطابقة إذا لم يوجد)"""
+    stats = await db.get(SystemStats, STATS_ID)
+    if stats is None:
+        if db.sync_session.info.get(READ_ONLY_KEY):
+            # جلسة القراءة لا تنشئ الصف؛ نحسب القيم مرة واحدة بدون حفظ
+            return SimpleNamespace(**await count_all(db), reconciled_at=None)
+        await reconcile(db)
+        stats = await db.get(SystemStats, STATS_ID)
+    return SimpleNamespace(
+        **{name: (getattr(stats, name) or 0) + _unflushed.get(name, 0) for name in COUNTERS},
+        reconciled_at=stats.reconciled_at,
+    )
+
+async def count_all(db) -> dict:
+    """حساب كل العدادات من الجداول مباشرة (مكلف: للمطابقة فقط)
+
+    الطلبات والتحويلات تشمل الأرشيف؛ النقل للأرشيف لا يغير العدادات.
+    """
+    return {
+        'users': await db.scalar(select(func.count()).select_from(User)),
+        'admins': await db.scalar(select(func.count()).select_from(User).filter_by(is_admin=True)),
+        'banned': await db.scalar(select(func.count()).select_from(User).filter_by(is_banned=True)),
+        'points': await db.scalar(select(func.sum(User.points))) or 0,
+        'requests': await db.scalar(select(func.count()).select_from(FundingRequest))
+            + await db.scalar(select(func.count()).select_from(FundingRequestArchive)),
+        'requests_pending': await db.scalar(select(func.count()).select_from(FundingRequest).filter_by(status='pending')),
+        'requests_completed': await db.scalar(select(func.count()).select_from(FundingRequest).filter_by(status='completed'))
+            + await db.scalar(select(func.count()).select_from(FundingRequestArchive).filter_by(status='completed')),
+        'transfers': await db.scalar(select(func.count()).select_from(PointsTransfer))
+            + await db.scalar(select(func.count()).select_from(PointsTransferArchive)),
+        'channels': await db.scalar(select(func.count()).select_from(Channel)),
+        'groups': await db.scalar(select(func.count()).select_from(GroupSource)),
+    }
+
+async def reconcile(db):
+    """تصحيح العدادات من الجداول وإرجاع الفروقات التي صُححت"""
+    # الفروقات المحفوظة قبل العد محسوبة ضمن count_all، فتُطرح من الذاكرة بعد commit
+    baseline = dict(_unflushed)
+    db.sync_session.info[RECONCILED_KEY] = baseline
+    counts = await count_all(db)
+    # فروقات هذه المعاملة محسوبة ضمن count_all
+    db.sync_session.info.pop(PENDING_KEY, None)
+    stats = await db.get(SystemStats, STATS_ID)
+    if stats is None:
+        stats = SystemStats(id=STATS_ID)
+        db.add(stats)
+    drift = {name: counts[name] - (getattr(stats, name) or 0) - baseline.get(name, 0) for name in COUNTERS}
+    for name, value in counts.items():
+        setattr(stats, name, value)
+    stats.reconciled_at = datetime.now()
+    await db.flush()
+    return {name: delta for name, delta in drift.items() if delta}
+
+async def reconcile_stats(interval: int = 3600, flush_interval: int = 10):
+    """مهمة خلفية: كتابة الفروقات المجمعة كل flush_interval ثانية، ومطابقة العدادات كل interval"""
+    reconciled = time.monotonic()
+    while True:
+        await asyncio.sleep(flush_interval)
+        if time.monotonic() - reconciled < interval:
+            try:
+                await flush_stats()
+            except Exception as e:
+                logger.error(f"خطأ في كتابة عدادات الإحصائيات: {e}")
+            continue
+        reconciled = time.monotonic()
+        db = get_db()
+        try:
+            drift = await reconcile(db)
+            await db.commit()
+            if drift:
+                logger.warning(f"تم تصحيح عدادات الإحصائيات: {drift}")
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"خطأ في مطابقة عدادات الإحصائيات: {e}")
+        finally:
+            await db.close()
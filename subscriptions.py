@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from config import Config
+from database import Channel, ChannelMembership
+from metrics import registry
+from write_queue import write_queue
+
+logger = logging.getLogger(__name__)
+
+# حالات العضوية التي تعني أن المستخدم غير مشترك
+LEFT_STATUSES = ('left', 'kicked')
+
+# مفتاح session.info: تغيرت القنوات في هذه المعاملة فتُمسح القائمة بعد commit
+PENDING_KEY = 'mandatory_channels_pending'
+
+CHANNEL_FIELDS = ('channel_id', 'channel_username', 'channel_title')
+
+class MandatoryChannels:
+    """قائمة القنوات الإجبارية في الذاكرة
+
+    تُمسح بعد حفظ أي تعديل على جدول القنوات في هذه العملية، ومدة الصلاحية تلتقط
+    تعديلات العمليات الأخرى.
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self._channels = None
+        self._expires = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self, db) -> list:
+        if self._channels is None or self._expires < time.monotonic():
+            async with self._lock:
+                if self._channels is None or self._expires < time.monotonic():
+                    rows = (await db.scalars(select(Channel).filter_by(is_mandatory=True).order_by(Channel.id))).all()
+                    self._channels = [
+                        SimpleNamespace(**{name: getattr(row, name) for name in CHANNEL_FIELDS}) for row in rows
+                    ]
+                    self._expires = time.monotonic() + self.ttl
+        return self._channels
+
+    def invalidate(self):
+        self._channels = None
+
+class MembershipCache:
+    """اشتراكات مؤكدة لكل (مستخدم، قناة) مع مدة صلاحية
+
+    تُخزن النتائج الإيجابية فقط: المستخدم الذي اشترك للتو يُفحص مجدداً في الضغطة التالية.
+    """
+
+    def __init__(self, maxsize: int = 50000, ttl: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_member(self, user_id: int, channel_id: str) -> bool:
+        key = (user_id, channel_id)
+        expires = self._entries.get(key)
+        if expires is None:
+            self.misses += 1
+            return False
+        if expires < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def remember(self, user_id: int, channel_id: str):
+        key = (user_id, channel_id)
+        self._entries[key] = time.monotonic() + self.ttl
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def forget(self, user_id: int, channel_id: str):
+        self._entries.pop((user_id, channel_id), None)
+
+    def clear(self):
+        self._entries.clear()
+
+mandatory_channels = MandatoryChannels(Config.MANDATORY_CHANNELS_TTL)
+membership_cache = MembershipCache(Config.MEMBERSHIP_CACHE_SIZE, Config.MEMBERSHIP_CACHE_TTL)
+registry.cache('memberships', membership_cache)
+
+async def _store(db, user_id: int, channel_id: str, status: str):
+    """حفظ حالة الاشتراك في السجل المحلي (في جلسة المستدعي)"""
+    row = await db.get(ChannelMembership, (user_id, channel_id))
+    if row is None:
+        row = ChannelMembership(user_id=user_id, channel_id=channel_id)
+        db.add(row)
+    row.status = status
+    row.updated_at = datetime.now()
+
+async def _store_results(db, user_id: int, results: list):
+    """عملية طابور الكتابة: حفظ نتائج فحص Telegram [(القناة، الحالة)]"""
+    for channel_id, status in results:
+        await _store(db, user_id, channel_id, status)
+
+async def missing_channels(bot, db, user_id: int) -> list:
+    """القنوات الإجبارية التي لم يشترك فيها المستخدم
+
+    الترتيب: الذاكرة، ثم سجل الاشتراكات المحلي (استعلام واحد)، ثم Telegram للباقي فقط.
+    السجل يُعتمد عليه للاشتراك المؤكد؛ غير المشترك يُسأل عنه Telegram دائماً حتى يمر من
+    اشترك للتو في قناة لا تصلنا تحديثاتها. القنوات المتبقية تُفحص معاً (asyncio.gather)،
+    والقناة التي يتعذر على البوت فحصها لا تمنع المستخدم.
+    نتائج Telegram تُحفظ عبر طابور الكتابة لا جلسة التحديث: /start يسجل المستخدم بعدها عبر
+    الطابور أيضاً، وكتابة في جلسة التحديث قبله تحجز قفل SQLite الذي ينتظره الطابور.
+    """
+    channels = await mandatory_channels.get(db)
+    unknown = [channel for channel in channels if not membership_cache.is_member(user_id, channel.channel_id)]
+    if not unknown:
+        return []
+
+    rows = {
+        row.channel_id: row
+        for row in await db.scalars(
+            select(ChannelMembership).where(
+                ChannelMembership.user_id == user_id,
+                ChannelMembership.channel_id.in_([channel.channel_id for channel in unknown]),
+            )
+        )
+    }
+    fresh_after = datetime.now() - timedelta(seconds=Config.MEMBERSHIP_RECORD_TTL)
+    to_check = []
+    for channel in unknown:
+        row = rows.get(channel.channel_id)
+        if row is not None and row.status not in LEFT_STATUSES and row.updated_at >= fresh_after:
+            membership_cache.remember(user_id, channel.channel_id)
+        else:
+            to_check.append(channel)
+    if not to_check:
+        return []
+
+    results = await asyncio.gather(
+        *[bot.get_chat_member(channel.channel_id, user_id) for channel in to_check],
+        return_exceptions=True,
+    )
+    missing = []
+    checked = []
+    for channel, result in zip(to_check, results):
+        if isinstance(result, Exception):
+            logger.warning(f"تعذر فحص الاشتراك في {channel.channel_id}: {result}")
+            continue
+        checked.append((channel.channel_id, result.status))
+        if result.status in LEFT_STATUSES:
+            missing.append(channel)
+        else:
+            membership_cache.remember(user_id, channel.channel_id)
+    if checked:
+        try:
+            await write_queue.submit(_store_results, user_id, checked)
+        except Exception as exc:
+            # السجل تحسين فقط: الفحص التالي يسأل Telegram مجدداً
+            logger.warning(f"تعذر حفظ نتائج فحص الاشتراك للمستخدم {user_id}: {exc}")
+    return missing
+
+async def record_membership(db, change) -> bool:
+    """تحديث السجل من ChatMemberUpdated؛ يرجع False إذا لم تكن القناة إجبارية
+
+    Telegram يرسل هذه التحديثات فقط للقنوات التي البوت مشرف فيها.
+    """
+    chat = change.chat
+    names = {str(chat.id)}
+    if chat.username:
+        names.add(f"@{chat.username}".lower())
+    channels = await mandatory_channels.get(db)
+    channel = next((channel for channel in channels if channel.channel_id.lower() in names), None)
+    if channel is None:
+        return False
+
+    member = change.new_chat_member
+    status = member.status
+    if status == 'restricted' and not getattr(member, 'is_member', True):
+        status = 'left'
+    await _store(db, member.user.id, channel.channel_id, status)
+    if status in LEFT_STATUSES:
+        membership_cache.forget(member.user.id, channel.channel_id)
+    else:
+        membership_cache.remember(member.user.id, channel.channel_id)
+    return True
+
+@event.listens_for(Session, 'before_flush')
+def _collect_channel_changes(session, flush_context, instances):
+    if any(isinstance(obj, Channel) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info[PENDING_KEY] = True
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop(PENDING_KEY, False):
+        mandatory_channels.invalidate()
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    if previous_transaction.nested:
+        return
+    session.info.pop(PENDING_KEY, None)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# قاعدة في الذاكرة حتى لا تلمس الاختبارات ملف bot_database.db
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database import Base, User, create_db_engine
+from stats_counters import reconcile
+from admin_panel_handlers import show_all_users
+
+class FakeQuery:
+    def __init__(self, data):
+        self.data = data
+        self.text = None
+        self.markup = None
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def edit_message_text(self, text, reply_markup=None):
+        self.text = text
+        self.markup = reply_markup
+
+def _buttons(query):
+    return {button.text: button.callback_data for button in query.markup.inline_keyboard[0]}
+
+def _user_ids(query):
+    return [int(line.split("🆔: ")[1].split(" ")[0]) for line in query.text.splitlines() if "🆔: " in line]
+
+def test_keyset_pages_walk_forward_and_back():
+    async def scenario():
+        engine = create_db_engine('sqlite:///:memory:')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        start = datetime(2024, 1, 1)
+        async with sessions() as db:
+            # مستخدمان في نفس اللحظة لاختبار كسر التعادل بالـ id
+            db.add_all([User(user_id=1000 + i, first_name=f"u{i}", created_at=start + timedelta(minutes=i // 2))
+                        for i in range(25)])
+            await db.flush()
+            await reconcile(db)
+            await db.commit()
+
+        async def open_page(data):
+            query = FakeQuery(data)
+            async with sessions() as db:
+                await show_all_users(SimpleNamespace(callback_query=query), SimpleNamespace(db=db, read_db=db))
+            return query
+
+        pages = [await open_page("show_all_users_1")]
+        while "▶️ التالي" in _buttons(pages[-1]):
+            pages.append(await open_page(_buttons(pages[-1])["▶️ التالي"]))
+        back = await open_page(_buttons(pages[2])["◀️ السابق"])
+        await engine.dispose()
+        return pages, back
+
+    pages, back = asyncio.run(scenario())
+
+    seen = [user_id for page in pages for user_id in _user_ids(page)]
+    assert seen == list(range(1024, 999, -1))
+    assert [len(_user_ids(page)) for page in pages] == [10, 10, 5]
+    assert "الصفحة 3 من ~3" in pages[2].text
+    assert _user_ids(back) == _user_ids(pages[1])
+    assert all(len(data.encode()) <= 64 for page in pages for data in _buttons(page).values())
@@ -0,0 +1,83 @@
+import asyncio
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from telegram.error import Forbidden
+from database import Base, User, create_db_engine
+from admin_roster import admin_roster
+
+class FakeBot:
+    def __init__(self, blocked=()):
+        self.blocked = set(blocked)
+        self.sent = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if chat_id in self.blocked:
+                raise Forbidden("bot was blocked by the user")
+            self.sent.append(chat_id)
+        finally:
+            self.in_flight -= 1
+
+def test_roster_is_cached_and_notifications_fan_out():
+    async def scenario():
+        engine = create_db_engine('sqlite:///:memory:')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        admin_roster.invalidate()
+        admin_roster.failures.clear()
+        async with sessions() as db:
+            db.add_all([User(user_id=i, is_admin=True) for i in (1, 2, 3)] + [User(user_id=4)])
+            await db.commit()
+
+            bot = FakeBot(blocked={2})
+            first = await admin_roster.notify(bot, db, "طلب جديد")
+            failure = admin_roster.failures.get(2)
+
+            # ترقية مستخدم تمسح القائمة بعد الحفظ
+            user = await db.scalar(select(User).filter_by(user_id=4))
+            user.is_admin = True
+            await db.commit()
+            bot.blocked.clear()
+            second = await admin_roster.notify(bot, db, "طلب جديد")
+        await engine.dispose()
+        return first, failure, second, bot
+
+    first, failure, second, bot = asyncio.run(scenario())
+
+    assert first == (2, 1)
+    assert failure[0] == 1
+    assert bot.max_in_flight == 4
+    assert second == (4, 0)
+    assert sorted(bot.sent) == [1, 1, 2, 3, 3, 4]
+    # نجاح لاحق يمسح سجل الفشل
+    assert admin_roster.failures == {}
+
+def test_roster_reads_the_database_once():
+    async def scenario():
+        engine = create_db_engine('sqlite:///:memory:')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        admin_roster.invalidate()
+        async with sessions() as db:
+            db.add(User(user_id=1, is_admin=True))
+            await db.commit()
+        statements = []
+        event.listen(engine.sync_engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        async with sessions() as db:
+            for _ in range(3):
+                admins = await admin_roster.get(db)
+        await engine.dispose()
+        return admins, statements
+
+    admins, statements = asyncio.run(scenario())
+
+    assert [admin.user_id for admin in admins] == [1]
+    assert len([s for s in statements if s.startswith('SELECT')]) == 1
@@ -0,0 +1,139 @@
+import asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import MetaData, inspect, select, func, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database import (Base, User, FundingRequest, FundingRequestArchive, PointsTransfer,
+                      PointsTransferArchive, create_db_engine)
+from archive import archive_finished, user_requests, recent_transfers, transfer_totals
+from migrations import migration_010_archived_ids_not_reused
+from stats_counters import reconcile
+
+NOW = datetime(2024, 6, 1)
+
+def _request(id, status, age_days):
+    when = NOW - timedelta(days=age_days)
+    return FundingRequest(id=id, user_id=1, target_channel="@c", target_type="channel", requested_members=1,
+                          points_cost=25, status=status, created_at=when, updated_at=when)
+
+def _transfer(id, age_days):
+    return PointsTransfer(id=id, from_user_id=1, to_user_id=2, amount=10, fee_percent=5, fee_amount=1,
+                          net_amount=10, transfer_date=NOW - timedelta(days=age_days))
+
+def test_finished_rows_move_and_history_reads_both(tmp_path, monkeypatch):
+    monkeypatch.setattr('config.Config.ARCHIVE_BATCH_SIZE', 2)
+
+    async def scenario():
+        engine = create_db_engine(f"sqlite:///{tmp_path / 'bot.db'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with sessions() as db:
+            db.add_all([User(user_id=1), User(user_id=2)])
+            db.add_all([
+                _request(1, 'completed', 30), _request(2, 'rejected', 20), _request(3, 'failed', 10),
+                _request(4, 'pending', 40), _request(5, 'completed', 1),
+            ])
+            db.add_all([_transfer(i, age) for i, age in enumerate((90, 60, 45, 5), 1)])
+            await db.flush()
+            await reconcile(db)
+            await db.commit()
+
+        moved = await archive_finished(sessions, now=NOW)
+
+        async with sessions() as db:
+            hot_requests = (await db.scalars(select(FundingRequest.id).order_by(FundingRequest.id))).all()
+            archived_requests = (await db.scalars(select(FundingRequestArchive.id).order_by(FundingRequestArchive.id))).all()
+            hot_transfers = await db.scalar(select(func.count()).select_from(PointsTransfer))
+            archived_transfers = await db.scalar(select(func.count()).select_from(PointsTransferArchive))
+            history = [row.id for row in await user_requests(db, 1, limit=10)]
+            transfers = [row.id for row in await recent_transfers(db, 2, limit=3)]
+            totals = await transfer_totals(db)
+            drift = await reconcile(db)
+        await engine.dispose()
+        return (moved, hot_requests, archived_requests, hot_transfers, archived_transfers,
+                history, transfers, totals, drift)
+
+    (moved, hot_requests, archived_requests, hot_transfers, archived_transfers,
+     history, transfers, totals, drift) = asyncio.run(scenario())
+
+    assert moved == {'requests': 3, 'transfers': 3}
+    assert hot_requests == [4, 5]
+    assert archived_requests == [1, 2, 3]
+    assert (hot_transfers, archived_transfers) == (1, 3)
+    # الأحدث أولاً من الجدولين معاً
+    assert history == [5, 3, 2, 1, 4]
+    assert transfers == [4, 3, 2]
+    assert totals == (4, 40, 4)
+    assert drift == {}
+
+def test_ids_are_not_reused_after_archiving(tmp_path):
+    async def scenario():
+        engine = create_db_engine(f"sqlite:///{tmp_path / 'bot.db'}", attached={})
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+        async def add_transfer():
+            async with sessions() as db:
+                transfer = _transfer(None, 90)
+                db.add(transfer)
+                await db.commit()
+                return transfer.id
+
+        first = [await add_transfer(), await add_transfer()]
+        moved = [await archive_finished(sessions, now=NOW)]
+        # الجدول الساخن فارغ الآن: الرقم التالي يكمل بعد المؤرشف
+        second = await add_transfer()
+        moved.append(await archive_finished(sessions, now=NOW))
+        async with sessions() as db:
+            archived = (await db.scalars(select(PointsTransferArchive.id).order_by(PointsTransferArchive.id))).all()
+        await engine.dispose()
+        return first, second, moved, archived
+
+    first, second, moved, archived = asyncio.run(scenario())
+
+    assert first == [1, 2]
+    assert second == 3
+    assert [result['transfers'] for result in moved] == [2, 1]
+    assert archived == [1, 2, 3]
+
+def test_migration_rebuilds_old_tables_and_starts_after_archived_ids(tmp_path):
+    async def scenario():
+        engine = create_db_engine(f"sqlite:///{tmp_path / 'old.db'}", attached={})
+        # مخطط قديم: جدول الطلبات بدون AUTOINCREMENT، وأعلى طلب مؤرشف رقمه 7
+        old = MetaData()
+        FundingRequest.__table__.to_metadata(old).dialect_options['sqlite']['autoincrement'] = False
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda sync_conn: Base.metadata.create_all(
+                sync_conn, tables=[table for table in Base.metadata.sorted_tables if table.name != 'funding_requests']
+            ))
+            await conn.run_sync(old.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with sessions() as db:
+            db.add_all([_request(3, 'pending', 1), _request(5, 'pending', 1)])
+            db.add(FundingRequestArchive(id=7, user_id=1, target_channel="@c", target_type="channel",
+                                         requested_members=1, points_cost=25, status='completed'))
+            await db.commit()
+
+        await migration_010_archived_ids_not_reused(engine)
+        # إعادة التشغيل لا تعيد البناء
+        await migration_010_archived_ids_not_reused(engine)
+
+        async with sessions() as db:
+            request = _request(None, 'pending', 0)
+            db.add(request)
+            await db.commit()
+            ids = (await db.scalars(select(FundingRequest.id).order_by(FundingRequest.id))).all()
+        async with engine.connect() as conn:
+            definition = await conn.scalar(text("SELECT sql FROM sqlite_master WHERE name = 'funding_requests'"))
+            indexes = await conn.run_sync(
+                lambda sync_conn: {index['name'] for index in inspect(sync_conn).get_indexes('funding_requests')}
+            )
+        await engine.dispose()
+        return ids, definition, indexes
+
+    ids, definition, indexes = asyncio.run(scenario())
+
+    assert ids == [3, 5, 8]
+    assert 'AUTOINCREMENT' in definition
+    assert indexes == {'ix_funding_requests_status_created', 'ix_funding_requests_user_created'}
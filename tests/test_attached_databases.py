@@ -0,0 +1,71 @@
+import asyncio
+import sqlite3
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database import Base, User, PointsLedger, FundingRequest, create_db_engine
+from migrations import relocate_attached_tables
+from points_service import credit
+
+def _tables(path):
+    with sqlite3.connect(path) as conn:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+def test_tables_live_in_their_own_files(tmp_path):
+    attached = {'ledger': str(tmp_path / 'ledger.db'), 'jobs': str(tmp_path / 'jobs.db')}
+
+    async def scenario():
+        engine = create_db_engine(f"sqlite:///{tmp_path / 'bot.db'}", attached=attached)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with sessions() as db:
+            db.add(User(user_id=1))
+            await db.flush()
+            await credit(db, 1, 30, 'admin_grant')
+            await db.commit()
+        async with sessions() as db:
+            entries = await db.scalar(select(func.count()).select_from(PointsLedger))
+        await engine.dispose()
+        return entries
+
+    assert asyncio.run(scenario()) == 1
+    assert 'users' in _tables(tmp_path / 'bot.db')
+    assert 'points_ledger' not in _tables(tmp_path / 'bot.db')
+    assert {'points_ledger', 'balance_snapshots', 'points_transfers'} <= _tables(tmp_path / 'ledger.db')
+    assert {'funding_requests', 'funding_requests_archive'} <= _tables(tmp_path / 'jobs.db')
+
+def test_existing_tables_are_relocated_with_their_rows(tmp_path):
+    main = tmp_path / 'bot.db'
+    attached = {'ledger': str(tmp_path / 'ledger.db'), 'jobs': str(tmp_path / 'jobs.db')}
+
+    async def scenario():
+        # قاعدة قديمة: كل الجداول في الملف الرئيسي
+        engine = create_db_engine(f"sqlite:///{main}", attached={})
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with sessions() as db:
+            db.add(User(user_id=1))
+            db.add(FundingRequest(user_id=1, target_channel="@c", target_type="channel",
+                                  requested_members=1, points_cost=25))
+            await db.flush()
+            await credit(db, 1, 30, 'admin_grant')
+            await db.commit()
+        await engine.dispose()
+
+        engine = create_db_engine(f"sqlite:///{main}", attached=attached)
+        first = await relocate_attached_tables(engine)
+        second = await relocate_attached_tables(engine)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with sessions() as db:
+            entries = await db.scalar(select(func.count()).select_from(PointsLedger))
+            requests = await db.scalar(select(func.count()).select_from(FundingRequest))
+        await engine.dispose()
+        return first, second, entries, requests
+
+    first, second, entries, requests = asyncio.run(scenario())
+
+    assert {'points_ledger', 'funding_requests'} <= set(first)
+    assert second == []
+    assert (entries, requests) == (1, 1)
+    assert _tables(main) & set(first) == set()
@@ -0,0 +1,132 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from telegram.error import Forbidden, NetworkError
+from database import Base, User, BroadcastJob, PointsLedger, SystemSettings, create_db_engine
+from broadcast import Broadcaster, create_broadcast
+from bot_handlers import handle_message
+from callback_router import router
+from settings_cache import settings_cache
+from user_cache import user_cache
+
+class FakeBot:
+    def __init__(self, crash_on=None):
+        self.sent = []
+        self.edits = []
+        self.crash_on = crash_on
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == self.crash_on:
+            self.crash_on = None
+            raise RuntimeError("process killed")
+        if chat_id == 3:
+            raise Forbidden("bot was blocked by the user")
+        if chat_id == 4:
+            raise NetworkError("timeout")
+        self.sent.append(chat_id)
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append(text)
+
+def _scenario(crash_on=None):
+    async def scenario():
+        engine = create_db_engine('sqlite:///:memory:')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with sessions() as db:
+            db.add_all([User(user_id=i) for i in range(1, 8)])
+            db.add(User(user_id=8, is_banned=True))
+            db.add(User(user_id=9, bot_blocked=True))
+            job = await create_broadcast(db, 1, "مرحبا", points=5, total=9, progress_chat_id=1, progress_message_id=10)
+            await db.commit()
+
+        bot = FakeBot(crash_on)
+        broadcaster = Broadcaster(bot, session_factory=sessions, page_size=2, progress_interval=0)
+        if crash_on is not None:
+            with pytest.raises(RuntimeError):
+                await broadcaster.run(job.id)
+            # إعادة التشغيل: مرسل جديد يكمل من آخر صفحة محفوظة
+            broadcaster = Broadcaster(bot, session_factory=sessions, page_size=2, progress_interval=0)
+        await broadcaster.run(job.id)
+
+        async with sessions() as db:
+            job = await db.get(BroadcastJob, job.id)
+            points = dict((await db.execute(select(User.user_id, User.points))).all())
+            blocked = (await db.scalars(select(User.user_id).filter_by(bot_blocked=True).order_by(User.user_id))).all()
+            ledger = (await db.scalars(select(PointsLedger.user_id).filter_by(reason='broadcast', ref_id=job.id))).all()
+        await engine.dispose()
+        return job, points, blocked, sorted(ledger), bot
+
+    return asyncio.run(scenario())
+
+def test_broadcast_sends_credits_and_marks_blocked_users():
+    job, points, blocked, ledger, bot = _scenario()
+
+    assert job.status == 'completed'
+    assert (job.sent, job.blocked, job.failed) == (5, 1, 1)
+    assert bot.sent == [1, 2, 5, 6, 7]
+    assert blocked == [3, 9]
+    assert ledger == [1, 2, 5, 6, 7]
+    assert {user_id: p for user_id, p in points.items() if p} == {1: 5, 2: 5, 5: 5, 6: 5, 7: 5}
+    assert "اكتمل" in bot.edits[-1]
+
+def test_broadcast_resumes_without_double_credits():
+    job, points, blocked, ledger, bot = _scenario(crash_on=6)
+
+    assert job.status == 'completed'
+    # الصفحة التي انقطعت (5، 6) أُعيدت فقط
+    assert sorted(bot.sent) == [1, 2, 5, 5, 6, 7]
+    assert ledger == [1, 2, 5, 6, 7]
+    assert points[5] == 5
+
+class FakeChat:
+    """زر أو رسالة من المشرف: يسجل الردود ويعيد رسالة برقم للتقدم"""
+
+    def __init__(self, user_id, data=None, text=None):
+        self.data = data
+        self.text = text
+        self.from_user = SimpleNamespace(id=user_id)
+        self.replies = []
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def edit_message_text(self, text, **kwargs):
+        self.replies.append(text)
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        return SimpleNamespace(chat_id=self.from_user.id, message_id=50)
+
+def test_admin_text_after_broadcast_button_creates_a_job():
+    async def scenario():
+        engine = create_db_engine('sqlite:///:memory:')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        user_cache.clear()
+        user_data = {}
+        async with sessions() as db:
+            db.add_all([User(user_id=1, is_admin=True), User(user_id=2), SystemSettings()])
+            await db.commit()
+            await settings_cache.load(db)
+            context = SimpleNamespace(db=db, read_db=db, user_data=user_data)
+
+            query = FakeChat(1, data="broadcast_with_points")
+            await router.dispatch(SimpleNamespace(callback_query=query), context)
+            message = FakeChat(1, text="10\nهدية للجميع")
+            await handle_message(SimpleNamespace(effective_user=message.from_user, message=message), context)
+            await db.commit()
+            jobs = (await db.scalars(select(BroadcastJob))).all()
+        await engine.dispose()
+        return jobs, message.replies, user_data
+
+    jobs, replies, user_data = asyncio.run(scenario())
+
+    assert [(job.created_by, job.text, job.points, job.progress_message_id) for job in jobs] == [(1, "هدية للجميع", 10, 50)]
+    # الرسالة لم تصل لمعالج الرسائل العام
+    assert len(replies) == 1 and replies[0].startswith("📨 البث #1")
+    assert user_data == {}
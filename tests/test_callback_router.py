@@ -0,0 +1,105 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database import Base, User, SystemSettings, create_db_engine
+from callback_router import CallbackRouter, router
+from settings_cache import settings_cache
+from user_cache import user_cache
+import bot_handlers, admin_panel_handlers  # noqa: F401 تسجيل المسارات
+
+class FakeQuery:
+    def __init__(self, data, user_id):
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id)
+        self.message = self
+        self.answers = []
+        self.replies = []
+
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append(text)
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+async def noop(update, context):
+    pass
+
+def test_exact_routes_win_then_longest_prefix():
+    local = CallbackRouter()
+    local.add("show_all_users_1", noop)
+    local.route("show_", prefix=True)(noop)
+    longer = local.route("show_all_users_", prefix=True)(lambda update, context: None)
+
+    assert local.resolve("show_all_users_1").callback is noop
+    assert local.resolve("show_all_users_2_n_x_5").callback is longer
+    assert local.resolve("show_menu").callback is noop
+    assert local.resolve("sho") is None
+    assert local.resolve("unknown") is None
+    with pytest.raises(ValueError):
+        local.add("show_", noop, prefix=True)
+
+def test_handlers_register_every_screen():
+    for data in ("my_points", "back_to_main", "funding_type_group", "admin_stats", "show_all_users_3",
+                 "approve_request_12", "reject_request_12", "cancel_broadcast_4", "broadcast_with_points"):
+        assert router.resolve(data) is not None, data
+    assert router.resolve("approve_request_12").callback is admin_panel_handlers.approve_funding_request
+    assert router.resolve("approve_request_12").admin_only
+    assert not router.resolve("my_points").admin_only
+
+def test_dispatch_checks_admin_rights_and_maintenance():
+    async def scenario():
+        engine = create_db_engine('sqlite:///:memory:')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        calls = []
+        local = CallbackRouter()
+
+        @local.route("admin_stats", admin_only=True, answer=False)
+        async def admin_stats(update, context):
+            calls.append(("admin_stats", update.callback_query.from_user.id))
+
+        @local.route("funding_type_", prefix=True)
+        async def funding_type(update, context):
+            calls.append(("funding", update.callback_query.data))
+
+        user_cache.clear()
+        async with sessions() as db:
+            settings = SystemSettings(maintenance_mode=False, maintenance_message="صيانة")
+            db.add_all([User(user_id=1, is_admin=True), User(user_id=2), settings])
+            await db.commit()
+            await settings_cache.load(db)
+
+            async def press(data, user_id):
+                query = FakeQuery(data, user_id)
+                await local.dispatch(SimpleNamespace(callback_query=query), SimpleNamespace(db=db))
+                return query
+
+            denied = await press("admin_stats", 2)
+            allowed = await press("admin_stats", 1)
+            funding = await press("funding_type_channel", 2)
+            stale = await press("copy_link", 2)
+
+            settings.maintenance_mode = True
+            await db.commit()
+            await settings_cache.load(db)
+            blocked = await press("funding_type_group", 2)
+            await press("admin_stats", 1)
+
+            settings.maintenance_mode = False
+            await db.commit()
+            await settings_cache.load(db)
+        await engine.dispose()
+        return calls, denied, allowed, funding, stale, blocked
+
+    calls, denied, allowed, funding, stale, blocked = asyncio.run(scenario())
+
+    assert calls == [("admin_stats", 1), ("funding", "funding_type_channel"), ("admin_stats", 1)]
+    assert denied.answers == ["❌ ليس لديك صلاحية!"]
+    # المعالج الذي يرد بنفسه لا يُرد عنه
+    assert allowed.answers == []
+    assert funding.answers == [None]
+    assert stale.answers == [None]
+    # الصيانة توقف أزرار المستخدمين فقط
+    assert blocked.replies == ["🔧 صيانة"]
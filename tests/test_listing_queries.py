@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database import Base, User, FundingRequest, PointsTransfer, create_db_engine
+from user_cache import user_cache
+from admin_panel_handlers import admin_requests, view_transfers_log
+from bot_handlers import show_transfer_history
+
+class FakeQuery:
+    def __init__(self, data, user_id=1):
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id)
+        self.text = None
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def edit_message_text(self, text, **kwargs):
+        self.text = text
+
+async def _admin_requests(db, query):
+    await admin_requests(SimpleNamespace(callback_query=query), SimpleNamespace(db=db, read_db=db))
+
+async def _view_transfers_log(db, query):
+    await view_transfers_log(SimpleNamespace(callback_query=query), SimpleNamespace(db=db, read_db=db))
+
+async def _show_transfer_history(db, query):
+    await show_transfer_history(query, SimpleNamespace(db=db))
+
+SCREENS = [_admin_requests, _view_transfers_log, _show_transfer_history]
+
+def _statements_per_screen(rows):
+    async def scenario():
+        engine = create_db_engine('sqlite:///:memory:')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with sessions() as db:
+            db.add_all([User(user_id=i, first_name=f"u{i}") for i in range(1, rows + 2)])
+            db.add_all([FundingRequest(user_id=i, target_channel="@c", target_type="channel",
+                                       requested_members=1, points_cost=25) for i in range(2, rows + 2)])
+            db.add_all([PointsTransfer(from_user_id=1, to_user_id=i, amount=1, fee_percent=0,
+                                       fee_amount=0, net_amount=1) for i in range(2, rows + 2)])
+            await db.commit()
+
+        statements = []
+        event.listen(engine.sync_engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        counts = {}
+        for screen in SCREENS:
+            user_cache.clear()
+            statements.clear()
+            query = FakeQuery(screen.__name__)
+            async with sessions() as db:
+                await screen(db, query)
+            assert "u2" in query.text
+            counts[screen.__name__] = len([s for s in statements if s.startswith('SELECT')])
+        await engine.dispose()
+        return counts
+
+    return asyncio.run(scenario())
+
+def test_statement_count_does_not_grow_with_rows():
+    few = _statements_per_screen(2)
+    many = _statements_per_screen(10)
+
+    assert few == many
+    # الاستعلام الرئيسي + استعلام IN واحد للأسماء
+    assert set(many.values()) == {2}
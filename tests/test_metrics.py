@@ -0,0 +1,98 @@
+import asyncio
+import re
+from types import SimpleNamespace
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from sqlalchemy import text
+from telegram.error import BadRequest
+from telegram.ext import CallbackQueryHandler
+from database import create_db_engine
+from metrics import Registry, registry, instrument_handler, instrument_engine
+from rate_limiter import PriorityRateLimiter
+from web_server import create_web_app
+import user_cache, write_queue  # noqa: F401 تسجيل مقاييس الوحدتين
+
+def _sample(body: str, name: str, **labels) -> float:
+    """قيمة عينة واحدة من نص Prometheus"""
+    for line in body.splitlines():
+        match = re.fullmatch(r'(\w+)(?:\{(.*)\})? (\S+)', line)
+        if not match or match.group(1) != name:
+            continue
+        found = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group(2) or ''))
+        if all(found.get(key) == str(value) for key, value in labels.items()):
+            return float(match.group(3))
+    raise KeyError((name, labels))
+
+def test_handlers_queries_and_api_calls_are_measured():
+    async def scenario():
+        async def show_menu(update, context):
+            await asyncio.sleep(0.01)
+
+        async def broken(update, context):
+            raise ValueError("boom")
+
+        handler = instrument_handler(CallbackQueryHandler(show_menu))
+        await handler.callback(None, None)
+        with pytest.raises(ValueError):
+            await instrument_handler(CallbackQueryHandler(broken)).callback(None, None)
+
+        engine = instrument_engine(create_db_engine('sqlite:///:memory:'), 'test')
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await conn.execute(text("select 2"))
+        await engine.dispose()
+
+        limiter = PriorityRateLimiter(max_retries=0)
+
+        async def rejected():
+            raise BadRequest("message is not modified")
+
+        with pytest.raises(BadRequest):
+            await limiter.process_request(rejected, (), {}, 'editMessageText', {'chat_id': 1}, None)
+        await limiter.shutdown()
+        registry.register(limiter.collect)
+        try:
+            return await registry.render()
+        finally:
+            registry.unregister(limiter.collect)
+
+    body = asyncio.run(scenario())
+
+    assert _sample(body, 'bot_handler_updates_total', handler='show_menu', status='ok') >= 1
+    assert _sample(body, 'bot_handler_updates_total', handler='broken', status='error') >= 1
+    assert _sample(body, 'bot_handler_duration_seconds_bucket', handler='show_menu', le='0.005') == 0
+    assert _sample(body, 'bot_handler_duration_seconds_bucket', handler='show_menu', le='+Inf') >= 1
+    assert _sample(body, 'bot_db_queries_total', engine='test', statement='SELECT') == 2
+    assert _sample(body, 'bot_api_requests_total', method='editMessageText', error='BadRequest') >= 1
+    assert _sample(body, 'bot_api_queued', priority='interactive') == 0
+    assert '# TYPE bot_handler_updates_total counter' in body
+    assert '# TYPE bot_db_query_duration_seconds histogram' in body
+
+def test_metrics_route_requires_token_and_survives_broken_collectors():
+    async def scenario():
+        cache = SimpleNamespace(hits=3, misses=1)
+        local = Registry()
+        local.cache('test', cache)
+        local.register(lambda: 1 / 0)
+        local.counter('bot_test_events', "Test events", ('kind',)).inc(kind='a "quoted"\nvalue')
+        rendered = await local.render()
+
+        app = create_web_app(SimpleNamespace(running=True), metrics_token='token')
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            denied = (await client.get('/metrics')).status
+            allowed = await client.get('/metrics', headers={'Authorization': 'Bearer token'})
+            body = await allowed.text()
+        finally:
+            await client.close()
+        return rendered, denied, allowed.status, allowed.content_type, body
+
+    rendered, denied, status, content_type, body = asyncio.run(scenario())
+
+    assert _sample(rendered, 'bot_cache_hit_ratio', cache='test') == 0.75
+    assert 'bot_test_events_total{kind="a \\"quoted\\"\\nvalue"} 1' in rendered
+    assert (denied, status, content_type) == (401, 200, 'text/plain')
+    # المقاييس التي تسجلها الوحدات عند استيرادها
+    assert _sample(body, 'bot_cache_hits_total', cache='users') >= 0
+    assert _sample(body, 'bot_write_queue_depth') == 0
@@ -0,0 +1,34 @@
+import asyncio
+from sqlalchemy import inspect
+from database import Base, create_db_engine
+from migrations import MIGRATIONS, run_migrations
+
+def _indexes(sync_conn, table):
+    return {index['name'] for index in inspect(sync_conn).get_indexes(table)}
+
+def test_indexes_added_to_existing_tables(tmp_path):
+    async def scenario():
+        engine = create_db_engine(f"sqlite:///{tmp_path / 'old.db'}")
+        # مخطط قديم: الجداول موجودة بدون الفهارس الجديدة
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    await conn.run_sync(index.drop)
+
+        first = await run_migrations(engine)
+        second = await run_migrations(engine)
+        async with engine.connect() as conn:
+            transfers = await conn.run_sync(_indexes, 'points_transfers')
+            requests = await conn.run_sync(_indexes, 'funding_requests')
+            users = await conn.run_sync(_indexes, 'users')
+        await engine.dispose()
+        return first, second, transfers, requests, users
+
+    first, second, transfers, requests, users = asyncio.run(scenario())
+
+    assert first == [version for version, _, _ in MIGRATIONS]
+    assert second == []
+    assert {'ix_points_transfers_from_date', 'ix_points_transfers_to_date'} <= transfers
+    assert 'ix_funding_requests_status_created' in requests
+    assert 'ix_users_username' in users
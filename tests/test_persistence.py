@@ -0,0 +1,84 @@
+import asyncio
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database import Base, PersistentState, create_db_engine
+from persistence import DatabasePersistence
+from write_queue import WriteQueue
+
+async def _setup():
+    engine = create_db_engine('sqlite:///:memory:')
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+    queue = WriteQueue(session_factory=sessions, delay=0)
+    return engine, sessions, queue
+
+async def _rows(sessions):
+    async with sessions() as db:
+        return {(row.owner, row.key): row.value for row in (await db.scalars(select(PersistentState))).all()}
+
+def test_funding_flow_survives_restart_and_only_dirty_keys_are_written():
+    async def scenario():
+        engine, sessions, queue = await _setup()
+        first = DatabasePersistence(session_factory=sessions, queue=queue)
+        assert await first.get_user_data() == {}
+
+        await first.update_user_data(1, {'funding_type': 'channel', 'requested_members': 100})
+        await first.update_user_data(2, {'awaiting_broadcast': {'points': True}})
+        # لا تغيير: لا كتابة
+        await first.update_user_data(1, {'funding_type': 'channel', 'requested_members': 100})
+        writes_after_noop = first.writes
+
+        # علامة في صف لم يتغير: لا يُعاد كتابته عند تغيير مفتاح آخر
+        async with sessions() as db:
+            await db.execute(update(PersistentState).filter_by(owner='1', key='funding_type').values(value='"marker"'))
+            await db.commit()
+        await first.update_user_data(1, {'funding_type': 'channel', 'requested_members': 100, 'points_needed': 500})
+        rows = await _rows(sessions)
+
+        # نهاية التدفق: حذف المفاتيح، ومستخدم محذوف بالكامل
+        await first.update_user_data(1, {'funding_type': 'channel'})
+        await first.drop_user_data(2)
+
+        restarted = DatabasePersistence(session_factory=sessions, queue=queue)
+        restored = await restarted.get_user_data()
+        await queue.close()
+        await engine.dispose()
+        return writes_after_noop, rows, restored
+
+    writes_after_noop, rows, restored = asyncio.run(scenario())
+
+    assert writes_after_noop == 2
+    assert rows[('1', 'funding_type')] == '"marker"'
+    assert rows[('1', 'points_needed')] == '500'
+    assert rows[('2', 'awaiting_broadcast')] == '{"points":true}'
+    # المفتاح الذي لم يتغير محلياً لم يُكتب أبداً بعد أول حفظ (فبقيت العلامة)
+    assert restored == {1: {'funding_type': 'marker'}}
+
+def test_shared_refresh_merges_other_process_changes_with_local_edits():
+    async def scenario():
+        engine, sessions, queue = await _setup()
+        local = DatabasePersistence(session_factory=sessions, queue=queue, shared=True)
+        other = DatabasePersistence(session_factory=sessions, queue=queue, shared=True)
+        await local.get_user_data()
+        await other.get_user_data()
+
+        await local.update_user_data(1, {'funding_type': 'channel', 'step': 1})
+        await other.refresh_user_data(1, other_data := {})
+        # العملية الأخرى تكمل الخطوة وتحذف funding_type
+        other_data['step'] = 2
+        other_data['requested_members'] = 50
+        del other_data['funding_type']
+        await other.update_user_data(1, other_data)
+
+        # تعديل محلي لم يُحفظ بعد يبقى، والباقي يأتي من قاعدة البيانات
+        user_data = {'funding_type': 'channel', 'step': 1, 'note': 'unsaved'}
+        await local.refresh_user_data(1, user_data)
+        await queue.close()
+        await engine.dispose()
+        return other_data, user_data
+
+    other_data, user_data = asyncio.run(scenario())
+
+    assert other_data == {'step': 2, 'requested_members': 50}
+    assert user_data == {'step': 2, 'requested_members': 50, 'note': 'unsaved'}
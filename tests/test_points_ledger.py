@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import event, select, func, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database import Base, User, PointsLedger, create_db_engine
+from points_service import credit, debit, transfer_points
+from points_ledger import ledger_balance, user_history, take_snapshot, compact
+
+def _run(scenario):
+    async def wrapper():
+        engine = create_db_engine('sqlite:///:memory:')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with sessions() as db:
+            db.add_all([User(user_id=1), User(user_id=2)])
+            await db.commit()
+        statements = []
+        event.listen(
+            engine.sync_engine, 'before_cursor_execute',
+            lambda conn, cursor, statement, *args: statements.append(statement),
+        )
+        try:
+            return await scenario(sessions, statements)
+        finally:
+            await engine.dispose()
+    return asyncio.run(wrapper())
+
+async def _ledger_rows(sessions):
+    async with sessions() as db:
+        return await db.scalar(select(func.count()).select_from(PointsLedger))
+
+def test_entries_are_written_in_one_batch_at_commit():
+    async def scenario(sessions, statements):
+        def ledger_inserts():
+            return [s for s in statements if s.startswith('INSERT INTO') and 'points_ledger' in s]
+        async with sessions() as db:
+            await credit(db, 1, 100, 'admin_grant')
+            await transfer_points(db, 1, 2, 40, 2)
+            before_commit = len(ledger_inserts())
+            await db.commit()
+        inserts = ledger_inserts()
+        async with sessions() as db:
+            history = [(e.reason, e.delta, e.balance_after) for e in await user_history(db, 1)]
+        return before_commit, inserts, history
+
+    before_commit, inserts, history = _run(scenario)
+
+    assert before_commit == 0
+    assert len(inserts) == 1
+    assert history == [('transfer_out', -42, 58), ('admin_grant', 100, 100)]
+
+def test_rolled_back_changes_are_not_recorded():
+    async def scenario(sessions, statements):
+        async with sessions() as db:
+            await credit(db, 1, 10, 'admin_grant')
+            await db.rollback()
+            # الخصم الفاشل لا يُسجل
+            assert await debit(db, 1, 5, 'funding') is None
+            await db.commit()
+        return await _ledger_rows(sessions)
+
+    assert _run(scenario) == 0
+
+def test_snapshot_and_compaction_keep_balances():
+    async def scenario(sessions, statements):
+        async with sessions() as db:
+            await credit(db, 1, 30, 'admin_grant')
+            await credit(db, 2, 5, 'admin_grant')
+            await db.commit()
+        async with sessions() as db:
+            first = await take_snapshot(db)
+            await debit(db, 1, 10, 'funding')
+            await db.commit()
+        async with sessions() as db:
+            second = await take_snapshot(db)
+            again = await take_snapshot(db)
+            # كل الحركات قديمة بما يكفي للحذف
+            await db.execute(update(PointsLedger).values(created_at=datetime.now() - timedelta(days=365)))
+            removed = await compact(db, retention_days=90)
+            await db.commit()
+        async with sessions() as db:
+            balances = (await ledger_balance(db, 1), await ledger_balance(db, 2))
+            points = (await db.scalars(select(User.points).order_by(User.user_id))).all()
+        return first, second, again, removed, balances, points
+
+    first, second, again, removed, balances, points = _run(scenario)
+
+    assert (first, second, again) == (2, 1, 0)
+    assert removed == 3
+    assert balances == tuple(points) == (20, 5)
+
+def test_entries_after_compacting_everything_are_not_skipped():
+    async def scenario(sessions, statements):
+        async with sessions() as db:
+            await credit(db, 1, 30, 'admin_grant')
+            await credit(db, 2, 5, 'admin_grant')
+            await db.commit()
+        async with sessions() as db:
+            await take_snapshot(db)
+            await db.execute(update(PointsLedger).values(created_at=datetime.now() - timedelta(days=365)))
+            removed = await compact(db, retention_days=90)
+            await db.commit()
+        # السجل فارغ الآن؛ الحركة التالية يجب أن تقع بعد حد اللقطة
+        async with sessions() as db:
+            await credit(db, 1, 7, 'daily_gift')
+            await db.commit()
+        async with sessions() as db:
+            ids = (await db.scalars(select(PointsLedger.id))).all()
+            before = await ledger_balance(db, 1)
+            updated = await take_snapshot(db)
+            await db.commit()
+        async with sessions() as db:
+            after = await ledger_balance(db, 1)
+            points = await db.scalar(select(User.points).filter_by(user_id=1))
+        return removed, ids, before, updated, after, points
+
+    removed, ids, before, updated, after, points = _run(scenario)
+
+    assert removed == 2
+    assert ids == [3]
+    assert updated == 1
+    assert before == after == points == 37
@@ -0,0 +1,76 @@
+import asyncio
+from datetime import datetime, timedelta
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database import Base, User, FundingRequest, create_db_engine
+from points_service import debit, claim_daily_gift, transfer_points, reject_and_refund
+
+def _run(scenario, path):
+    async def wrapper():
+        engine = create_db_engine(f"sqlite:///{path}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with sessions() as db:
+            db.add_all([User(user_id=1, points=100), User(user_id=2, points=0)])
+            await db.commit()
+        try:
+            return await scenario(sessions)
+        finally:
+            await engine.dispose()
+    return asyncio.run(wrapper())
+
+async def _points(sessions, user_id):
+    async with sessions() as db:
+        return (await db.get(User, user_id)).points
+
+def test_concurrent_debits_never_overspend(tmp_path):
+    async def scenario(sessions):
+        async def spend():
+            async with sessions() as db:
+                balance = await debit(db, 1, 60, 'funding')
+                await db.commit()
+                return balance
+        results = await asyncio.gather(spend(), spend())
+        return results, await _points(sessions, 1)
+
+    results, points = _run(scenario, tmp_path / "bot.db")
+
+    assert sorted(results, key=lambda r: r is None) == [40, None]
+    assert points == 40
+
+def test_daily_gift_is_claimed_once_per_day(tmp_path):
+    async def scenario(sessions):
+        now = datetime(2024, 1, 2, 12, 0)
+        async with sessions() as db:
+            first = await claim_daily_gift(db, 1, 3, now)
+            second = await claim_daily_gift(db, 1, 3, now)
+            next_day = await claim_daily_gift(db, 1, 3, now + timedelta(days=1))
+            await db.commit()
+        return first, second, next_day
+
+    assert _run(scenario, tmp_path / "bot.db") == (103, None, 106)
+
+def test_transfer_with_insufficient_points_changes_nothing(tmp_path):
+    async def scenario(sessions):
+        async with sessions() as db:
+            failed = await transfer_points(db, 1, 2, 100, 5)
+            done = await transfer_points(db, 1, 2, 50, 5)
+            await db.commit()
+        return failed, done, await _points(sessions, 1), await _points(sessions, 2)
+
+    assert _run(scenario, tmp_path / "bot.db") == (None, (45, 50), 45, 50)
+
+def test_rejecting_twice_refunds_once(tmp_path):
+    async def scenario(sessions):
+        async with sessions() as db:
+            db.add(FundingRequest(id=7, user_id=2, target_channel="@c", target_type="channel",
+                                  requested_members=10, points_cost=20, status='pending'))
+            await db.commit()
+        results = []
+        for _ in range(2):
+            async with sessions() as db:
+                results.append(await reject_and_refund(db, 7, 1))
+                await db.commit()
+        return results, await _points(sessions, 2)
+
+    assert _run(scenario, tmp_path / "bot.db") == ([True, False], 20)
@@ -0,0 +1,75 @@
+import asyncio
+import time
+from telegram.error import RetryAfter
+from rate_limiter import PriorityRateLimiter, INTERACTIVE, ADMIN, BACKGROUND
+
+def test_interactive_requests_overtake_queued_background_work():
+    async def scenario():
+        limiter = PriorityRateLimiter(overall_rate=20, max_retries=0)
+        # إفراغ الدلو العام حتى ينتظر الجميع في الطابور
+        limiter._overall.tokens = 0
+        order = []
+
+        def call(name, priority):
+            async def callback():
+                order.append(name)
+                return name
+            return limiter.process_request(callback, (), {}, 'getChat', {}, {'priority': priority})
+
+        background = [asyncio.create_task(call(f"bg{i}", BACKGROUND)) for i in range(3)]
+        await asyncio.sleep(0)
+        urgent = [asyncio.create_task(call("admin", ADMIN)), asyncio.create_task(call("reply", INTERACTIVE))]
+        await asyncio.gather(*background, *urgent)
+        stats = limiter.stats()
+        await limiter.shutdown()
+        return order, stats
+
+    order, stats = asyncio.run(scenario())
+
+    assert order == ["reply", "admin", "bg0", "bg1", "bg2"]
+    assert stats['background']['requests'] == 3
+    assert stats['background']['wait_max'] > stats['interactive']['wait_max'] > 0
+    assert all(stats[name]['queued'] == 0 for name in ('interactive', 'admin', 'background'))
+
+def test_retry_after_pauses_and_retries():
+    async def scenario():
+        limiter = PriorityRateLimiter(max_retries=2)
+        attempts = []
+
+        async def callback():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(0.05)
+            return True
+
+        result = await limiter.process_request(callback, (), {}, 'sendMessage', {'chat_id': 1}, None)
+        stats = limiter.stats()
+        await limiter.shutdown()
+        return result, attempts, stats
+
+    result, attempts, stats = asyncio.run(scenario())
+
+    assert result is True
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.04
+    assert stats['retries'] == 1
+
+def test_messages_to_one_chat_are_spaced():
+    async def scenario():
+        limiter = PriorityRateLimiter(chat_rate=20)
+        limiter._chat_bucket(5).tokens = 1
+        sent = []
+
+        async def callback():
+            sent.append(time.monotonic())
+
+        await asyncio.gather(*[
+            limiter.process_request(callback, (), {}, 'sendMessage', {'chat_id': 5}, None) for _ in range(3)
+        ])
+        await limiter.shutdown()
+        return sent
+
+    sent = asyncio.run(scenario())
+
+    # رسالة فورية ثم واحدة كل 1/20 ثانية
+    assert sent[2] - sent[0] >= 0.09
@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+from sqlalchemy import select, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database import Base, User, SystemStats, READ_ONLY_KEY, create_db_engine, create_read_engine
+from stats_counters import read_stats
+from user_cache import user_cache
+
+def test_memory_database_keeps_the_main_engine():
+    assert create_read_engine('sqlite:///:memory:', replica_url='') is None
+
+def test_read_engine_sees_commits_and_refuses_writes(tmp_path):
+    url = f"sqlite:///{tmp_path / 'bot.db'}"
+
+    async def scenario():
+        engine = create_db_engine(url, attached={})
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        reader = create_read_engine(url, replica_url='', attached={})
+        writes = async_sessionmaker(bind=engine, expire_on_commit=False)
+        reads = async_sessionmaker(bind=reader, expire_on_commit=False, info={READ_ONLY_KEY: True})
+        try:
+            async with writes() as db:
+                db.add_all([User(user_id=1, first_name="a", points=5), User(user_id=2, first_name="b")])
+                await db.commit()
+
+            user_cache.clear()
+            async with reads() as db:
+                users = await db.scalar(select(func.count()).select_from(User))
+                # لا يوجد صف عدادات بعد: يُحسب بدون إنشائه
+                stats = await read_stats(db)
+                names = await user_cache.get_many(db, [1, 2])
+                with pytest.raises(OperationalError):
+                    db.add(User(user_id=3))
+                    await db.flush()
+            async with writes() as db:
+                stats_rows = await db.scalar(select(func.count()).select_from(SystemStats))
+            return users, stats, names, stats_rows
+        finally:
+            await reader.dispose()
+            await engine.dispose()
+
+    users, stats, names, stats_rows = asyncio.run(scenario())
+
+    assert users == 2
+    assert (stats.users, stats.points) == (2, 5)
+    assert stats_rows == 0
+    assert names[1].first_name == "a"
+    # ما قُرئ من مجمع القراءة لا يدخل الذاكرة المشتركة
+    assert len(user_cache) == 0
@@ -0,0 +1,62 @@
+import asyncio
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database import Base, SystemSettings, PointsSettings, create_db_engine
+from settings_cache import SettingsCache
+
+async def _setup():
+    engine = create_db_engine('sqlite:///:memory:')
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+    async with sessions() as db:
+        db.add_all([SystemSettings(), PointsSettings()])
+        await db.commit()
+    return engine, sessions
+
+def test_write_through_applies_only_after_commit():
+    async def scenario():
+        engine, sessions = await _setup()
+        cache = SettingsCache()
+        async with sessions() as db:
+            await cache.system(db)
+            await cache.update_system(db, 1, maintenance_mode=True)
+            before_commit = (await cache.system(db)).maintenance_mode
+            await db.commit()
+        after_commit = (await cache.system(None)).maintenance_mode
+
+        async with sessions() as db:
+            await cache.update_system(db, 1, transfer_fee_percent=40)
+            await db.rollback()
+        after_rollback = (await cache.system(None)).transfer_fee_percent
+        version = cache.version
+        await engine.dispose()
+        return before_commit, after_commit, after_rollback, version
+
+    before_commit, after_commit, after_rollback, version = asyncio.run(scenario())
+
+    assert before_commit is False
+    assert after_commit is True
+    assert after_rollback == 5
+    assert version == 1
+
+def test_other_process_change_is_detected():
+    async def scenario():
+        engine, sessions = await _setup()
+        cache = SettingsCache()
+        async with sessions() as db:
+            await cache.system(db)
+            fresh = await cache.refresh_if_stale(db)
+            # عملية أخرى تعدل الصف مباشرة
+            await db.execute(update(SystemSettings).values(transfer_enabled=False, version=SystemSettings.version + 1))
+            await db.commit()
+            stale = await cache.refresh_if_stale(db)
+        enabled = (await cache.system(None)).transfer_enabled
+        await engine.dispose()
+        return fresh, stale, enabled
+
+    fresh, stale, enabled = asyncio.run(scenario())
+
+    assert fresh is False
+    assert stale is True
+    assert enabled is False
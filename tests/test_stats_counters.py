@@ -0,0 +1,126 @@
+import asyncio
+from sqlalchemy import event, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database import Base, User, FundingRequest, PointsTransfer, SystemStats, create_db_engine
+from points_service import credit, debit, reject_and_refund
+from stats_counters import COUNTERS, read_stats, count_all, reconcile, flush_stats
+
+def _run(scenario):
+    async def wrapper():
+        engine = create_db_engine('sqlite:///:memory:')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with sessions() as db:
+            await reconcile(db)
+            await db.commit()
+        try:
+            return await scenario(sessions)
+        finally:
+            await engine.dispose()
+    return asyncio.run(wrapper())
+
+async def _compare(sessions):
+    async with sessions() as db:
+        stats = await read_stats(db)
+        return {name: getattr(stats, name) for name in COUNTERS}, await count_all(db)
+
+def _request(**kwargs):
+    return FundingRequest(user_id=1, target_channel="@c", target_type="channel",
+                          requested_members=1, points_cost=25, **kwargs)
+
+def test_counters_follow_every_code_path():
+    async def scenario(sessions):
+        async with sessions() as db:
+            db.add_all([User(user_id=1), User(user_id=2, is_admin=True)])
+            await db.flush()
+            await credit(db, 1, 100, 'admin_grant')
+            await debit(db, 1, 50, 'funding')
+            db.add_all([_request(id=1), _request(id=2), _request(id=3)])
+            db.add(PointsTransfer(from_user_id=1, to_user_id=2, amount=1, fee_percent=0, fee_amount=0, net_amount=1))
+            await db.commit()
+        async with sessions() as db:
+            user = await db.get(User, 1)
+            user.is_banned = True
+            (await db.get(FundingRequest, 1)).status = 'approved'
+            await db.flush()
+            (await db.get(FundingRequest, 1)).status = 'completed'
+            await reject_and_refund(db, 2, 2)
+            await db.commit()
+        return await _compare(sessions)
+
+    stats, counts = _run(scenario)
+
+    assert stats == counts
+    assert stats['requests_pending'] == 1
+    assert stats['requests_completed'] == 1
+    assert stats['points'] == 75
+
+def test_rolled_back_changes_do_not_move_counters():
+    async def scenario(sessions):
+        async with sessions() as db:
+            db.add(User(user_id=1))
+            await db.flush()
+            await credit(db, 1, 10, 'admin_grant')
+            await db.rollback()
+        return await _compare(sessions)
+
+    stats, counts = _run(scenario)
+
+    assert stats == counts
+    assert stats['users'] == 0
+
+def test_reconcile_corrects_drift():
+    async def scenario(sessions):
+        async with sessions() as db:
+            db.add(User(user_id=1))
+            await db.commit()
+        await flush_stats(sessions)
+        async with sessions() as db:
+            await db.execute(update(SystemStats).values(users=100))
+            await db.commit()
+        async with sessions() as db:
+            drift = await reconcile(db)
+            await db.commit()
+        return drift, await _compare(sessions)
+
+    drift, (stats, counts) = _run(scenario)
+
+    assert drift == {'users': -99}
+    assert stats == counts
+
+def test_commits_do_not_write_the_counter_row_until_flushed():
+    async def scenario(sessions):
+        statements = []
+        async with sessions() as db:
+            bind = db.get_bind()
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(bind, 'before_cursor_execute', listener)
+        async with sessions() as db:
+            db.add_all([User(user_id=1), User(user_id=2)])
+            await db.flush()
+            await credit(db, 1, 40, 'admin_grant')
+            await db.commit()
+        # معاملة بلا تغيير في العدادات
+        async with sessions() as db:
+            (await db.get(User, 2)).first_name = "b"
+            await db.commit()
+        writes_before_flush = sum('system_stats' in statement for statement in statements)
+        before = await _compare(sessions)
+        flushed = await flush_stats(sessions)
+        again = await flush_stats(sessions)
+        event.remove(bind, 'before_cursor_execute', listener)
+        async with sessions() as db:
+            row = await db.get(SystemStats, 1)
+            stored = (row.users, row.points)
+        return writes_before_flush, before, flushed, again, stored, await _compare(sessions)
+
+    writes_before_flush, (stats, counts), flushed, again, stored, after = _run(scenario)
+
+    # القراءة تشمل ما لم يُكتب بعد
+    assert stats == counts
+    assert writes_before_flush == 0
+    assert flushed == {'users': 2, 'points': 40}
+    assert again == {}
+    assert stored == (2, 40)
+    assert after[0] == after[1]
@@ -0,0 +1,177 @@
+import asyncio
+from types import SimpleNamespace
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from telegram.error import BadRequest
+from config import Config
+from database import Base, Channel, ChannelMembership, SystemSettings, User, create_db_engine
+from settings_cache import settings_cache
+from subscriptions import mandatory_channels, membership_cache, missing_channels, record_membership
+from user_cache import user_cache
+from write_queue import WriteQueue
+import bot_handlers, subscriptions
+
+class FakeBot:
+    """يحصي طلبات get_chat_member وأقصى عدد منها في نفس الوقت"""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            status = self.statuses[chat_id]
+            if status is None:
+                raise BadRequest("Chat not found")
+            return SimpleNamespace(status=status)
+        finally:
+            self.in_flight -= 1
+
+def _use_queue(monkeypatch, sessions) -> WriteQueue:
+    """طابور كتابة على قاعدة الاختبار بدلاً من الطابور العام"""
+    queue = WriteQueue(session_factory=sessions, delay=0)
+    monkeypatch.setattr(subscriptions, 'write_queue', queue)
+    monkeypatch.setattr(bot_handlers, 'write_queue', queue)
+    return queue
+
+def test_checks_run_together_and_positive_results_are_cached(monkeypatch):
+    statuses = {'@a': 'member', '@b': 'administrator', '@c': 'left', '@d': None, '@e': 'member'}
+
+    async def scenario():
+        engine = create_db_engine('sqlite:///:memory:')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        queue = _use_queue(monkeypatch, sessions)
+        mandatory_channels.invalidate()
+        membership_cache.clear()
+        bot = FakeBot(statuses)
+        async with sessions() as db:
+            db.add_all([Channel(channel_id=channel_id, is_mandatory=True) for channel_id in statuses])
+            db.add(Channel(channel_id='@optional'))
+            await db.commit()
+
+            first = [channel.channel_id for channel in await missing_channels(bot, db, 7)]
+            after_first = (bot.calls, bot.max_in_flight)
+            second = [channel.channel_id for channel in await missing_channels(bot, db, 7)]
+            after_second = bot.calls
+
+            # إضافة قناة إجبارية تمسح القائمة بعد الحفظ
+            db.add(Channel(channel_id='@f', is_mandatory=True))
+            statuses['@f'] = 'left'
+            await db.commit()
+            third = [channel.channel_id for channel in await missing_channels(bot, db, 7)]
+        await queue.close()
+        await engine.dispose()
+        return first, after_first, second, after_second, third
+
+    first, after_first, second, after_second, third = asyncio.run(scenario())
+
+    assert first == ['@c']
+    assert after_first == (5, 5)
+    assert second == ['@c']
+    # فقط القناة غير المشترك فيها والقناة التي تعذر فحصها تُفحصان مجدداً
+    assert after_second == 7
+    assert third == ['@c', '@f']
+
+def _change(chat_id, username, user_id, status):
+    return SimpleNamespace(
+        chat=SimpleNamespace(id=chat_id, username=username),
+        new_chat_member=SimpleNamespace(status=status, user=SimpleNamespace(id=user_id)),
+    )
+
+def test_chat_member_updates_answer_checks_without_the_api(monkeypatch):
+    async def scenario():
+        engine = create_db_engine('sqlite:///:memory:')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        queue = _use_queue(monkeypatch, sessions)
+        mandatory_channels.invalidate()
+        membership_cache.clear()
+        bot = FakeBot({'@News': 'left', '-100123': 'left'})
+        async with sessions() as db:
+            db.add_all([Channel(channel_id='@News', is_mandatory=True), Channel(channel_id='-100123', is_mandatory=True)])
+            await db.commit()
+            recorded = [
+                await record_membership(db, _change(-100999, 'news', 7, 'member')),
+                await record_membership(db, _change(-100123, None, 7, 'administrator')),
+                await record_membership(db, _change(-100555, 'other', 7, 'member')),
+            ]
+            await db.commit()
+
+        # عملية جديدة: الذاكرة فارغة والسجل المحلي يجيب
+        membership_cache.clear()
+        async with sessions() as db:
+            joined = await missing_channels(bot, db, 7)
+            calls_after_join = bot.calls
+            await record_membership(db, _change(-100999, 'news', 7, 'left'))
+            await db.commit()
+            left = [channel.channel_id for channel in await missing_channels(bot, db, 7)]
+        await queue.close()
+        await engine.dispose()
+        return recorded, joined, calls_after_join, left, bot.calls
+
+    recorded, joined, calls_after_join, left, calls = asyncio.run(scenario())
+
+    assert recorded == [True, True, False]
+    assert joined == []
+    assert calls_after_join == 0
+    # المغادرة تمسح الذاكرة فيُسأل Telegram عن تلك القناة فقط
+    assert left == ['@News']
+    assert calls == 1
+
+class FakeMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+def test_start_registers_new_user_on_file_database(tmp_path, monkeypatch):
+    # مهلة قصيرة حتى يظهر انتظار قفل الكتابة فشلاً سريعاً بدلاً من 5 ثوانٍ
+    monkeypatch.setattr(Config, 'SQLITE_BUSY_TIMEOUT_MS', 300)
+
+    async def scenario():
+        engine = create_db_engine(f"sqlite:///{tmp_path / 'bot.db'}", attached={})
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        queue = _use_queue(monkeypatch, sessions)
+        mandatory_channels.invalidate()
+        membership_cache.clear()
+        user_cache.clear()
+        async with sessions() as db:
+            db.add_all([Channel(channel_id='@news', channel_username='@news', is_mandatory=True), SystemSettings()])
+            await db.commit()
+            await settings_cache.load(db)
+
+        message = FakeMessage()
+        update = SimpleNamespace(
+            effective_user=SimpleNamespace(id=7, username='u', first_name='a', last_name=''),
+            message=message,
+            callback_query=None,
+        )
+        # جلسة التحديث كما تفتحها وحدة العمل، وتُحفظ بعد انتهاء المعالج
+        async with sessions() as db:
+            await bot_handlers.start_command(update, SimpleNamespace(bot=FakeBot({'@news': 'member'}), db=db, args=[]))
+            await db.commit()
+        await queue.close()
+
+        async with sessions() as db:
+            users = (await db.scalars(select(User.user_id))).all()
+            statuses = (await db.scalars(select(ChannelMembership.status))).all()
+        await engine.dispose()
+        return users, statuses, message.replies
+
+    users, statuses, replies = asyncio.run(scenario())
+
+    assert users == [7]
+    assert statuses == ['member']
+    assert len(replies) == 1
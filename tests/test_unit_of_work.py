@@ -0,0 +1,203 @@
+import asyncio
+from sqlalchemy import event, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from telegram.error import BadRequest
+from telegram.ext import Application, ContextTypes, ExtBot, TypeHandler
+import unit_of_work
+from config import Config
+from database import Base, User, create_db_engine
+from unit_of_work import BotApplication, BotContext, UnitOfWorkBot
+
+class CountingSessions:
+    """مصنع جلسات يحصي الجلسات وعمليات commit واستعارة الاتصالات"""
+
+    def __init__(self, engine):
+        self.maker = async_sessionmaker(bind=engine, expire_on_commit=False)
+        self.sessions = []
+        self.commits = 0
+        self.checkouts = 0
+        event.listen(engine.sync_engine, 'checkout', self._on_checkout)
+
+    def _on_checkout(self, *args):
+        self.checkouts += 1
+
+    def __call__(self):
+        session = self.maker()
+        commit = session.commit
+
+        async def counting_commit():
+            self.commits += 1
+            await commit()
+
+        session.commit = counting_commit
+        self.sessions.append(session)
+        return session
+
+def run_update(monkeypatch, handlers, error_handler=None):
+    """تشغيل تحديث واحد عبر BotApplication وإرجاع العداد وحالة المستخدمين بعده"""
+    async def scenario():
+        engine = create_db_engine('sqlite:///:memory:')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        setup = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with setup() as db:
+            db.add(User(user_id=1, first_name="a", points=10))
+            await db.commit()
+
+        sessions = CountingSessions(engine)
+        monkeypatch.setattr(unit_of_work, 'SessionLocal', sessions)
+
+        application = (
+            Application.builder()
+            .token("123:TEST")
+            .application_class(BotApplication)
+            .context_types(ContextTypes(context=BotContext))
+            .build()
+        )
+        for group, handler in enumerate(handlers):
+            application.add_handler(TypeHandler(object, handler), group=group)
+        if error_handler:
+            application.add_error_handler(error_handler)
+        # تجنب initialize() لأنها تتصل بخوادم Telegram
+        application._initialized = True
+
+        await application.process_update(object())
+        event.remove(engine.sync_engine, 'checkout', sessions._on_checkout)
+
+        async with setup() as db:
+            points = await db.scalar(select(User.points).filter_by(user_id=1))
+            users = len((await db.scalars(select(User))).all())
+        await engine.dispose()
+        return sessions, points, users
+
+    return asyncio.run(scenario())
+
+def test_one_session_and_one_commit_per_update(monkeypatch):
+    seen = []
+
+    async def first(update, context):
+        user = await context.db.scalar(select(User).filter_by(user_id=1))
+        user.points += 5
+        seen.append(context.db)
+
+    async def second(update, context):
+        user = await context.db.scalar(select(User).filter_by(user_id=1))
+        user.points += 1
+        seen.append(context.db)
+
+    sessions, points, _ = run_update(monkeypatch, [first, second])
+
+    assert len(sessions.sessions) == 1
+    assert seen[0] is seen[1]
+    assert sessions.commits == 1
+    assert sessions.checkouts == 1
+    assert points == 16
+
+def test_update_without_database_access_opens_no_session(monkeypatch):
+    async def handler(update, context):
+        pass
+
+    sessions, _, _ = run_update(monkeypatch, [handler])
+
+    assert sessions.sessions == []
+    assert sessions.checkouts == 0
+
+def test_failing_handler_rolls_back(monkeypatch):
+    errors = []
+
+    async def handler(update, context):
+        user = await context.db.scalar(select(User).filter_by(user_id=1))
+        user.points -= 10
+        await context.db.flush()
+        raise ValueError("boom")
+
+    async def on_error(update, context):
+        errors.append(context.error)
+
+    _, points, _ = run_update(monkeypatch, [handler], on_error)
+
+    assert points == 10
+    assert isinstance(errors[0], ValueError)
+
+def test_telegram_error_after_writes_keeps_changes(monkeypatch):
+    async def handler(update, context):
+        user = await context.db.scalar(select(User).filter_by(user_id=1))
+        user.points += 3
+        raise BadRequest("Query is too old")
+
+    _, points, _ = run_update(monkeypatch, [handler], lambda update, context: asyncio.sleep(0))
+
+    assert points == 13
+
+def test_commit_failure_is_reported_not_raised(monkeypatch):
+    errors = []
+
+    async def handler(update, context):
+        # user_id مكرر: يفشل فقط عند الحفظ النهائي
+        context.db.add(User(user_id=1, first_name="dup"))
+
+    async def on_error(update, context):
+        errors.append(context.error)
+
+    sessions, points, users = run_update(monkeypatch, [handler], on_error)
+
+    assert sessions.commits == 1
+    assert len(errors) == 1
+    assert users == 1
+    assert points == 10
+
+def test_writes_are_committed_before_bot_api_calls(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'SQLITE_BUSY_TIMEOUT_MS', 200)
+    probes = []
+
+    async def scenario():
+        engine = create_db_engine(f"sqlite:///{tmp_path / 'bot.db'}", attached={})
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with sessions() as db:
+            db.add(User(user_id=1, first_name="a", points=10))
+            await db.commit()
+        monkeypatch.setattr(unit_of_work, 'SessionLocal', sessions)
+
+        async def fake_post(self, endpoint, data, **kwargs):
+            # كاتب آخر (مثل طابور الكتابة) يحصل على القفل أثناء انتظار Telegram
+            async with engine.connect() as conn:
+                try:
+                    await conn.execute(text("BEGIN IMMEDIATE"))
+                    probes.append((endpoint, 'free'))
+                except Exception:
+                    probes.append((endpoint, 'locked'))
+                await conn.rollback()
+            return {'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'}}
+
+        monkeypatch.setattr(ExtBot, '_do_post', fake_post)
+
+        async def handler(update, context):
+            user = await context.db.scalar(select(User).filter_by(user_id=1))
+            user.points += 5
+            await context.db.flush()
+            # طلبان معاً كما في إشعار المشرفين: حفظ واحد
+            await asyncio.gather(context.bot.send_message(1, "a"), context.bot.send_message(2, "b"))
+            user.points += 1
+
+        application = (
+            Application.builder()
+            .bot(UnitOfWorkBot("123:TEST"))
+            .application_class(BotApplication)
+            .context_types(ContextTypes(context=BotContext))
+            .build()
+        )
+        application.add_handler(TypeHandler(object, handler))
+        application._initialized = True
+        await application.process_update(object())
+
+        async with sessions() as db:
+            points = await db.scalar(select(User.points).filter_by(user_id=1))
+        await engine.dispose()
+        return points
+
+    points = asyncio.run(scenario())
+
+    assert probes == [('sendMessage', 'free'), ('sendMessage', 'free')]
+    assert points == 16
@@ -0,0 +1,129 @@
+import asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from telegram import Update
+from telegram.ext import Application, ContextTypes, ExtBot, TypeHandler
+import unit_of_work
+from config import Config
+from database import Base, User, create_db_engine
+from unit_of_work import BotApplication, BotContext, UnitOfWorkBot
+from update_processor import PerUserUpdateProcessor
+
+def _update(update_id: int, user_id: int) -> Update:
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'u'},
+            'text': str(update_id),
+        },
+    }, None)
+
+def _run(concurrency, updates):
+    async def scenario():
+        processor = PerUserUpdateProcessor(concurrency=concurrency, max_pending=100)
+        events = []
+        state = {'active': 0, 'peak': 0}
+
+        async def handle(update):
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+            events.append(('start', update.update_id))
+            await asyncio.sleep(0.02)
+            events.append(('end', update.update_id))
+            state['active'] -= 1
+
+        async with processor:
+            # كما يفعل Application مع concurrent_updates: مهمة لكل تحديث بترتيب الوصول
+            await asyncio.gather(*[
+                asyncio.create_task(processor.process_update(update, handle(update))) for update in updates
+            ])
+            leftover = (len(processor._locks), processor.waiting, processor.active)
+        return events, state['peak'], leftover
+
+    return asyncio.run(scenario())
+
+def test_same_user_is_serialized_while_other_users_run():
+    # المستخدم 1 يرسل 1 ثم 2 ثم 3؛ المستخدم 2 يرسل 4
+    events, peak, leftover = _run(8, [_update(1, 1), _update(2, 1), _update(4, 2), _update(3, 1)])
+
+    user_one = [event for event in events if event[1] in (1, 2, 3)]
+    assert user_one == [('start', 1), ('end', 1), ('start', 2), ('end', 2), ('start', 3), ('end', 3)]
+    # المستخدم 2 لم ينتظر تحديثات المستخدم 1
+    assert events.index(('start', 4)) < events.index(('end', 1))
+    assert peak == 2
+    assert leftover == (0, 0, 0)
+
+def test_global_concurrency_is_bounded():
+    events, peak, leftover = _run(3, [_update(i, i) for i in range(1, 11)])
+
+    assert peak == 3
+    assert len(events) == 20
+    assert leftover == (0, 0, 0)
+
+def test_two_users_writing_at_once_both_commit_on_file_sqlite(tmp_path, monkeypatch):
+    # مهلة أقصر من انتظار Telegram: كاتب يحجز القفل أثناء الرد يُفشل الآخر
+    monkeypatch.setattr(Config, 'SQLITE_BUSY_TIMEOUT_MS', 200)
+    errors = []
+
+    async def scenario():
+        engine = create_db_engine(f"sqlite:///{tmp_path / 'bot.db'}", attached={})
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with sessions() as db:
+            db.add_all([User(user_id=1, points=0), User(user_id=2, points=0)])
+            await db.commit()
+        monkeypatch.setattr(unit_of_work, 'SessionLocal', sessions)
+
+        async def slow_post(self, endpoint, data, **kwargs):
+            await asyncio.sleep(0.3)
+            return {'message_id': 1, 'date': 0, 'chat': {'id': data['chat_id'], 'type': 'private'}}
+
+        monkeypatch.setattr(ExtBot, '_do_post', slow_post)
+        state = {'active': 0, 'peak': 0}
+
+        async def handler(update, context):
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+            user_id = update.effective_user.id
+            user = await context.db.scalar(select(User).filter_by(user_id=user_id))
+            user.points += 5
+            await context.db.flush()
+            await context.bot.send_message(user_id, "تم")
+            user.points += 1
+            state['active'] -= 1
+
+        async def on_error(update, context):
+            errors.append(context.error)
+
+        processor = PerUserUpdateProcessor(concurrency=4)
+        application = (
+            Application.builder()
+            .bot(UnitOfWorkBot("123:TEST"))
+            .application_class(BotApplication)
+            .context_types(ContextTypes(context=BotContext))
+            .concurrent_updates(processor)
+            .build()
+        )
+        application.add_handler(TypeHandler(Update, handler))
+        application.add_error_handler(on_error)
+        application._initialized = True
+        async with processor:
+            await asyncio.gather(*[
+                processor.process_update(update, application.process_update(update))
+                for update in (_update(1, 1), _update(2, 2))
+            ])
+
+        async with sessions() as db:
+            points = dict((await db.execute(select(User.user_id, User.points))).all())
+        await engine.dispose()
+        return points, state['peak']
+
+    points, peak = asyncio.run(scenario())
+
+    assert errors == []
+    assert peak == 2
+    assert points == {1: 6, 2: 6}
@@ -0,0 +1,68 @@
+import asyncio
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database import Base, User, create_db_engine
+from user_cache import UserCache
+
+def _run(scenario):
+    async def wrapper():
+        engine = create_db_engine('sqlite:///:memory:')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with sessions() as db:
+            db.add_all([User(user_id=i, first_name=f"u{i}", points=i) for i in (1, 2, 3)])
+            await db.commit()
+        try:
+            return await scenario(sessions)
+        finally:
+            await engine.dispose()
+    return asyncio.run(wrapper())
+
+def test_hits_misses_and_lru_eviction():
+    async def scenario(sessions):
+        cache = UserCache(maxsize=2, ttl=60)
+        async with sessions() as db:
+            await cache.get(db, 1)
+            await cache.get(db, 2)
+            await cache.get(db, 1)
+            await cache.get(db, 3)
+        return cache
+
+    cache = _run(scenario)
+
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert cache.peek(2) is None
+    assert cache.peek(1).points == 1
+    assert len(cache) == 2
+
+def test_expired_entries_are_reloaded():
+    async def scenario(sessions):
+        cache = UserCache(maxsize=10, ttl=0)
+        async with sessions() as db:
+            await cache.get(db, 1)
+            await cache.get(db, 1)
+        return cache
+
+    cache = _run(scenario)
+
+    assert cache.misses == 2
+
+def test_invalidation_after_commit_drops_values_read_mid_transaction():
+    async def scenario(sessions):
+        cache = UserCache()
+        async with sessions() as db:
+            user = await db.get(User, 1)
+            user.points = 50
+            cache.invalidate_on_commit(db, 1)
+            # قراءة داخل المعاملة تخزن قيمة غير محفوظة بعد
+            await cache.get(db, 1)
+            await db.rollback()
+        after_rollback = cache.peek(1)
+        async with sessions() as db:
+            reloaded = await cache.get(db, 1)
+        return after_rollback, reloaded
+
+    after_rollback, reloaded = _run(scenario)
+
+    assert after_rollback is None
+    assert reloaded.points == 1
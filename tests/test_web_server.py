@@ -0,0 +1,61 @@
+import asyncio
+from types import SimpleNamespace
+from aiohttp.test_utils import TestClient, TestServer
+from web_server import SECRET_HEADER, create_web_app
+
+UPDATE = {
+    'update_id': 7,
+    'message': {
+        'message_id': 1,
+        'date': 0,
+        'chat': {'id': 5, 'type': 'private'},
+        'from': {'id': 5, 'is_bot': False, 'first_name': 'Ali'},
+        'text': 'hi',
+    },
+}
+
+def _application(running=True):
+    return SimpleNamespace(bot=None, running=running, update_queue=asyncio.Queue())
+
+def test_webhook_validates_secret_and_queues_updates():
+    async def scenario():
+        application = _application()
+        client = TestClient(TestServer(create_web_app(application, 'secret', '/webhook')))
+        await client.start_server()
+        try:
+            missing = (await client.post('/webhook', json=UPDATE)).status
+            wrong = (await client.post('/webhook', json=UPDATE, headers={SECRET_HEADER: 'nope'})).status
+            invalid = (await client.post('/webhook', data=b'{', headers={SECRET_HEADER: 'secret'})).status
+            ok = (await client.post('/webhook', json=UPDATE, headers={SECRET_HEADER: 'secret'})).status
+        finally:
+            await client.close()
+        return (missing, wrong, invalid, ok), application.update_queue
+
+    statuses, queue = asyncio.run(scenario())
+
+    assert statuses == (403, 403, 400, 200)
+    assert queue.qsize() == 1
+    update = queue.get_nowait()
+    assert (update.update_id, update.message.text) == (7, 'hi')
+
+def test_health_route_without_webhook():
+    async def scenario():
+        application = _application(running=False)
+        client = TestClient(TestServer(create_web_app(application, 'secret')))
+        await client.start_server()
+        try:
+            starting = (await client.get('/')).status
+            application.running = True
+            alive = await client.get('/')
+            body = await alive.text()
+            # مسار webhook غير مسجل في وضع polling
+            webhook = (await client.post('/webhook', json=UPDATE, headers={SECRET_HEADER: 'secret'})).status
+        finally:
+            await client.close()
+        return starting, alive.status, body, webhook
+
+    starting, alive, body, webhook = asyncio.run(scenario())
+
+    assert (starting, alive) == (503, 200)
+    assert 'alive' in body
+    assert webhook == 404
@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from database import Base, User, PointsLedger, create_db_engine
+from points_service import claim_daily_gift, credit
+from bot_handlers import register_user
+from write_queue import WriteQueue
+
+def _run(scenario, path):
+    async def wrapper():
+        engine = create_db_engine(f"sqlite:///{path}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with sessions() as db:
+            db.add_all([User(user_id=i) for i in range(1, 21)])
+            await db.commit()
+        commits = []
+        queue = WriteQueue(session_factory=sessions, delay=0.01)
+        original = queue._commit_batch
+
+        async def counting(batch):
+            commits.append(len(batch))
+            await original(batch)
+        queue._commit_batch = counting
+        try:
+            return await scenario(sessions, queue), commits
+        finally:
+            await queue.close()
+            await engine.dispose()
+    return asyncio.run(wrapper())
+
+def test_concurrent_claims_share_one_commit(tmp_path):
+    async def scenario(sessions, queue):
+        now = datetime(2024, 1, 1, 12)
+        results = await asyncio.gather(*[queue.submit(claim_daily_gift, i, 3, now) for i in range(1, 21)])
+        again = await queue.submit(claim_daily_gift, 1, 3, now)
+        async with sessions() as db:
+            total = await db.scalar(select(func.sum(User.points)))
+        return results, again, total
+
+    (results, again, total), commits = _run(scenario, tmp_path / "bot.db")
+
+    assert results == [3] * 20
+    assert again is None
+    assert total == 60
+    assert commits == [20, 1]
+
+def test_failing_operation_only_rolls_back_itself(tmp_path):
+    async def failing(db):
+        await credit(db, 1, 500, 'admin_grant')
+        raise ValueError("boom")
+
+    async def scenario(sessions, queue):
+        results = await asyncio.gather(
+            queue.submit(credit, 2, 10, 'admin_grant'),
+            queue.submit(failing),
+            queue.submit(register_user, 99, "new", "New", "", 3, 5),
+            return_exceptions=True,
+        )
+        async with sessions() as db:
+            points = dict((await db.execute(select(User.user_id, User.points).where(User.user_id.in_((1, 2, 3))))).all())
+            new_user = await db.scalar(select(User).filter_by(user_id=99))
+            reasons = sorted((await db.scalars(select(PointsLedger.reason))).all())
+        return results, points, new_user, reasons
+
+    (results, points, new_user, reasons), commits = _run(scenario, tmp_path / "bot.db")
+
+    assert results[0] == 10
+    assert isinstance(results[1], ValueError)
+    assert results[2] is True
+    assert points == {1: 0, 2: 10, 3: 5}
+    assert new_user.referred_by == 3
+    # حركة السجل الخاصة بالعملية الفاشلة لا تُكتب
+    assert reasons == ['admin_grant', 'referral']
+    assert commits == [3]
+
+def test_commit_failure_reaches_every_caller(tmp_path, monkeypatch):
+    async def broken_commit(self):
+        raise RuntimeError("disk full")
+
+    async def scenario(sessions, queue):
+        monkeypatch.setattr(AsyncSession, 'commit', broken_commit)
+        return await asyncio.gather(
+            queue.submit(credit, 1, 1, 'admin_grant'),
+            queue.submit(credit, 2, 1, 'admin_grant'),
+            return_exceptions=True,
+        )
+
+    results, _ = _run(scenario, tmp_path / "bot.db")
+
+    assert [type(r) for r in results] == [RuntimeError, RuntimeError]
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from telegram.error import TelegramError
+from telegram.ext import Application, CallbackContext, ExtBot
+from database import SessionLocal, ReadSessionLocal
+from metrics import instrument_handler
+
+logger = logging.getLogger(__name__)
+
+# وحدة العمل الخاصة بالتحديث الذي يجري معالجته حالياً
+_current_unit: ContextVar = ContextVar('current_unit_of_work', default=None)
+
+# مفتاح session.info: كتبت المعاملة الحالية شيئاً (في SQLite تحمل قفل الكتابة منذ أول كتابة)
+WROTE_KEY = 'unit_of_work_wrote'
+
+class UnitOfWork:
+    """جلسة واحدة لكل تحديث: تفتح عند أول استعلام وتغلق بعد انتهاء كل المعالجات
+
+    جلسة القراءة (لشاشات التقارير) تفتح بنفس الطريقة على مجمع القراءة ولا تُحفظ أبداً.
+    قبل كل طلب Bot API تُحفظ كتابات التحديث حتى الآن (release)، فلا يبقى قفل كتابة SQLite
+    أو صفوف PostgreSQL محجوزة أثناء انتظار الشبكة بينما تعمل تحديثات أخرى بالتوازي.
+    ما كُتب قبل رد يخبر المستخدم بالنتيجة يُحفظ إذن حتى لو فشل المعالج بعد الرد.
+    """
+
+    def __init__(self):
+        self._session = None
+        self._read_session = None
+        self._release_lock = asyncio.Lock()
+
+    @property
+    def session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = SessionLocal()
+        return self._session
+
+    @property
+    def read_session(self) -> AsyncSession:
+        if self._read_session is None:
+            self._read_session = ReadSessionLocal()
+        return self._read_session
+
+    async def commit(self):
+        if self._session is not None:
+            await self._session.commit()
+
+    async def release(self):
+        """حفظ ما كتبه التحديث حتى الآن (لا شيء إذا لم يكتب)"""
+        # الطلبات المتوازية من نفس المعالج (asyncio.gather) تنتظر حفظاً واحداً
+        async with self._release_lock:
+            if self._session is not None and self._session.sync_session.info.get(WROTE_KEY):
+                await self._session.commit()
+
+    async def rollback(self):
+        if self._session is not None:
+            try:
+                await self._session.rollback()
+            except Exception as exc:
+                # الاتصال قد يكون معطلاً؛ الإغلاق لاحقاً يعيده للمجمع
+                logger.error(f"فشل التراجع عن جلسة التحديث: {exc}")
+
+    async def close(self):
+        try:
+            if self._read_session is not None:
+                await self._read_session.close()
+                self._read_session = None
+        finally:
+            if self._session is not None:
+                await self._session.close()
+                self._session = None
+
+def current_unit_of_work() -> UnitOfWork:
+    """وحدة العمل للتحديث الحالي"""
+    unit = _current_unit.get()
+    if unit is None:
+        raise RuntimeError("لا يوجد تحديث قيد المعالجة لربط الجلسة به")
+    return unit
+
+async def release_write_lock():
+    """إنهاء معاملة الكتابة للتحديث الحالي قبل انتظار طويل (لا شيء خارج التحديثات)"""
+    unit = _current_unit.get()
+    if unit is not None:
+        await unit.release()
+
+@event.listens_for(Session, 'after_flush')
+def _mark_flush(session, flush_context):
+    session.info[WROTE_KEY] = True
+
+@event.listens_for(Session, 'do_orm_execute')
+def _mark_statement(orm_execute_state):
+    # update()/delete()/insert() المباشرة لا تمر بـ flush
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        orm_execute_state.session.info[WROTE_KEY] = True
+
+@event.listens_for(Session, 'after_transaction_end')
+def _clear_mark(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(WROTE_KEY, None)
+
+class UnitOfWorkBot(ExtBot):
+    """بوت يحفظ كتابات التحديث الجاري قبل كل طلب Bot API (ومنها الانتظار في جدولة الطلبات)"""
+
+    async def _do_post(self, endpoint, data, **kwargs):
+        if endpoint != 'getUpdates':
+            await release_write_lock()
+        return await super()._do_post(endpoint, data, **kwargs)
+
+class BotContext(CallbackContext):
+    """سياق المعالجات مع جلسة قاعدة البيانات الخاصة بالتحديث"""
+
+    @property
+    def db(self) -> AsyncSession:
+        return current_unit_of_work().session
+
+    @property
+    def read_db(self) -> AsyncSession:
+        """جلسة للقراءة فقط على مجمع اتصالات مستقل (قد لا ترى كتابات هذا التحديث)"""
+        return current_unit_of_work().read_session
+
+class BotApplication(Application):
+    """تطبيق يربط جلسة قاعدة بيانات واحدة بكل تحديث ويحفظها مرة واحدة في النهاية"""
+
+    def add_handler(self, handler, group: int = 0) -> None:
+        # عدد ومدة استدعاءات كل معالج في /metrics
+        super().add_handler(instrument_handler(handler), group)
+
+    async def process_update(self, update: object) -> None:
+        unit = UnitOfWork()
+        token = _current_unit.set(unit)
+        try:
+            await super().process_update(update)
+            try:
+                await unit.commit()
+            except Exception as exc:
+                # لا نعيد رفع الخطأ: مهمة جلب التحديثات في PTB تتوقف نهائياً عند أي استثناء
+                logger.error(f"فشل حفظ تغييرات التحديث: {exc}")
+                await self.process_error(update=update, error=exc)
+        finally:
+            try:
+                await unit.close()
+            except Exception as exc:
+                logger.error(f"فشل إغلاق جلسة التحديث: {exc}")
+            _current_unit.reset(token)
+
+    async def process_error(self, update, error, job=None, coroutine=None) -> bool:
+        # التراجع عن تغييرات المعالج الفاشل قبل أن تحفظها وحدة العمل.
+        # أخطاء Telegram (مثل الرد على زر تمت الإجابة عليه) تحدث بعد اكتمال العمل
+        # في قاعدة البيانات، لذلك لا تلغي التغييرات الصحيحة
+        unit = _current_unit.get()
+        if unit is not None and not isinstance(error, TelegramError):
+            await unit.rollback()
+        return await super().process_error(update, error, job=job, coroutine=coroutine)
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """معالجة التحديثات بالتوازي مع تسلسل تحديثات المستخدم الواحد
+
+    تحديثات نفس المستخدم تنتظر بعضها بترتيب وصولها (قفل لكل مستخدم)، فلا تتداخل خطوات
+    تدفق متعدد المراحل في context.user_data (funding_type ← requested_members ← الرابط)،
+    بينما يعمل المستخدمون المختلفون معاً حتى concurrency تحديث.
+
+    حد PTB الخارجي (max_pending) يشمل المنتظرين على قفل مستخدمهم، لذلك هو أكبر من
+    concurrency: مستخدم يرسل عشرين ضغطة متتالية لا يحجز أماكن التنفيذ عن الآخرين.
+    """
+
+    __slots__ = ('concurrency', '_running', '_locks', 'active', 'waiting')
+
+    def __init__(self, concurrency: int = 16, max_pending: int = 1000):
+        super().__init__(max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self._running = asyncio.Semaphore(concurrency)
+        # {مفتاح: [القفل، عدد التحديثات التي تحمله أو تنتظره]}
+        self._locks = {}
+        self.active = 0
+        self.waiting = 0
+
+    @staticmethod
+    def _key(update):
+        """المستخدم صاحب التحديث، أو المحادثة إن لم يكن له مستخدم (منشورات القنوات)"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine) -> None:
+        key = self._key(update)
+        if key is None:
+            async with self._running:
+                await self._run(coroutine)
+            return
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self.waiting += 1
+        started = False
+        try:
+            async with entry[0]:
+                # مكان التنفيذ يُحجز بعد دور المستخدم فقط
+                async with self._running:
+                    self.waiting -= 1
+                    started = True
+                    await self._run(coroutine)
+        finally:
+            if not started:
+                # أُلغي التحديث وهو ينتظر
+                self.waiting -= 1
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def _run(self, coroutine):
+        self.active += 1
+        try:
+            await coroutine
+        finally:
+            self.active -= 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._locks.clear()
+
+    def collect(self) -> list:
+        """حالة المعالجة لصفحة /metrics"""
+        return [
+            ('bot_updates_in_progress', 'gauge', "Updates being handled now", [({}, self.active)]),
+            ('bot_updates_waiting', 'gauge', "Updates waiting for their user's previous update or a free slot",
+             [({}, self.waiting)]),
+            ('bot_update_concurrency', 'gauge', "Maximum updates handled at once", [({}, self.concurrency)]),
+        ]
@@ -0,0 +1,140 @@
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from config import Config
+from database import User, READ_ONLY_KEY
+from metrics import registry
+
+# المستخدمون الذين تغيرت بياناتهم في الجلسة (يُمسحون من الذاكرة عند commit أو rollback)
+PENDING_KEY = 'user_cache_pending'
+# المستخدمون المحملون خلال التحديث الحالي (جلسة لكل تحديث)، بما فيهم غير الموجودين (None)
+LOADED_KEY = 'user_cache_loaded'
+
+# الحقول التي تحتاجها الشاشات وفحوص الحظر والإشراف
+CACHED_FIELDS = ('user_id', 'username', 'first_name', 'last_name', 'points', 'is_banned', 'ban_reason', 'is_admin', 'bot_blocked', 'created_at')
+
+def _snapshot(user):
+    return SimpleNamespace(**{name: getattr(user, name) for name in CACHED_FIELDS})
+
+class UserCache:
+    """ذاكرة LRU محدودة الحجم لبيانات المستخدمين مع مدة صلاحية
+
+    القيم للقراءة فقط؛ أي تعديل يتم على صف User من الجلسة ثم يستدعي invalidate.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def peek(self, user_id: int):
+        """القيمة المخزنة إن كانت صالحة (بدون استعلام)"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        expires, snapshot = entry
+        if expires < time.monotonic():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return snapshot
+
+    def put(self, user):
+        """تخزين نسخة من صف المستخدم"""
+        self._entries[user.user_id] = (time.monotonic() + self.ttl, _snapshot(user))
+        self._entries.move_to_end(user.user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def get(self, db, user_id: int):
+        """بيانات المستخدم من الذاكرة، أو من قاعدة البيانات عند عدم وجودها"""
+        snapshot = self.peek(user_id)
+        if snapshot is not None:
+            self.hits += 1
+            return snapshot
+        self.misses += 1
+        user = await db.scalar(select(User).filter_by(user_id=user_id).limit(1))
+        if user is None:
+            return None
+        self.put(user)
+        return self._entries[user_id][1]
+
+    async def get_many(self, db, user_ids) -> dict:
+        """تحميل عدة مستخدمين باستعلام IN واحد على الأكثر
+
+        يرجع {user_id: بيانات المستخدم أو None}. ما حُمل سابقاً في نفس التحديث أو موجود
+        في الذاكرة لا يُستعلم عنه، فعدد الاستعلامات ثابت مهما كان عدد الصفوف في الشاشة.
+        """
+        loaded = db.sync_session.info.setdefault(LOADED_KEY, {})
+        # نسخة القراءة قد تتأخر عن الرئيسية فلا نخزن منها في الذاكرة المشتركة
+        read_only = db.sync_session.info.get(READ_ONLY_KEY, False)
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            if user_id is None or user_id in loaded:
+                continue
+            snapshot = self.peek(user_id)
+            if snapshot is not None:
+                self.hits += 1
+                loaded[user_id] = snapshot
+            else:
+                missing.append(user_id)
+
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            self.misses += len(chunk)
+            for user in await db.scalars(select(User).where(User.user_id.in_(chunk))):
+                if read_only:
+                    loaded[user.user_id] = _snapshot(user)
+                    continue
+                self.put(user)
+                loaded[user.user_id] = self._entries[user.user_id][1]
+            for user_id in chunk:
+                loaded.setdefault(user_id, None)
+
+        return {user_id: loaded.get(user_id) for user_id in user_ids if user_id is not None}
+
+    def invalidate(self, *user_ids):
+        for user_id in user_ids:
+            self._entries.pop(user_id, None)
+
+    def invalidate_on_commit(self, db, *user_ids):
+        """مسح المستخدمين الآن وبعد انتهاء المعاملة
+
+        المسح الثاني يمنع بقاء قيمة قرأها معالج آخر قبل الحفظ، أو قيمة غير محفوظة بعد التراجع.
+        """
+        self.invalidate(*user_ids)
+        loaded = db.sync_session.info.get(LOADED_KEY, {})
+        for user_id in user_ids:
+            loaded.pop(user_id, None)
+        db.sync_session.info.setdefault(PENDING_KEY, set()).update((self, user_id) for user_id in user_ids)
+
+    def clear(self):
+        self._entries.clear()
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    for cache, user_id in session.info.pop(PENDING_KEY, ()):
+        cache.invalidate(user_id)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _invalidate_after_rollback(session, previous_transaction):
+    if previous_transaction.nested:
+        # المسح سيتم عند انتهاء المعاملة الكاملة
+        return
+    for cache, user_id in session.info.pop(PENDING_KEY, ()):
+        cache.invalidate(user_id)
+
+user_cache = UserCache(Config.USER_CACHE_SIZE, Config.USER_CACHE_TTL)
+registry.cache('users', user_cache)
@@ -0,0 +1,79 @@
+import hmac
+import json
+import logging
+from aiohttp import web
+from telegram import Update
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# رأس التحقق الذي يرسله تليجرام مع كل تحديث عند ضبط secret_token في setWebhook
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# أنواع التحديثات التي لها معالجات فعلاً (chat_member لتتبع اشتراكات القنوات الإجبارية)
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.CHAT_MEMBER]
+
+APPLICATION_KEY = web.AppKey('bot_application', object)
+SECRET_KEY = web.AppKey('webhook_secret', str)
+METRICS_TOKEN_KEY = web.AppKey('metrics_token', str)
+
+# ==================== المسارات ====================
+async def health(request: web.Request) -> web.Response:
+    """فحص الحياة لخدمات الاستضافة"""
+    application = request.app[APPLICATION_KEY]
+    if not application.running:
+        return web.Response(status=503, text="⏳ Bot is starting")
+    return web.Response(text="🤖 Bot is alive and running!")
+
+async def metrics(request: web.Request) -> web.Response:
+    """مقاييس التشغيل بصيغة Prometheus النصية"""
+    token = request.app[METRICS_TOKEN_KEY]
+    if token and not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {token}".encode()):
+        return web.Response(status=401, headers={'WWW-Authenticate': 'Bearer'})
+    body = await registry.render()
+    return web.Response(text=body, content_type='text/plain', charset='utf-8', headers={'X-Content-Type-Options': 'nosniff'})
+
+async def webhook(request: web.Request) -> web.Response:
+    """استقبال تحديث من تليجرام ووضعه في طابور التطبيق
+
+    الرد فوري: المعالجة تتم في حلقة التطبيق وتليجرام لا ينتظرها.
+    """
+    secret = request.app[SECRET_KEY]
+    if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, '').encode(), secret.encode()):
+        logger.warning(f"رفض طلب webhook برمز تحقق خاطئ من {request.remote}")
+        return web.Response(status=403)
+    try:
+        data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return web.Response(status=400)
+    application = request.app[APPLICATION_KEY]
+    update = Update.de_json(data, application.bot)
+    if update is None:
+        return web.Response(status=400)
+    await application.update_queue.put(update)
+    return web.Response()
+
+# ==================== الخادم ====================
+def create_web_app(application, secret_token: str = '', webhook_path: str = None,
+                   metrics_token: str = '') -> web.Application:
+    """تطبيق HTTP يعمل على حلقة البوت نفسها
+
+    مسارا الصحة والمقاييس متاحان دائماً، ومسار webhook يُضاف فقط عند تحديد webhook_path.
+    """
+    app = web.Application()
+    app[APPLICATION_KEY] = application
+    app[SECRET_KEY] = secret_token
+    app[METRICS_TOKEN_KEY] = metrics_token
+    app.router.add_get('/', health)
+    app.router.add_get('/metrics', metrics)
+    if webhook_path:
+        app.router.add_post(webhook_path, webhook)
+    return app
+
+async def start_web_server(app: web.Application, port: int, host: str = '0.0.0.0') -> web.AppRunner:
+    """تشغيل الخادم؛ يُوقف لاحقاً بـ runner.cleanup()"""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"خادم HTTP يعمل على المنفذ {port}")
+    return runner
@@ -0,0 +1,149 @@
+import asyncio
+import copy
+import logging
+from sqlalchemy import text
+from config import Config
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+class _OperationFailed(Exception):
+    """فشل عملية في المسار السريع: تُعاد الدفعة بنقاط حفظ"""
+
+class WriteQueue:
+    """تجميع الكتابات الصغيرة المتكررة في معاملة واحدة (group commit)
+
+    كل عملية دالة async تستقبل الجلسة: operation(db, *args). العمليات التي تصل خلال
+    delay ثانية تُنفذ في معاملة واحدة، كل منها داخل نقطة حفظ (SAVEPOINT) حتى لا يلغي فشل
+    إحداها الباقي، ثم commit واحد (fsync واحد في SQLite) للدفعة كلها.
+    المستدعي ينتظر نتيجته الخاصة، وتصله بعد نجاح الحفظ فقط.
+    """
+
+    def __init__(self, session_factory=None, delay: float = None, max_batch: int = None):
+        self._session_factory = session_factory
+        self.delay = Config.WRITE_QUEUE_DELAY_MS / 1000 if delay is None else delay
+        self.max_batch = max_batch or Config.WRITE_QUEUE_MAX_BATCH
+        self._queue = asyncio.Queue()
+        self._task = None
+        self.batches = 0
+        self.operations = 0
+
+    def _sessions(self):
+        if self._session_factory is None:
+            from database import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+
+    async def submit(self, operation, *args, **kwargs):
+        """إضافة عملية للدفعة التالية وانتظار نتيجتها بعد الحفظ
+
+        العملية تعمل في جلسة الطابور لا جلسة التحديث؛ لا تُستدعى من معالج كتب في جلسته
+        قبلها (في SQLite ينتظر الطابور قفل الكتابة الذي يحمله المعالج).
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((operation, args, kwargs, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # نافذة التجميع: ننتظر قليلاً لتصل عمليات أخرى
+            await asyncio.sleep(self.delay)
+            stopping = False
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await self._commit_batch(batch)
+            except Exception as exc:
+                logger.error(f"خطأ في دفعة الكتابة: {exc}")
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+            if stopping:
+                return
+
+    async def _commit_batch(self, batch):
+        pending = [item for item in batch if not item[3].done()]
+        if not pending:
+            return
+        # المسار السريع: كل العمليات مباشرة في معاملة واحدة. إذا فشلت إحداها نعيد الدفعة
+        # بنقطة حفظ لكل عملية (العمليات تعمل على قاعدة البيانات فقط فإعادتها آمنة)
+        try:
+            done = await self._execute(pending, isolate=False)
+        except _OperationFailed:
+            done = await self._execute(pending, isolate=True)
+
+        self.batches += 1
+        self.operations += len(done)
+        for future, result in done:
+            if not future.done():
+                future.set_result(result)
+
+    async def _execute(self, batch, isolate: bool) -> list:
+        db = self._sessions()
+        done = []
+        try:
+            if db.get_bind().dialect.name == 'sqlite':
+                # قفل الكتابة من البداية: نقاط الحفظ تحتاج معاملة مفتوحة، وBEGIN IMMEDIATE
+                # ينتظر busy_timeout بدلاً من الفشل عند ترقية قفل القراءة لاحقاً
+                await db.execute(text("BEGIN IMMEDIATE"))
+
+            for operation, args, kwargs, future in batch:
+                if not isolate:
+                    try:
+                        done.append((future, await operation(db, *args, **kwargs)))
+                    except Exception as exc:
+                        raise _OperationFailed() from exc
+                    continue
+                # المستمعون يضعون أعمالهم المؤجلة في session.info (سجل النقاط، العدادات...)
+                # فنعيدها كما كانت إذا تراجعت العملية إلى نقطة الحفظ
+                saved = {key: copy.copy(value) for key, value in db.sync_session.info.items()}
+                try:
+                    async with db.begin_nested():
+                        result = await operation(db, *args, **kwargs)
+                except Exception as exc:
+                    db.sync_session.info.clear()
+                    db.sync_session.info.update(saved)
+                    future.set_exception(exc)
+                else:
+                    done.append((future, result))
+
+            await db.commit()
+        except _OperationFailed:
+            await db.rollback()
+            raise
+        except Exception as exc:
+            await db.rollback()
+            for future, _ in done:
+                if not future.done():
+                    future.set_exception(exc)
+            raise
+        finally:
+            await db.close()
+        return done
+
+    async def close(self):
+        """إيقاف المهمة بعد تنفيذ كل ما في الطابور"""
+        if self._task is not None and not self._task.done():
+            await self._queue.put(None)
+            await self._task
+        self._task = None
+
+write_queue = WriteQueue()
+
+@registry.register
+def _queue_metrics():
+    return [
+        ('bot_write_queue_depth', 'gauge', "Operations waiting for the next group commit", [({}, write_queue._queue.qsize())]),
+        ('bot_write_queue_batches_total', 'counter', "Group commits", [({}, write_queue.batches)]),
+        ('bot_write_queue_operations_total', 'counter', "Operations committed in batches", [({}, write_queue.operations)]),
+    ]